@@ -0,0 +1,422 @@
+import logging
+import queue
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import requests
+
+import config
+import governor
+import resilience
+import scraper
+import sessions
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+Progress = Optional[Callable[[str, List[Dict]], None]]  # called with (date, slots) as days arrive
+
+# Reads need no login: callers may pass session=None to use the shared anonymous pool.
+ANON_SESSIONS = sessions.AnonymousPool(scraper.init_session)
+
+def _broken(e: Exception) -> bool:
+    """A failure that retrying on the same session won't fix (as opposed to the site being down)."""
+    if isinstance(e, (scraper.SessionExpired, ValueError)):  # ValueError: HTML where JSON was expected
+        return True
+    r = getattr(e, "response", None) if isinstance(e, requests.HTTPError) else None
+    return r is not None and 400 <= r.status_code < 500 and r.status_code != 429
+
+def _read(fetch: Callable, session: Optional[requests.Session], *args):
+    """fetch(session, *args) on the caller's session or a pooled one; a pooled session that broke is retired."""
+    sess = session if session is not None else ANON_SESSIONS.get()
+    try:
+        return fetch(sess, *args)
+    except Exception as e:
+        if session is None and _broken(e):
+            logger.info("retiring anonymous session after %s", type(e).__name__)
+            ANON_SESSIONS.retire(sess)
+        raise
+
+# Process-wide, shared by every chat: availability does not depend on who asks.
+
+_SLOTS = TTLCache(config.SLOT_CACHE_TTL_SECONDS, config.SLOT_CACHE_MAX_ENTRIES)    # (branch, service, date) -> slots
+_NEAREST = TTLCache(config.SLOT_CACHE_TTL_SECONDS, config.SLOT_CACHE_MAX_ENTRIES)  # (branch, service, from_date) -> resp
+
+# Change feed: every time a day is (re)observed it is diffed against what we saw
+# before, and subscribers get typed events. Events are queued and delivered on a
+# separate thread, so subscribers never run on (or slow down) a read.
+SLOT_OPENED = "slot_opened"  # times that became free
+SLOT_TAKEN = "slot_taken"    # times that are no longer free
+DAY_EMPTIED = "day_emptied"  # the day had free times and now has none
+
+class SlotEvent(NamedTuple):
+    kind: str
+    branch_id: str
+    service_id: str
+    date: str
+    times: FrozenSet[str]
+
+_SEEN: Dict[Tuple[str, str, str], FrozenSet[str]] = {}  # (branch, service, date) -> free times last observed
+_SEEN_LOCK = threading.Lock()
+_SUBSCRIBERS: List[Tuple[Callable[[SlotEvent], None], Optional[str], Optional[str]]] = []
+_EVENTS: "queue.Queue[SlotEvent]" = queue.Queue()
+_DELIVERY: Optional[threading.Thread] = None
+_DELIVERY_LOCK = threading.Lock()
+
+def subscribe(callback: Callable[[SlotEvent], None], branch_id: Optional[str] = None, service_id: Optional[str] = None):
+    """
+    Call `callback(event)` for every change, optionally only for one branch and/or
+    service. The first observation of a day reports its free times as opened.
+    Callbacks run one at a time on the change feed's delivery thread.
+    """
+    global _DELIVERY
+    _SUBSCRIBERS.append((callback, branch_id, service_id))
+    with _DELIVERY_LOCK:
+        if _DELIVERY is None:
+            _DELIVERY = threading.Thread(target=_deliver, name="slot-events", daemon=True)
+            _DELIVERY.start()
+
+def _deliver():
+    while True:
+        ev = _EVENTS.get()
+        try:
+            for callback, b, s in list(_SUBSCRIBERS):
+                if (b is None or b == ev.branch_id) and (s is None or s == ev.service_id):
+                    try:
+                        callback(ev)
+                    except Exception:
+                        logger.exception("availability subscriber failed on %s", ev)
+        finally:
+            _EVENTS.task_done()
+
+def _slot_times(slots: List[Dict]) -> FrozenSet[str]:
+    """A day's free times under every spelling a slot carries (value and label), as hour filters match them."""
+    return frozenset(t for sl in slots for t in (sl.get("value"), sl.get("label")) if t)
+
+def _observe(branch_id: str, service_id: str, date_dd_mm_yyyy: str, slots: List[Dict]):
+    """Diff a day against its previous observation and queue events for subscribers."""
+    new = _slot_times(slots)
+    with _SEEN_LOCK:
+        old = _SEEN.get((branch_id, service_id, date_dd_mm_yyyy), frozenset())
+        _SEEN[(branch_id, service_id, date_dd_mm_yyyy)] = new
+    if new == old:
+        return
+    events = []
+    if new - old:
+        events.append(SlotEvent(SLOT_OPENED, branch_id, service_id, date_dd_mm_yyyy, new - old))
+    if old - new:
+        events.append(SlotEvent(SLOT_TAKEN, branch_id, service_id, date_dd_mm_yyyy, old - new))
+        if not new:
+            events.append(SlotEvent(DAY_EMPTIED, branch_id, service_id, date_dd_mm_yyyy, old))
+    if _SUBSCRIBERS:
+        for ev in events:
+            _EVENTS.put(ev)
+
+class _TargetIndex:
+    """Inverted views over one (branch, service)'s fetched days: time -> dates, weekday -> dates, date -> count."""
+
+    def __init__(self):
+        self.days: Dict[str, Tuple[int, FrozenSet[str], int]] = {}  # date -> (slot count, times, weekday)
+        self.by_time: Dict[str, Set[str]] = {}
+        self.by_weekday: Dict[int, Set[str]] = {wd: set() for wd in range(7)}
+
+    def put(self, date_dd_mm_yyyy: str, slots: List[Dict]):
+        self.remove(date_dd_mm_yyyy)
+        weekday = datetime.strptime(date_dd_mm_yyyy, "%d-%m-%Y").weekday()
+        times = _slot_times(slots)
+        self.days[date_dd_mm_yyyy] = (len(slots), times, weekday)
+        for t in times:
+            self.by_time.setdefault(t, set()).add(date_dd_mm_yyyy)
+        if slots:
+            self.by_weekday[weekday].add(date_dd_mm_yyyy)
+
+    def remove(self, date_dd_mm_yyyy: str):
+        old = self.days.pop(date_dd_mm_yyyy, None)
+        if old is None:
+            return
+        for t in old[1]:
+            dates = self.by_time.get(t)
+            if dates is not None:
+                dates.discard(date_dd_mm_yyyy)
+                if not dates:
+                    del self.by_time[t]
+        self.by_weekday[old[2]].discard(date_dd_mm_yyyy)
+
+_INDEX: Dict[Tuple[str, str], _TargetIndex] = {}
+_INDEX_LOCK = threading.Lock()
+_INDEX_DAY: Optional[date] = None
+
+def _index(branch_id: str, service_id: str) -> _TargetIndex:
+    global _INDEX_DAY
+    today = date.today()
+    if _INDEX_DAY != today:
+        # once a day, forget days that are already in the past
+        for idx in _INDEX.values():
+            for d in [d for d in idx.days if datetime.strptime(d, "%d-%m-%Y").date() < today]:
+                idx.remove(d)
+        with _SEEN_LOCK:
+            for key in [k for k in _SEEN if datetime.strptime(k[2], "%d-%m-%Y").date() < today]:
+                del _SEEN[key]
+        _INDEX_DAY = today
+    return _INDEX.setdefault((branch_id, service_id), _TargetIndex())
+
+def _store(branch_id: str, service_id: str, date_dd_mm_yyyy: str, slots: List[Dict], observe: bool = True):
+    _SLOTS.set((branch_id, service_id, date_dd_mm_yyyy), slots)
+    with _INDEX_LOCK:
+        _index(branch_id, service_id).put(date_dd_mm_yyyy, slots)
+    if observe:
+        _observe(branch_id, service_id, date_dd_mm_yyyy, slots)
+
+# Versioned snapshot of the whole lookahead window, kept warm by crawler.py.
+# Each (branch, service) carries the time it was crawled; reads fall back to the
+# live site once that is older than SNAPSHOT_MAX_AGE_MINUTES.
+_SNAPSHOT: Dict[str, object] = {"version": 0, "taken_at": 0.0, "targets": {}}
+_SNAPSHOT_LOCK = threading.Lock()
+
+def publish(branch_id: str, service_id: str, days: Dict[str, List[Dict]], taken_at: Optional[float] = None):
+    """Replace one target's window in the snapshot with a fresh crawl (date -> slots, empty days included)."""
+    taken_at = taken_at or time.time()
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT["targets"][(branch_id, service_id)] = {"taken_at": taken_at, "days": dict(days)}
+        _SNAPSHOT["version"] += 1
+        _SNAPSHOT["taken_at"] = taken_at
+    for d, slots in days.items():
+        _observe(branch_id, service_id, d, slots)
+
+def _snapshot_days(branch_id: str, service_id: str, any_age: bool = False) -> Optional[Dict[str, List[Dict]]]:
+    """
+    The target's crawled days if they are fresh enough to answer from (or any_age),
+    else None. The crawler, which builds the snapshot, never reads from it.
+    """
+    if governor.current() == governor.CRAWLER:
+        return None
+    with _SNAPSHOT_LOCK:
+        entry = _SNAPSHOT["targets"].get((branch_id, service_id))
+    if entry is None:
+        return None
+    if not any_age and time.time() - entry["taken_at"] > config.SNAPSHOT_MAX_AGE_MINUTES * 60:
+        return None
+    return entry["days"]
+
+# While the upstream breaker is not closed, interactive reads settle for stale data
+# (expired cache entries, an old snapshot) rather than failing. Tracker and crawler
+# calls never do: they must not act on old data and simply retry next cycle.
+_UPSTREAM_DOWN = (resilience.UpstreamUnavailable, requests.RequestException)
+
+def _degraded() -> bool:
+    return scraper.BREAKER.state != "closed" and governor.current() == governor.INTERACTIVE
+
+def _stale(branch_id: str, service_id: str, date_dd_mm_yyyy: str) -> Tuple[bool, List[Dict]]:
+    if governor.current() != governor.INTERACTIVE:
+        return False, None
+    hit, slots = _SLOTS.lookup((branch_id, service_id, date_dd_mm_yyyy), stale=True)
+    if hit:
+        return hit, slots
+    days = _snapshot_days(branch_id, service_id, any_age=True)
+    if days is not None and date_dd_mm_yyyy in days:
+        return True, days[date_dd_mm_yyyy]
+    return False, None
+
+def snapshot_info() -> Dict[str, object]:
+    with _SNAPSHOT_LOCK:
+        return {"version": _SNAPSHOT["version"], "taken_at": _SNAPSHOT["taken_at"],
+                "targets": len(_SNAPSHOT["targets"])}
+
+def _cached(branch_id: str, service_id: str, date_dd_mm_yyyy: str) -> Tuple[bool, List[Dict]]:
+    hit, slots = _SLOTS.lookup((branch_id, service_id, date_dd_mm_yyyy))
+    if hit:
+        return hit, slots
+    days = _snapshot_days(branch_id, service_id, any_age=_degraded())
+    if days is not None and date_dd_mm_yyyy in days:
+        slots = days[date_dd_mm_yyyy]
+        # already observed when published; must not replay an older state as a change
+        _store(branch_id, service_id, date_dd_mm_yyyy, slots, observe=False)
+        return True, slots
+    return False, None
+
+def slots_for_day(session: Optional[requests.Session], branch_id: str, service_id: str, date_dd_mm_yyyy: str) -> List[Dict]:
+    hit, slots = _cached(branch_id, service_id, date_dd_mm_yyyy)
+    if hit:
+        return slots
+    try:
+        slots = _read(scraper.slots_for_day, session, branch_id, service_id, date_dd_mm_yyyy)
+    except _UPSTREAM_DOWN:
+        hit, slots = _stale(branch_id, service_id, date_dd_mm_yyyy)
+        if not hit:
+            raise
+        logger.info("upstream down, serving stale %s/%s %s", branch_id, service_id, date_dd_mm_yyyy)
+        return slots
+    _store(branch_id, service_id, date_dd_mm_yyyy, slots)
+    return slots
+
+def slots_for_days(session: Optional[requests.Session], branch_id: str, service_id: str,
+                   dates: Iterable[str], progress: Progress = None,
+                   deadline: Optional[float] = None) -> List[Tuple[str, List[Dict]]]:
+    """
+    (date, slots) for every day that could be loaded, in date order; misses are fetched
+    in parallel within `deadline` seconds (default config.SCAN_DEADLINE_SECONDS).
+    """
+    dates = list(dates)
+    cached = {}
+    for d in dates:
+        hit, slots = _cached(branch_id, service_id, d)
+        if hit:
+            cached[d] = slots
+            if progress is not None:
+                progress(d, slots)
+    missing = [d for d in dates if d not in cached]
+    if missing:
+        cached.update(scraper.fan_out(lambda d: slots_for_day(session, branch_id, service_id, d), missing,
+                                      deadline=deadline, on_result=progress))
+    return [(d, cached[d]) for d in dates if d in cached]
+
+def _fresh(session: Optional[requests.Session], branch_id: str, service_id: str, dates: Iterable[str],
+           progress: Progress = None) -> List[str]:
+    """Make sure the given days are cached (fetching misses) and return those that are."""
+    return [d for d, _ in slots_for_days(session, branch_id, service_id, dates, progress)]
+
+def day_counts(session: Optional[requests.Session], branch_id: str, service_id: str,
+               dates: Iterable[str], progress: Progress = None) -> List[Tuple[str, int]]:
+    """(date, free slot count) for the days with openings, in date order."""
+    known = _fresh(session, branch_id, service_id, dates, progress)
+    with _INDEX_LOCK:
+        days = _index(branch_id, service_id).days
+        return [(d, days[d][0]) for d in known if d in days and days[d][0]]
+
+def days_at_time(session: Optional[requests.Session], branch_id: str, service_id: str,
+                 hhmm: str, dates: Iterable[str], progress: Progress = None) -> List[str]:
+    """Days that have a free slot at HH:MM, in date order."""
+    known = _fresh(session, branch_id, service_id, dates, progress)
+    with _INDEX_LOCK:
+        hits = _index(branch_id, service_id).by_time.get(hhmm, set())
+        return [d for d in known if d in hits]
+
+def days_on_weekday(session: Optional[requests.Session], branch_id: str, service_id: str,
+                    weekday: int, dates: Iterable[str], progress: Progress = None) -> List[Tuple[str, int]]:
+    """(date, free slot count) for days with openings falling on `weekday` (0 = Monday)."""
+    known = _fresh(session, branch_id, service_id, dates, progress)
+    with _INDEX_LOCK:
+        idx = _index(branch_id, service_id)
+        hits = idx.by_weekday[weekday]
+        return [(d, idx.days[d][0]) for d in known if d in hits]
+
+def nearest_day(session: Optional[requests.Session], branch_id: str, service_id: str, from_date_dd_mm_yyyy: str) -> Dict:
+    key = (branch_id, service_id, from_date_dd_mm_yyyy)
+    hit, resp = _NEAREST.lookup(key)
+    if hit:
+        return resp
+    try:
+        resp = _read(scraper.nearest_day, session, branch_id, service_id, from_date_dd_mm_yyyy)
+    except _UPSTREAM_DOWN:
+        hit, resp = _NEAREST.lookup(key, stale=True)
+        if not hit or governor.current() != governor.INTERACTIVE:
+            raise
+        logger.info("upstream down, serving stale nearest day for %s/%s", branch_id, service_id)
+        return resp
+    _NEAREST.set(key, resp)
+    data = resp.get("data") or {}
+    if data.get("day") and data.get("slots"):
+        _store(branch_id, service_id, data["day"], data["slots"])
+    return resp
+
+def discover_days(session: Optional[requests.Session], branch_id: str, service_id: str,
+                  dates: List[str], limit: Optional[int] = None,
+                  progress: Progress = None, fallback: bool = True,
+                  settled: Optional[Dict[str, List[Dict]]] = None, deadline: Optional[float] = None,
+                  chain_hits: Optional[int] = None,
+                  chain_seconds: Optional[float] = None) -> List[Tuple[str, List[Dict]]]:
+    """
+    Find the open days of a contiguous window by chaining hqb-nearest-day: each call
+    starts the day after the previous hit, so a mostly empty month costs a handful
+    of requests. Days skipped over are cached as empty. Stops at the end of the
+    window or after `limit` hits. The chain is serial, so a caller in a hurry can
+    cap it at `chain_hits` open days or `chain_seconds`. If the chain stops early
+    (that cap, an error or an inconsistent answer), the days it did not reach are
+    fetched with slots_for_days unless fallback=False. The whole call gives up after
+    `deadline` seconds (default config.SCAN_DEADLINE_SECONDS). `settled`, if given,
+    receives every day the chain resolved, empty ones included.
+    governor.BudgetSpent is passed to the caller.
+    """
+    if not dates:
+        return []
+    limit = limit or config.DISCOVERY_MAX_DAYS
+    started = time.monotonic()
+    deadline = config.SCAN_DEADLINE_SECONDS if deadline is None else deadline
+    chain_end = started + (deadline if chain_seconds is None else min(deadline, chain_seconds))
+    days = _snapshot_days(branch_id, service_id, any_age=_degraded())
+    if days is not None and all(d in days for d in dates):
+        found = [(d, days[d]) for d in dates if days[d]][:limit]
+        for d, slots in found:
+            if progress is not None:
+                progress(d, slots)
+        return found
+    cur = datetime.strptime(dates[0], "%d-%m-%Y").date()
+    end = datetime.strptime(dates[-1], "%d-%m-%Y").date()
+    found: List[Tuple[str, List[Dict]]] = []
+    settled = {} if settled is None else settled
+    try:
+        while cur <= end and len(found) < limit:
+            if (chain_hits is not None and len(found) >= chain_hits) or time.monotonic() >= chain_end:
+                logger.info("discover: %s/%s switching to a scan at %s", branch_id, service_id, cur)
+                break
+            data = nearest_day(session, branch_id, service_id, cur.strftime("%d-%m-%Y")).get("data") or {}
+            day = data.get("day")
+            hit = datetime.strptime(day, "%d-%m-%Y").date() if day else None
+            if hit is not None and hit < cur:
+                logger.warning("discover: nearest day %s before %s, falling back", day, cur)
+                break
+            stop = min(hit - timedelta(days=1), end) if hit else end
+            while cur <= stop:
+                settled[cur.strftime("%d-%m-%Y")] = []
+                _store(branch_id, service_id, cur.strftime("%d-%m-%Y"), [])
+                cur += timedelta(days=1)
+            if hit is None or hit > end:
+                return found
+            slots = data.get("slots") or slots_for_day(session, branch_id, service_id, day)
+            settled[day] = slots
+            _store(branch_id, service_id, day, slots)
+            if slots:
+                found.append((day, slots))
+                if progress is not None:
+                    progress(day, slots)
+            cur = hit + timedelta(days=1)
+    except governor.BudgetSpent:
+        raise
+    except Exception:
+        logger.warning("discover: chain for %s/%s stopped early", branch_id, service_id, exc_info=True)
+    left = deadline - (time.monotonic() - started)
+    if cur > end or len(found) >= limit or not fallback or left <= 0:
+        return found
+    rest = [d for d in dates if datetime.strptime(d, "%d-%m-%Y").date() >= cur]
+    more = slots_for_days(session, branch_id, service_id, rest,
+                          progress and (lambda d, slots: slots and progress(d, slots)), deadline=left)
+    settled.update(more)
+    return found + [(d, slots) for d, slots in more if slots][:limit - len(found)]
+
+def invalidate(branch_id: str, service_id: str, date_dd_mm_yyyy: Optional[str] = None):
+    """Drop cached availability for a target, e.g. after a booking took a slot."""
+    if date_dd_mm_yyyy:
+        _SLOTS.pop((branch_id, service_id, date_dd_mm_yyyy))
+    else:
+        _SLOTS.invalidate(lambda k: k[:2] == (branch_id, service_id))
+    with _INDEX_LOCK:
+        idx = _INDEX.get((branch_id, service_id))
+        if idx is not None:
+            for d in ([date_dd_mm_yyyy] if date_dd_mm_yyyy else list(idx.days)):
+                idx.remove(d)
+    # any nearest-day answer for this target may point at the changed day
+    _NEAREST.invalidate(lambda k: k[:2] == (branch_id, service_id))
+    with _SNAPSHOT_LOCK:
+        entry = _SNAPSHOT["targets"].get((branch_id, service_id))
+        if entry is not None:
+            if date_dd_mm_yyyy:
+                entry["days"].pop(date_dd_mm_yyyy, None)
+            else:
+                del _SNAPSHOT["targets"][(branch_id, service_id)]
+
+def stats() -> Dict[str, Dict[str, object]]:
+    return {"slots": _SLOTS.stats(), "nearest": _NEAREST.stats(), "snapshot": snapshot_info(),
+            "breaker": scraper.BREAKER.stats(), "anon_sessions": ANON_SESSIONS.stats(),
+            "events": {"queued": _EVENTS.qsize()}}
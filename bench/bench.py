@@ -0,0 +1,166 @@
+"""
+Throughput benchmark for the search and tracker paths against bench/fake_rp.py.
+
+    python -m bench.bench --latency 0.08 --scans 30 --trackers 500
+    python -m bench.bench --json > bench.json   # for comparing runs
+
+Reports, per path: upstream requests/s, p50/p99 latency per scan (or per tracker
+poll) and the tracemalloc peak. Caches are dropped before every scan so each one
+really goes upstream. The governor limits default to "unlimited" here so the
+numbers measure the client, not RP_RATE_PER_SEC; set the env vars to override.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from bench.fake_rp import FakeRP
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def configure(rp_url: str):
+    # config reads the environment on import, so this runs before any bot module is imported
+    os.environ["RP_BASE"] = rp_url
+    os.environ["SUPABASE_URL"] = ""  # never touch a real database from a benchmark
+    os.environ.setdefault("TRACKER_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="rodar-bench-"), "trackers.db"))
+    os.environ.setdefault("CATALOG_PATH", os.path.join(tempfile.mkdtemp(prefix="rodar-bench-"), "catalog.json"))
+    os.environ.setdefault("RP_RATE_PER_SEC", "100000")
+    os.environ.setdefault("RP_BURST", "100000")
+    os.environ.setdefault("RP_MAX_CONCURRENCY", "256")
+
+def measure(name: str, rp: FakeRP, jobs: List[Callable[[], object]], parallel: int) -> Dict[str, object]:
+    """Run the jobs on `parallel` threads; latency per job, upstream request rate, peak memory."""
+    latencies: List[float] = []
+    errors: List[BaseException] = []
+
+    def run(job):
+        started = time.perf_counter()
+        try:
+            job()
+        except Exception as e:
+            errors.append(e)
+        latencies.append(time.perf_counter() - started)
+
+    rp.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        list(pool.map(run, jobs))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    requests_ = sum(rp.stats().values())
+    return {
+        "path": name, "jobs": len(jobs), "errors": len(errors), "seconds": round(elapsed, 3),
+        "requests": requests_, "requests_per_sec": round(requests_ / elapsed, 1) if elapsed else 0.0,
+        "p50": round(percentile(latencies, 50), 4), "p99": round(percentile(latencies, 99), 4),
+        "peak_mib": round(peak / 2 ** 20, 2),
+    }
+
+def bench_search(rp: FakeRP, scans: int, parallel: int) -> List[Dict[str, object]]:
+    import availability
+    import catalog
+    import config
+
+    branches, services = catalog.get()
+    targets = [(b, s) for b, _ in branches for s, _ in services]
+    today = datetime.now().date()
+    dates = [(today + timedelta(days=i)).strftime("%d-%m-%Y") for i in range(config.LOOKAHEAD_DAYS)]
+    def scan(b: str, s: str, how: str):
+        def job():
+            availability.invalidate(b, s)
+            if how == "chain":
+                availability.discover_days(None, b, s, dates)
+            elif how == "chain+scan":  # what interactive searches run with DAY_DISCOVERY=chain
+                availability.discover_days(None, b, s, dates, chain_hits=config.DISCOVERY_CHAIN_HITS,
+                                           chain_seconds=config.DISCOVERY_CHAIN_SECONDS)
+            else:
+                availability.day_counts(None, b, s, dates)
+        return job
+
+    out = []
+    for how in ("chain", "chain+scan", "scan"):
+        jobs = [scan(*targets[i % len(targets)], how) for i in range(scans)]
+        out.append(measure(f"search/{how}", rp, jobs, parallel))
+    return out
+
+def bench_trackers(rp: FakeRP, trackers: int, rounds: int) -> List[Dict[str, object]]:
+    import availability
+    import catalog
+    import config
+    import database as db
+    import governor
+    import handlers
+
+    branches, services = catalog.get()
+    targets = [(b, s) for b, _ in branches for s, _ in services]
+    for i in range(trackers):
+        b, s = targets[i % len(targets)]
+        db.set_tracker(900000 + i, b, s, None)
+    polled = db.tracker_targets()
+
+    def poll(b: str, s: str):
+        def job():
+            with governor.priority(governor.TRACKER):
+                handlers.poll_target(None, b, s, db.trackers_for_target(b, s))
+        return job
+
+    out = []
+    for r in range(rounds):
+        for b, s in polled:
+            availability.invalidate(b, s)  # as if a full interval had passed
+        jobs = [poll(b, s) for b, s in polled]
+        res = measure(f"tracker/round{r + 1}", rp, jobs, config.TRACK_MAX_CONCURRENCY)
+        res["trackers"] = trackers
+        out.append(res)
+    return out
+
+def main():
+    p = argparse.ArgumentParser(description="Search and tracker throughput against a local fake roadpolice.am")
+    p.add_argument("--latency", type=float, default=0.05, help="fake upstream latency per request (s)")
+    p.add_argument("--jitter", type=float, default=0.02)
+    p.add_argument("--failure-rate", type=float, default=0.0)
+    p.add_argument("--branches", type=int, default=10)
+    p.add_argument("--services", type=int, default=4)
+    p.add_argument("--open-ratio", type=float, default=0.3)
+    p.add_argument("--scans", type=int, default=20, help="searches per search path")
+    p.add_argument("--parallel", type=int, default=1, help="searches running at once")
+    p.add_argument("--trackers", type=int, default=200)
+    p.add_argument("--rounds", type=int, default=2, help="tracker poll rounds")
+    p.add_argument("--only", choices=("search", "tracker"))
+    p.add_argument("--json", action="store_true", help="print results as JSON")
+    args = p.parse_args()
+
+    rp = FakeRP(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                branches=args.branches, services=args.services, open_ratio=args.open_ratio).start()
+    configure(rp.url)
+    results = []
+    try:
+        if args.only in (None, "search"):
+            results += bench_search(rp, args.scans, args.parallel)
+        if args.only in (None, "tracker"):
+            results += bench_trackers(rp, args.trackers, args.rounds)
+    finally:
+        rp.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    for r in results:
+        print(f"{r['path']:<16} jobs={r['jobs']:<5} errors={r['errors']:<3} "
+              f"p50={r['p50']:.3f}s p99={r['p99']:.3f}s "
+              f"upstream={r['requests']} ({r['requests_per_sec']} req/s) peak={r['peak_mib']} MiB")
+
+if __name__ == "__main__":
+    main()
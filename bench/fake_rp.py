@@ -0,0 +1,279 @@
+"""
+Local stand-in for the roadpolice.am endpoints the bot uses, for benchmarks and
+load tests. Run it on its own and point the bot at it with RP_BASE:
+
+    python -m bench.fake_rp --port 8089 --latency 0.08 --failure-rate 0.01
+    RP_BASE=http://127.0.0.1:8089 python main.py
+
+Availability is deterministic per (seed, branch, service, date); bookings remove
+slots. POSTs need the XSRF token issued with the session cookie, as Laravel does
+(419 otherwise), and sessions can be made to expire to exercise token refresh.
+"""
+import argparse
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+DAY_TIMES = [f"{h:02d}:{m:02d}" for h in range(9, 18) for m in (0, 30)]
+
+class FakeRP:
+    def __init__(self, port: int = 0, lang: str = "hy", latency: float = 0.05, jitter: float = 0.0,
+                 failure_rate: float = 0.0, branches: int = 10, services: int = 4, horizon: int = 60,
+                 open_ratio: float = 0.3, slots_per_day: int = 8, seed: int = 1,
+                 session_ttl: Optional[float] = None, nearest_with_slots: bool = True):
+        self.port = port
+        self.lang = lang
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.branches = [(str(100 + i), f"Branch {i + 1}") for i in range(branches)]
+        self.services = [(str(300 + i), f"Service {i + 1}") for i in range(services)]
+        self.horizon = horizon
+        self.open_ratio = open_ratio
+        self.slots_per_day = slots_per_day
+        self.seed = seed
+        self.session_ttl = session_ttl
+        self.nearest_with_slots = nearest_with_slots
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Tuple[str, float]] = {}  # session id -> (xsrf token, created)
+        self._booked: Set[Tuple[str, str, str, str]] = set()
+        self._counts: Dict[str, int] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # -- data --
+
+    def slots(self, branch_id: str, service_id: str, day: date) -> List[str]:
+        today = date.today()
+        if day < today or day > today + timedelta(days=self.horizon):
+            return []
+        key = f"{self.seed}:{branch_id}:{service_id}:{day.isoformat()}"
+        rng = random.Random(hashlib.sha1(key.encode()).digest())
+        if day.weekday() == 6 or rng.random() >= self.open_ratio:
+            return []
+        times = sorted(rng.sample(DAY_TIMES, rng.randint(1, min(self.slots_per_day, len(DAY_TIMES)))))
+        d = day.strftime("%d-%m-%Y")
+        with self._lock:
+            return [t for t in times if (branch_id, service_id, d, t) not in self._booked]
+
+    def nearest(self, branch_id: str, service_id: str, start: date) -> Optional[Tuple[date, List[str]]]:
+        end = date.today() + timedelta(days=self.horizon)
+        day = max(start, date.today())
+        while day <= end:
+            times = self.slots(branch_id, service_id, day)
+            if times:
+                return day, times
+            day += timedelta(days=1)
+        return None
+
+    def hqb_html(self) -> str:
+        def select(name: str, options: List[Tuple[str, str]]) -> str:
+            opts = "".join(f'<option value="{v}">{label}</option>' for v, label in options)
+            return f'<select name="{name}"><option value="">--</option>{opts}</select>'
+        return (f"<html><body><form>{select('branchId', self.branches)}"
+                f"{select('serviceId', self.services)}</form></body></html>")
+
+    # -- server --
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FakeRP":
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-rp", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def count(self, path: str):
+        with self._lock:
+            self._counts[path] = self._counts.get(path, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self, bookings: bool = False):
+        with self._lock:
+            self._counts.clear()
+            if bookings:
+                self._booked.clear()
+
+    def new_session(self) -> Tuple[str, str]:
+        sid, token = secrets.token_hex(16), secrets.token_urlsafe(30)
+        with self._lock:
+            self._sessions[sid] = (token, time.monotonic())
+        return sid, token
+
+    def session_token(self, sid: Optional[str]) -> Optional[str]:
+        with self._lock:
+            entry = self._sessions.get(sid or "")
+        if entry is None:
+            return None
+        if self.session_ttl is not None and time.monotonic() - entry[1] > self.session_ttl:
+            return None
+        return entry[0]
+
+    def book(self, branch_id: str, service_id: str, d: str, t: str) -> bool:
+        try:
+            day = datetime.strptime(d, "%d-%m-%Y").date()
+        except ValueError:
+            return False
+        if t not in self.slots(branch_id, service_id, day):
+            return False
+        with self._lock:
+            key = (branch_id, service_id, d, t)
+            if key in self._booked:
+                return False
+            self._booked.add(key)
+        return True
+
+def _handler(rp: FakeRP):
+    prefix = f"/{rp.lang}"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _cookies(self) -> Dict[str, str]:
+            out = {}
+            for part in (self.headers.get("Cookie") or "").split(";"):
+                if "=" in part:
+                    k, v = part.strip().split("=", 1)
+                    out[k] = v
+            return out
+
+        def _send(self, status: int, body: str, content_type: str = "application/json",
+                  headers: Optional[Dict[str, str]] = None, cookies: Optional[Dict[str, str]] = None):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            for k, v in (cookies or {}).items():
+                self.send_header("Set-Cookie", f"{k}={v}; Path=/")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _json(self, status: int, obj):
+            self._send(status, json.dumps(obj))
+
+        def _simulate(self, path: str) -> bool:
+            """Count, sleep and maybe fail the request. False if a failure was sent."""
+            rp.count(path)
+            delay = rp.latency + (random.uniform(-rp.jitter, rp.jitter) if rp.jitter else 0)
+            if delay > 0:
+                time.sleep(delay)
+            if rp.failure_rate and random.random() < rp.failure_rate:
+                self._json(500, {"message": "Server Error"})
+                return False
+            return True
+
+        def do_GET(self):
+            path = urlsplit(self.path).path.rstrip("/")
+            if path not in (prefix, f"{prefix}/hqb"):
+                self._json(404, {"message": "Not Found"})
+                return
+            if not self._simulate(path):
+                return
+            cookies = {}
+            if rp.session_token(self._cookies().get("laravel_session")) is None:
+                sid, token = rp.new_session()
+                cookies = {"laravel_session": sid, "XSRF-TOKEN": quote(token)}
+            if path == prefix:
+                self._send(200, "<html><body>roadpolice</body></html>", "text/html", cookies=cookies)
+                return
+            html = rp.hqb_html()
+            etag = '"%s"' % hashlib.md5(html.encode()).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, "", "text/html", headers={"ETag": etag}, cookies=cookies)
+                return
+            self._send(200, html, "text/html", headers={"ETag": etag}, cookies=cookies)
+
+        def do_POST(self):
+            path = urlsplit(self.path).path.rstrip("/")
+            length = int(self.headers.get("Content-Length") or 0)
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+            name = path[len(prefix) + 1:] if path.startswith(prefix + "/") else ""
+            if name not in ("hqb-nearest-day", "hqb-slots-for-day", "hqb-register", "hqb-sw/login", "hqb-sw/verify"):
+                self._json(404, {"message": "Not Found"})
+                return
+            if not self._simulate(path):
+                return
+            token = rp.session_token(self._cookies().get("laravel_session"))
+            sent = self.headers.get("X-CSRF-TOKEN")
+            if token is None or sent is None or unquote(sent) != token:
+                self._json(419, {"message": "CSRF token mismatch."})
+                return
+            b, s, d = form.get("branchId", ""), form.get("serviceId", ""), form.get("date", "")
+            if name == "hqb-sw/login":
+                self._json(200, {"status": "verify", "message": "SMS sent"})
+            elif name == "hqb-sw/verify":
+                self._json(200, {"status": "OK"})
+            elif name == "hqb-register":
+                if rp.book(b, s, d, form.get("slotTime", "")):
+                    self._json(200, {"status": "OK", "pin": str(random.randint(100000, 999999))})
+                else:
+                    self._json(422, {"message": "The selected time is not available."})
+            else:
+                try:
+                    day = datetime.strptime(d, "%d-%m-%Y").date()
+                except ValueError:
+                    self._json(422, {"message": "The date is invalid."})
+                    return
+                if name == "hqb-slots-for-day":
+                    self._json(200, {"data": [{"label": t, "value": t} for t in rp.slots(b, s, day)]})
+                    return
+                hit = rp.nearest(b, s, day)
+                if hit is None:
+                    self._json(200, {"status": "OK", "data": {}})
+                    return
+                data = {"day": hit[0].strftime("%d-%m-%Y")}
+                if rp.nearest_with_slots:
+                    data["slots"] = [{"label": t, "value": t} for t in hit[1]]
+                self._json(200, {"status": "OK", "data": data})
+
+    return Handler
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--port", type=int, default=8089)
+    p.add_argument("--latency", type=float, default=0.05, help="seconds added to every request")
+    p.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random latency")
+    p.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    p.add_argument("--branches", type=int, default=10)
+    p.add_argument("--services", type=int, default=4)
+    p.add_argument("--horizon", type=int, default=60, help="days ahead that can have slots")
+    p.add_argument("--open-ratio", type=float, default=0.3, help="fraction of days with free slots")
+    p.add_argument("--slots-per-day", type=int, default=8)
+    p.add_argument("--session-ttl", type=float, default=None, help="seconds before an XSRF token expires")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    rp = FakeRP(port=args.port, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                branches=args.branches, services=args.services, horizon=args.horizon,
+                open_ratio=args.open_ratio, slots_per_day=args.slots_per_day, seed=args.seed,
+                session_ttl=args.session_ttl).start()
+    print(f"fake roadpolice.am on {rp.url} (RP_BASE={rp.url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        rp.stop()
+
+if __name__ == "__main__":
+    main()
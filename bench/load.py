@@ -0,0 +1,245 @@
+"""
+Concurrent-user load harness: N chats talk to the conversations built by
+handlers.register_dispatcher at the same time, against bench/fake_rp.py.
+
+    python -m bench.load --chats 1,10,25,50 --latency 0.08
+
+Each chat registers (/start, phone, PSN, SMS code) and then runs one /search,
+mixing nearest day + booking, all days, weekday and hour filters. Updates go
+through the Dispatcher's update queue exactly as from Telegram, and the bot's
+replies are captured by an offline Bot. Per concurrency level it reports:
+
+  queue      time from enqueueing an update until the dispatcher picks it up
+  turn       time from enqueueing an update until the bot's final reply to it
+  convo      time for a whole conversation (all turns, no think time)
+  peak       tracemalloc peak while the level ran
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from queue import Queue
+from typing import Callable, Dict, List, Optional, Union
+
+from bench.bench import configure, percentile
+from bench.fake_rp import FakeRP
+
+PARTIAL_MARK = "⏳"  # streamed partial results; the turn is not over yet
+Step = Union[str, Callable[[object], str]]
+
+def _first_button(msg) -> str:
+    return msg.reply_markup.keyboard[0][0].text
+
+def scripts(chat_index: int, services: List[str], branches: List[str]) -> List[List[Step]]:
+    """(registration, search) steps for one chat; searches rotate through the filters."""
+    reg = ["/start", "+37491%06d" % chat_index, "%010d" % (1000000000 + chat_index), "123456"]
+    search: List[Step] = ["/search", "Բոլոր ծառայությունները",
+                          services[chat_index % len(services)], branches[chat_index % len(branches)]]
+    kind = chat_index % 4
+    if kind == 0:
+        search += ["Ամենամոտ օրը", _first_button, f"user{chat_index}@example.com", "Այո"]
+    elif kind == 1:
+        search += ["Բոլոր ազատ օրերը"]
+    elif kind == 2:
+        search += ["Ֆիլտր՝ շաբաթվա օրով", "Չորեքշաբթի"]
+    else:
+        search += ["Ֆիլտր՝ ժամով", "10:00"]
+    return [reg, search]
+
+class Harness:
+    def __init__(self, workers: int, turn_timeout: float):
+        from telegram import Bot, Chat, Message, MessageEntity, Update, User
+        from telegram.ext import Dispatcher, JobQueue, TypeHandler
+
+        import handlers
+
+        harness = self
+        self._tg = (Chat, Message, MessageEntity, Update, User)
+        self.turn_timeout = turn_timeout
+
+        class OfflineBot(Bot):
+            """Records outgoing messages instead of calling the Bot API."""
+
+            def __init__(self):
+                super().__init__(token="123456:offline")
+                self._bot = User(123456, "bench", True, username="bench_bot")
+                self._ids = itertools.count(1)
+
+            def get_me(self, *args, **kwargs):
+                return self._bot
+
+            def send_message(self, chat_id, text, *args, reply_markup=None, **kwargs):
+                msg = Message(next(self._ids), datetime.now(), Chat(chat_id, "private"), text=text,
+                              reply_markup=reply_markup, bot=self)
+                harness._reply(chat_id, msg)
+                return msg
+
+            def edit_message_text(self, text=None, chat_id=None, message_id=None, *args, reply_markup=None, **kwargs):
+                msg = Message(message_id, datetime.now(), Chat(chat_id, "private"), text=text,
+                              reply_markup=reply_markup, bot=self)
+                harness._reply(chat_id, msg)
+                return msg
+
+        self.bot = OfflineBot()
+        self.dp = Dispatcher(self.bot, Queue(), workers=workers, job_queue=JobQueue())
+        self.dp.job_queue.set_dispatcher(self.dp)
+        # picked-up time of every update, recorded before the conversations see it
+        self.dp.add_handler(TypeHandler(Update, self._picked), group=-1)
+        handlers.register_dispatcher(self.dp, self.dp.job_queue)  # job queue is never started
+
+        self._cv = threading.Condition()
+        self._replies: Dict[int, List] = {}
+        self._enqueued: Dict[int, float] = {}
+        self.queue_delays: List[float] = []
+        self._update_ids = itertools.count(1)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self.dp.start, kwargs={"ready": ready}, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        self.dp.stop()
+
+    def _picked(self, update, context):
+        now = time.perf_counter()
+        with self._cv:
+            started = self._enqueued.pop(update.update_id, None)
+            if started is not None:
+                self.queue_delays.append(now - started)
+
+    def _reply(self, chat_id: int, msg):
+        with self._cv:
+            self._replies.setdefault(chat_id, []).append(msg)
+            self._cv.notify_all()
+
+    def _update(self, chat_id: int, text: str):
+        Chat, Message, MessageEntity, Update, User = self._tg
+        entities = [MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text))] if text.startswith("/") else []
+        msg = Message(next(self._update_ids), datetime.now(), Chat(chat_id, "private"),
+                      from_user=User(chat_id, f"user{chat_id}", False), text=text, entities=entities, bot=self.bot)
+        return Update(msg.message_id, message=msg)
+
+    def turn(self, chat_id: int, text: str):
+        """Send one message as the user and wait for the bot's final reply to it."""
+        update = self._update(chat_id, text)
+        with self._cv:
+            seen = len(self._replies.get(chat_id, []))
+            self._enqueued[update.update_id] = time.perf_counter()
+        self.dp.update_queue.put(update)
+        deadline = time.monotonic() + self.turn_timeout
+        with self._cv:
+            while True:
+                for msg in self._replies.get(chat_id, [])[seen:]:
+                    if PARTIAL_MARK not in (msg.text or ""):
+                        return msg
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"chat {chat_id}: no reply to {text!r}")
+                self._cv.wait(left)
+
+    def converse(self, chat_id: int, steps: List[Step]) -> float:
+        started = time.perf_counter()
+        last = None
+        for step in steps:
+            last = self.turn(chat_id, step(last) if callable(step) else step)
+        return time.perf_counter() - started
+
+def run_level(harness: Harness, rp: FakeRP, chats: int, first_chat: int) -> Dict[str, object]:
+    import availability
+    import catalog
+
+    branches, services = catalog.get()
+    for b, _ in branches:
+        for s, _ in services:
+            availability.invalidate(b, s)  # every level starts cold
+    branch_labels = [label for _, label in branches]
+    service_labels = [label for _, label in services]
+
+    harness.queue_delays = []
+    turn_times: List[float] = []
+    convo_times: List[float] = []
+    errors: List[BaseException] = []
+    lock = threading.Lock()
+
+    def user(i: int):
+        chat_id = first_chat + i
+        for steps in scripts(chat_id, service_labels, branch_labels):
+            try:
+                took = harness.converse(chat_id, steps)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                return
+            with lock:
+                convo_times.append(took)
+                turn_times.append(took / len(steps))
+
+    rp.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(chats)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    q = harness.queue_delays
+    return {
+        "chats": chats, "conversations": len(convo_times), "errors": len(errors),
+        "seconds": round(elapsed, 2), "upstream_requests": sum(rp.stats().values()),
+        "queue_p50": round(percentile(q, 50), 4), "queue_p99": round(percentile(q, 99), 4),
+        "queue_max": round(max(q) if q else 0.0, 4),
+        "turn_avg_p50": round(percentile(turn_times, 50), 4), "turn_avg_p99": round(percentile(turn_times, 99), 4),
+        "convo_p50": round(percentile(convo_times, 50), 3), "convo_p99": round(percentile(convo_times, 99), 3),
+        "peak_mib": round(peak / 2 ** 20, 2),
+    }
+
+def main():
+    p = argparse.ArgumentParser(description="Concurrent conversations against a local fake roadpolice.am")
+    p.add_argument("--chats", default="1,5,10,25,50", help="comma-separated concurrency levels")
+    p.add_argument("--workers", type=int, default=4, help="Dispatcher worker threads")
+    p.add_argument("--latency", type=float, default=0.05, help="fake upstream latency per request (s)")
+    p.add_argument("--jitter", type=float, default=0.02)
+    p.add_argument("--failure-rate", type=float, default=0.0)
+    p.add_argument("--branches", type=int, default=10)
+    p.add_argument("--services", type=int, default=4)
+    p.add_argument("--turn-timeout", type=float, default=120.0)
+    p.add_argument("--json", action="store_true", help="print results as JSON")
+    args = p.parse_args()
+
+    rp = FakeRP(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                branches=args.branches, services=args.services).start()
+    configure(rp.url)
+    harness = Harness(args.workers, args.turn_timeout)
+    harness.start()
+    results = []
+    try:
+        first_chat = 10000
+        for n in (int(x) for x in args.chats.split(",")):
+            results.append(run_level(harness, rp, n, first_chat))
+            first_chat += n
+            if not args.json:
+                r = results[-1]
+                print(f"chats={r['chats']:<4} convos={r['conversations']:<4} errors={r['errors']:<3} "
+                      f"queue p50/p99/max={r['queue_p50']:.3f}/{r['queue_p99']:.3f}/{r['queue_max']:.3f}s "
+                      f"turn p50/p99={r['turn_avg_p50']:.3f}/{r['turn_avg_p99']:.3f}s "
+                      f"convo p50/p99={r['convo_p50']:.2f}/{r['convo_p99']:.2f}s "
+                      f"upstream={r['upstream_requests']} peak={r['peak_mib']} MiB", flush=True)
+    finally:
+        harness.stop()
+        rp.stop()
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import requests
+
+import config
+import governor
+import scraper
+
+logger = logging.getLogger(__name__)
+
+# Branch and service lists from /hqb. They almost never change, so we keep them in
+# memory, refresh in the background and fall back to the last good copy on disk.
+_LOCK = threading.Lock()
+_STATE = {"branches": [], "services": [], "etag": None, "last_modified": None, "loaded_at": 0.0}
+_SESSION: Optional[requests.Session] = None
+
+def _load_disk() -> bool:
+    try:
+        with open(config.CATALOG_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception:
+        logger.warning("catalog: unreadable %s", config.CATALOG_PATH, exc_info=True)
+        return False
+    if not data.get("branches") or not data.get("services"):
+        return False
+    _STATE.update(
+        branches=[tuple(x) for x in data["branches"]],
+        services=[tuple(x) for x in data["services"]],
+        etag=data.get("etag"),
+        last_modified=data.get("last_modified"),
+        loaded_at=float(data.get("loaded_at") or 0),
+    )
+    return True
+
+def _save_disk():
+    tmp = config.CATALOG_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_STATE, f, ensure_ascii=False)
+        os.replace(tmp, config.CATALOG_PATH)
+    except Exception:
+        logger.warning("catalog: could not write %s", config.CATALOG_PATH, exc_info=True)
+
+def refresh() -> bool:
+    """Re-fetch /hqb (conditionally). Returns True if the lists changed."""
+    global _SESSION
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+        lists, etag, last_modified = scraper.fetch_catalog(_SESSION, _STATE["etag"], _STATE["last_modified"])
+        _STATE["loaded_at"] = time.time()
+        if lists is None:
+            return False
+        branches, services = lists
+        if not branches or not services:
+            # a broken page must not replace a good copy
+            logger.warning("catalog: /hqb returned empty lists, keeping previous")
+            return False
+        changed = (branches, services) != (_STATE["branches"], _STATE["services"])
+        _STATE.update(branches=branches, services=services, etag=etag, last_modified=last_modified)
+        _save_disk()
+        if changed:
+            logger.info("catalog: %d branches, %d services", len(branches), len(services))
+        return changed
+
+def get() -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """(branches, services) from memory; loads from disk or upstream only on a cold start."""
+    if not _STATE["branches"]:
+        with _LOCK:
+            loaded = _STATE["branches"] or _load_disk()
+        if not loaded:
+            refresh()
+    return _STATE["branches"], _STATE["services"]
+
+def refresh_job(context=None):
+    try:
+        if not _STATE["branches"]:
+            with _LOCK:
+                _load_disk()
+        with governor.priority(governor.CRAWLER):
+            refresh()
+    except Exception:
+        logger.exception("catalog refresh error")
@@ -1,23 +1,109 @@
 import os
+from urllib.parse import urlsplit
 
 # Telegram
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
 PORT = int(os.getenv("PORT", "10000"))
+# In webhook mode /metrics is served on PORT; with polling only if this is set
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 # Supabase (optional)
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 SUPABASE_TABLE = os.getenv("SUPABASE_TABLE", "users")
+SUPABASE_TRACKERS_TABLE = os.getenv("SUPABASE_TRACKERS_TABLE", "trackers")
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "10"))
+# User rows are cached in process; our own writes refresh the cache
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "5000"))
+
+# Local tracker store, used when Supabase is not configured
+TRACKER_DB_PATH = os.getenv("TRACKER_DB_PATH", "trackers.db")
+TRACKER_LOAD_RETRY_SECONDS = int(os.getenv("TRACKER_LOAD_RETRY_SECONDS", "30"))
 
 # RoadPolice site
-RP_BASE = "https://roadpolice.am"
+RP_BASE = os.getenv("RP_BASE", "https://roadpolice.am").rstrip("/")  # e.g. bench/fake_rp.py for local runs
+RP_COOKIE_DOMAIN = urlsplit(RP_BASE).hostname
+RP_COOKIE_SECURE = urlsplit(RP_BASE).scheme == "https"
 RP_LANG = "hy"  # Armenian
+# Global upstream governor: requests/s, burst and requests in flight across the whole bot
+RP_RATE_PER_SEC = float(os.getenv("RP_RATE_PER_SEC", "10"))
+RP_BURST = float(os.getenv("RP_BURST", "20"))
+RP_MAX_CONCURRENCY = int(os.getenv("RP_MAX_CONCURRENCY", "16"))
+RP_LAZY_SESSION = os.getenv("RP_LAZY_SESSION", "1") == "1"  # reuse stored cookies without warm-up GETs
+RP_HTTP2 = os.getenv("RP_HTTP2", "0") == "1"  # async client only; needs the optional `h2` package
+RP_ASYNC_MAX_CONNECTIONS = int(os.getenv("RP_ASYNC_MAX_CONNECTIONS", "50"))
+# A read that joins an identical in-flight read started at a lower priority waits at
+# most this long for it before sending its own request
+RP_SHARED_WAIT_SECONDS = float(os.getenv("RP_SHARED_WAIT_SECONDS", "2"))
+# Transient failures (connection errors, timeouts, 5xx, 429) are retried with jittered
+# exponential backoff; after RP_BREAKER_FAILURES in a row calls fail fast for the cooldown
+RP_RETRIES = int(os.getenv("RP_RETRIES", "2"))
+RP_BACKOFF_BASE = float(os.getenv("RP_BACKOFF_BASE", "0.5"))
+RP_BACKOFF_MAX = float(os.getenv("RP_BACKOFF_MAX", "8"))
+RP_BREAKER_FAILURES = int(os.getenv("RP_BREAKER_FAILURES", "5"))
+RP_BREAKER_COOLDOWN_SECONDS = float(os.getenv("RP_BREAKER_COOLDOWN_SECONDS", "60"))
 
 # Search behavior
 TRACK_INTERVAL_MINUTES = int(os.getenv("TRACK_INTERVAL_MINUTES", "120"))  # refresh every 2h
 LOOKAHEAD_DAYS = int(os.getenv("LOOKAHEAD_DAYS", "30"))
 
+# Tracker scheduler: how often due targets are checked, +/- jitter (fraction of the
+# interval) and how many targets may be polled at once
+TRACK_TICK_SECONDS = int(os.getenv("TRACK_TICK_SECONDS", "15"))
+TRACK_JITTER = float(os.getenv("TRACK_JITTER", "0.1"))
+TRACK_MAX_CONCURRENCY = int(os.getenv("TRACK_MAX_CONCURRENCY", "4"))
+
+# Shared availability cache (slots per branch/service/day)
+SLOT_CACHE_TTL_SECONDS = int(os.getenv("SLOT_CACHE_TTL_SECONDS", "300"))
+SLOT_CACHE_MAX_ENTRIES = int(os.getenv("SLOT_CACHE_MAX_ENTRIES", "20000"))
+
+# Multi-day scans: parallel requests per scan and overall time limit
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "10"))
+SCAN_DEADLINE_SECONDS = float(os.getenv("SCAN_DEADLINE_SECONDS", "45"))
+# How interactive searches find open days. "scan": ask hqb-slots-for-day for every day
+# of the window in parallel (fastest). "chain": chain hqb-nearest-day (few requests on
+# sparse months, but serial), switching to a parallel scan of the rest after
+# DISCOVERY_CHAIN_HITS open days or DISCOVERY_CHAIN_SECONDS. The crawler always chains.
+DAY_DISCOVERY = os.getenv("DAY_DISCOVERY", "scan")
+DISCOVERY_MAX_DAYS = int(os.getenv("DISCOVERY_MAX_DAYS", "50"))
+DISCOVERY_CHAIN_HITS = int(os.getenv("DISCOVERY_CHAIN_HITS", "3"))
+DISCOVERY_CHAIN_SECONDS = float(os.getenv("DISCOVERY_CHAIN_SECONDS", "1.5"))
+# Long searches post partial results and edit them in place as days arrive
+STREAM_RESULTS = os.getenv("STREAM_RESULTS", "1") == "1"
+STREAM_EDIT_SECONDS = float(os.getenv("STREAM_EDIT_SECONDS", "1.5"))
+
+# Background crawler keeping a full availability snapshot warm; interactive reads use
+# the snapshot until it is older than SNAPSHOT_MAX_AGE_MINUTES
+CRAWL_INTERVAL_MINUTES = int(os.getenv("CRAWL_INTERVAL_MINUTES", "120"))
+CRAWL_REQUEST_BUDGET = int(os.getenv("CRAWL_REQUEST_BUDGET", "1500"))
+SNAPSHOT_MAX_AGE_MINUTES = int(os.getenv("SNAPSHOT_MAX_AGE_MINUTES", "150"))
+
+# Branch/service catalog: background refresh period and last-known-good copy on disk
+CATALOG_REFRESH_MINUTES = int(os.getenv("CATALOG_REFRESH_MINUTES", "360"))
+CATALOG_PATH = os.getenv("CATALOG_PATH", "catalog.json")
+
+# Per-chat upstream sessions: LRU cap, idle eviction and keep-alive socket budget
+SESSION_MAX = int(os.getenv("SESSION_MAX", "200"))
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+SESSION_MAX_SOCKETS = int(os.getenv("SESSION_MAX_SOCKETS", "100"))
+SESSION_SWEEP_SECONDS = int(os.getenv("SESSION_SWEEP_SECONDS", "300"))
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "2"))  # keep-alive sockets per chat session
+# Availability reads (searches, trackers, crawler) share a few anonymous sessions
+# instead of the per-chat ones, which are kept for login, verify and booking
+ANON_SESSIONS = int(os.getenv("ANON_SESSIONS", "4"))
+ANON_SESSION_MAX_AGE_SECONDS = int(os.getenv("ANON_SESSION_MAX_AGE_SECONDS", "3600"))
+
+# Outbound alerts: Telegram allows ~30 msg/s overall and ~1 msg/s per chat
+NOTIFY_RATE_PER_SEC = float(os.getenv("NOTIFY_RATE_PER_SEC", "25"))
+NOTIFY_PER_CHAT_SECONDS = float(os.getenv("NOTIFY_PER_CHAT_SECONDS", "1.1"))
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+
+# Conversation steps that call upstream (scans, login, booking) run on their own pool,
+# so cheap steps are never stuck behind them on the dispatcher thread
+HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", "8"))
+
 # Hints
 PHONE_HINT = "Մուտքագրեք ձևաչափով՝ +374XXXXXXXX կամ 0XXXXXXXX"
 EMAIL_HINT = "Մուտքագրեք Ձեր էլ․ փոստը (օր․: name@example.com)"
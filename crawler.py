@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import availability
+import catalog
+import config
+import governor
+
+logger = logging.getLogger(__name__)
+
+class Crawler:
+    """
+    Keeps availability's snapshot warm: walks every branch x service over the
+    lookahead window (chaining hqb-nearest-day, so empty days cost nothing) and
+    publishes each target. A run stops once it has spent `budget`
+    upstream requests (warm-ups and token refreshes included); the next run
+    resumes where it stopped.
+    """
+
+    def __init__(self, budget: int = config.CRAWL_REQUEST_BUDGET):
+        self.budget = budget
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self.last_run: Dict[str, float] = {}
+
+    def _targets(self) -> List[Tuple[str, str]]:
+        branches, services = catalog.get()
+        return [(b, s) for b, _ in branches for s, _ in services]
+
+    def _crawl_target(self, branch_id: str, service_id: str) -> Dict[str, List[Dict]]:
+        today = datetime.now().date()
+        dates = [(today + timedelta(days=i)).strftime("%d-%m-%Y") for i in range(config.LOOKAHEAD_DAYS)]
+        days: Dict[str, List[Dict]] = {}
+        availability.discover_days(None, branch_id, service_id, dates, limit=len(dates),
+                                   fallback=False, settled=days)
+        return days
+
+    def run(self, context=None):
+        if not self._lock.acquire(blocking=False):
+            logger.warning("crawler: previous run still going, skipping")
+            return
+        try:
+            with governor.priority(governor.CRAWLER):
+                self._run()
+        except Exception:
+            logger.exception("crawler run error")
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        targets = self._targets()
+        if not targets:
+            return
+        started = time.time()
+        done = 0
+        with governor.budget(self.budget) as budget:
+            while done < len(targets):
+                b, s = targets[self._cursor % len(targets)]
+                try:
+                    days = self._crawl_target(b, s)
+                except governor.BudgetSpent:
+                    break
+                except Exception:
+                    logger.warning("crawler: %s/%s failed", b, s, exc_info=True)
+                else:
+                    if days:  # a chain that broke off publishes the days it did settle
+                        availability.publish(b, s, days)
+                self._cursor = (self._cursor + 1) % len(targets)
+                done += 1
+        self.last_run = {"started": started, "seconds": round(time.time() - started, 1),
+                         "requests": budget.spent, "targets": done, "of": len(targets)}
+        logger.info("crawler: %s, snapshot %s", self.last_run, availability.snapshot_info())
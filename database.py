@@ -1,9 +1,15 @@
+import heapq
 import json
+import random
+import sqlite3
+import threading
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Set, Tuple
 import httpx
 import logging
 import config
+import metrics
+from cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -20,16 +26,66 @@ def _sb_headers():
         "Prefer": "return=representation",
     }
 
+# One long-lived client for every Supabase call: keep-alive connections instead of a
+# TLS handshake per query. httpx.Client is safe to share between threads.
+_CLIENT: Optional[httpx.Client] = None
+_CLIENT_LOCK = threading.Lock()
+
+def _client() -> httpx.Client:
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = httpx.Client(timeout=15.0, limits=httpx.Limits(
+                    max_connections=config.SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.SUPABASE_MAX_CONNECTIONS))
+    return _CLIENT
+
+# Read-through cache of user rows (None = no such user); upsert_user_fields writes through.
+# Every write bumps the user's generation; a row read or written under an older
+# generation is not cached, so a slow read can't put back what a write replaced.
+_USERS = TTLCache(config.USER_CACHE_TTL_SECONDS, config.USER_CACHE_MAX_ENTRIES)
+_USER_GEN: Dict[str, int] = {}
+_USER_GEN_LOCK = threading.Lock()
+
+def _user_gen(key: str, bump: bool = False) -> int:
+    with _USER_GEN_LOCK:
+        if bump:
+            _USER_GEN[key] = _USER_GEN.get(key, 0) + 1
+            _USERS.pop(key)
+        return _USER_GEN.get(key, 0)
+
+def _user_cache(key: str, user: Optional[Dict[str, Any]], gen: int):
+    with _USER_GEN_LOCK:
+        if _USER_GEN.get(key, 0) == gen:
+            _USERS.set(key, user)
+
+def _sb_call(op: str):
+    """Times a Supabase call; exceptions are counted as errors."""
+    return metrics.timed(metrics.SUPABASE_SECONDS, metrics.SUPABASE_ERRORS, op=op)
+
+def _sb_failed(op: str, r: httpx.Response):
+    metrics.SUPABASE_ERRORS.inc(op=op, error=str(r.status_code))
+
 def get_user(tg_user_id: int) -> Optional[Dict[str, Any]]:
+    """The user's row (a copy, safe to modify) or None."""
+    key = str(tg_user_id)
     if not _USE_SB:
-        return _MEM_USERS.get(str(tg_user_id))
+        user = _MEM_USERS.get(key)
+        return dict(user) if user else None
+    hit, user = _USERS.lookup(key)
+    if hit:
+        return dict(user) if user else None
+    gen = _user_gen(key)
     url = f"{config.SUPABASE_URL}/rest/v1/{config.SUPABASE_TABLE}"
     params = {"select": "*", "tg_user_id": f"eq.{tg_user_id}", "limit": "1"}
-    with httpx.Client(timeout=15.0) as client:
-        r = client.get(url, params=params, headers=_sb_headers())
+    with _sb_call("get_user"):
+        r = _client().get(url, params=params, headers=_sb_headers())
         r.raise_for_status()
         arr = r.json()
-        return arr[0] if arr else None
+    user = arr[0] if arr else None
+    _user_cache(key, user, gen)
+    return dict(user) if user else None
 
 def upsert_user_fields(tg_user_id: int, **fields):
     rec = {"tg_user_id": str(tg_user_id)}
@@ -39,11 +95,27 @@ def upsert_user_fields(tg_user_id: int, **fields):
         cur.update(rec)
         _MEM_USERS[str(tg_user_id)] = cur
         return
+    key = str(tg_user_id)
     url = f"{config.SUPABASE_URL}/rest/v1/{config.SUPABASE_TABLE}"
-    with httpx.Client(timeout=15.0) as client:
-        r = client.post(url, params={"on_conflict": "tg_user_id"}, headers=_sb_headers(), json=rec)
-        if r.status_code not in (200, 201):
-            logger.error("Supabase upsert failed: %s %s", r.status_code, r.text)
+    _user_gen(key, bump=True)  # reads already in flight must not cache the old row
+    try:
+        with _sb_call("upsert_user"):
+            r = _client().post(url, params={"on_conflict": "tg_user_id"}, headers=_sb_headers(), json=rec)
+    finally:
+        gen = _user_gen(key, bump=True)
+    if r.status_code not in (200, 201):
+        _sb_failed("upsert_user", r)
+        logger.error("Supabase upsert failed: %s %s", r.status_code, r.text)
+        return
+    try:
+        rows = r.json()  # Prefer: return=representation gives back the stored row
+    except ValueError:
+        return
+    if isinstance(rows, list) and rows:
+        _user_cache(key, rows[0], gen)  # skipped if another write landed meanwhile
+
+def user_cache_stats() -> Dict[str, int]:
+    return _USERS.stats()
 
 def save_cookies(tg_user_id: int, cookies: Dict[str, str]):
     upsert_user_fields(tg_user_id, cookies=json.dumps(cookies), updated_at=int(time.time()))
@@ -64,15 +136,197 @@ def get_verified(tg_user_id: int) -> bool:
     u = get_user(tg_user_id)
     return bool(u and u.get("verified"))
 
-# Tracker storage (in-memory)
-def set_tracker(chat_id: int, branch_id: str, service_id: str, last_day: Optional[str]):
-    _MEM_TRACKERS[str(chat_id)] = {"branch_id": branch_id, "service_id": service_id, "last_day": last_day}
+# Tracker storage: in-memory indexes over a durable backend (Supabase table when
+# configured, otherwise a local SQLite file). Loaded once, written through on change.
+_TR_LOCK = threading.RLock()  # guards the in-memory state only; no I/O under it
+_TR_WRITE_LOCK = threading.Lock()  # serialises backend writes
+_TR_LOAD_LOCK = threading.Lock()
+_TR_LOADED = False
+_TR_RETRY_AT = 0.0  # after a failed load, next attempt not before this time
+_TR_PAGE = 1000  # PostgREST caps responses (db-max-rows), so load in pages
+_BY_TARGET: Dict[Tuple[str, str], Set[str]] = {}  # (branch, service) -> chat ids
+_NEXT_DUE: Dict[Tuple[str, str], float] = {}      # (branch, service) -> next poll time
+_DUE_HEAP: List[Tuple[float, Tuple[str, str]]] = []  # lazy: entries not matching _NEXT_DUE are stale
+_SQLITE: Optional[sqlite3.Connection] = None
+
+def _sqlite() -> sqlite3.Connection:
+    global _SQLITE
+    if _SQLITE is None:
+        _SQLITE = sqlite3.connect(config.TRACKER_DB_PATH, check_same_thread=False)
+        _SQLITE.execute(
+            "CREATE TABLE IF NOT EXISTS trackers ("
+            "chat_id TEXT PRIMARY KEY, branch_id TEXT NOT NULL, service_id TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        _SQLITE.execute("CREATE INDEX IF NOT EXISTS trackers_target ON trackers (branch_id, service_id)")
+        _SQLITE.commit()
+    return _SQLITE
+
+def _tr_backend_load() -> Dict[str, Dict[str, Any]]:
+    if _USE_SB:
+        url = f"{config.SUPABASE_URL}/rest/v1/{config.SUPABASE_TRACKERS_TABLE}"
+        rows = []
+        while True:
+            params = {"select": "chat_id,data", "order": "chat_id", "limit": _TR_PAGE, "offset": len(rows)}
+            with _sb_call("load_trackers"):
+                r = _client().get(url, params=params, headers=_sb_headers())
+                r.raise_for_status()
+                page = r.json()
+            rows += [(row["chat_id"], row["data"]) for row in page]
+            if len(page) < _TR_PAGE:
+                break
+    else:
+        rows = _sqlite().execute("SELECT chat_id, data FROM trackers").fetchall()
+    return {str(cid): (json.loads(data) if isinstance(data, str) else data) for cid, data in rows}
+
+def _tr_backend_put(chat_id: str, rec: Dict[str, Any]):
+    row = {"chat_id": chat_id, "branch_id": rec["branch_id"], "service_id": rec["service_id"], "data": json.dumps(rec)}
+    if _USE_SB:
+        url = f"{config.SUPABASE_URL}/rest/v1/{config.SUPABASE_TRACKERS_TABLE}"
+        with _sb_call("put_tracker"):
+            r = _client().post(url, params={"on_conflict": "chat_id"},
+                            headers={**_sb_headers(), "Prefer": "resolution=merge-duplicates"}, json=row)
+            if r.status_code not in (200, 201, 204):
+                _sb_failed("put_tracker", r)
+                logger.error("Supabase tracker upsert failed: %s %s", r.status_code, r.text)
+        return
+    db = _sqlite()
+    db.execute("INSERT OR REPLACE INTO trackers (chat_id, branch_id, service_id, data) VALUES (?, ?, ?, ?)",
+               (row["chat_id"], row["branch_id"], row["service_id"], row["data"]))
+    db.commit()
+
+def _tr_backend_delete(chat_id: str):
+    if _USE_SB:
+        url = f"{config.SUPABASE_URL}/rest/v1/{config.SUPABASE_TRACKERS_TABLE}"
+        with _sb_call("delete_tracker"):
+            r = _client().delete(url, params={"chat_id": f"eq.{chat_id}"}, headers=_sb_headers())
+            if r.status_code not in (200, 204):
+                _sb_failed("delete_tracker", r)
+                logger.error("Supabase tracker delete failed: %s %s", r.status_code, r.text)
+        return
+    db = _sqlite()
+    db.execute("DELETE FROM trackers WHERE chat_id = ?", (chat_id,))
+    db.commit()
+
+def _tr_flush(chat_id: str):
+    """Write one tracker's current in-memory state (or its absence) to the backend."""
+    with _TR_WRITE_LOCK:
+        with _TR_LOCK:
+            rec = _MEM_TRACKERS.get(chat_id)
+        if rec is None:
+            _tr_backend_delete(chat_id)
+        else:
+            _tr_backend_put(chat_id, rec)
+
+def _set_due(target: Tuple[str, str], ts: float):
+    _NEXT_DUE[target] = ts
+    heapq.heappush(_DUE_HEAP, (ts, target))
+
+def _index_add(chat_id: str, rec: Dict[str, Any], due: float):
+    target = (rec["branch_id"], rec["service_id"])
+    subs = _BY_TARGET.get(target)
+    if subs is None:
+        subs = _BY_TARGET[target] = set()
+        _set_due(target, due)
+    subs.add(chat_id)
+
+def _index_remove(chat_id: str, rec: Dict[str, Any]):
+    target = (rec["branch_id"], rec["service_id"])
+    subs = _BY_TARGET.get(target)
+    if subs is None:
+        return
+    subs.discard(chat_id)
+    if not subs:
+        del _BY_TARGET[target]
+        _NEXT_DUE.pop(target, None)
+
+def _ensure_trackers():
+    global _TR_LOADED, _TR_RETRY_AT
+    if _TR_LOADED or time.time() < _TR_RETRY_AT:
+        return
+    with _TR_LOAD_LOCK:
+        if _TR_LOADED or time.time() < _TR_RETRY_AT:
+            return
+        try:
+            loaded = _tr_backend_load()
+        except Exception:
+            # serve what is in memory and try again later rather than staying empty
+            logger.exception("tracker store load failed, retrying in %ss", config.TRACKER_LOAD_RETRY_SECONDS)
+            _TR_RETRY_AT = time.time() + config.TRACKER_LOAD_RETRY_SECONDS
+            return
+        with _TR_LOCK:
+            for chat_id, rec in loaded.items():
+                if chat_id not in _MEM_TRACKERS:  # changed while the load was pending: memory wins
+                    _MEM_TRACKERS[chat_id] = rec
+                    _index_add(chat_id, rec, 0)
+            # after a restart, spread the first polls over one interval instead of a burst,
+            # each at a random point of its own slot so restarts don't repeat the same grid
+            now = time.time()
+            targets = sorted(_BY_TARGET)
+            for i, target in enumerate(targets):
+                _set_due(target, now + (i + random.random()) * config.TRACK_INTERVAL_MINUTES * 60 / len(targets))
+            _TR_LOADED = True
+
+def set_tracker(chat_id: int, branch_id: str, service_id: str, last_day: Optional[str], **extra):
+    _ensure_trackers()
+    key = str(chat_id)
+    with _TR_LOCK:
+        old = _MEM_TRACKERS.get(key)
+        rec = dict(old or {})
+        rec.update(extra, branch_id=branch_id, service_id=service_id, last_day=last_day)
+        if old == rec:
+            return
+        if old and (old["branch_id"], old["service_id"]) != (branch_id, service_id):
+            _index_remove(key, old)
+        _MEM_TRACKERS[key] = rec
+        _index_add(key, rec, time.time())
+    _tr_flush(key)
 
 def get_tracker(chat_id: int) -> Optional[Dict[str, Any]]:
+    _ensure_trackers()
     return _MEM_TRACKERS.get(str(chat_id))
 
 def clear_tracker(chat_id: int):
-    _MEM_TRACKERS.pop(str(chat_id), None)
+    _ensure_trackers()
+    key = str(chat_id)
+    with _TR_LOCK:
+        rec = _MEM_TRACKERS.pop(key, None)
+        if rec is not None:
+            _index_remove(key, rec)
+        elif _TR_LOADED:
+            return
+    _tr_flush(key)  # also when not loaded yet: the row may only exist in the backend
 
 def get_all_trackers() -> Dict[str, Dict[str, Any]]:
-    return dict(_MEM_TRACKERS)
+    _ensure_trackers()
+    with _TR_LOCK:
+        return dict(_MEM_TRACKERS)
+
+def tracker_targets() -> List[Tuple[str, str]]:
+    _ensure_trackers()
+    with _TR_LOCK:
+        return list(_BY_TARGET)
+
+def trackers_for_target(branch_id: str, service_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+    _ensure_trackers()
+    with _TR_LOCK:
+        return [(int(cid), _MEM_TRACKERS[cid]) for cid in _BY_TARGET.get((branch_id, service_id), ())]
+
+def due_targets(now: Optional[float] = None) -> List[Tuple[Tuple[str, str], float]]:
+    """
+    Claim the targets whose next poll time has passed, as ((branch, service), due).
+    A claimed target is not returned again until set_target_due() reschedules it.
+    """
+    _ensure_trackers()
+    now = time.time() if now is None else now
+    out = []
+    with _TR_LOCK:
+        while _DUE_HEAP and _DUE_HEAP[0][0] <= now:
+            ts, target = heapq.heappop(_DUE_HEAP)
+            if _NEXT_DUE.get(target) == ts:
+                out.append((target, ts))
+    return out
+
+def set_target_due(branch_id: str, service_id: str, ts: float):
+    with _TR_LOCK:
+        if (branch_id, service_id) in _BY_TARGET:
+            _set_due((branch_id, service_id), ts)
@@ -0,0 +1,143 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import config
+from ratelimit import TokenBucket
+
+# Priority classes, lower goes first
+INTERACTIVE = 0  # a user is waiting on a handler
+TRACKER = 1      # tracker polls
+CRAWLER = 2      # background snapshot crawl
+_NAMES = {INTERACTIVE: "interactive", TRACKER: "tracker", CRAWLER: "crawler"}
+
+_PRIORITY: contextvars.ContextVar = contextvars.ContextVar("rp_priority", default=INTERACTIVE)
+
+@contextmanager
+def priority(level: int):
+    """Run upstream calls made in this block (and in scans started from it) at `level`."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+def current() -> int:
+    """Priority class of the calling context."""
+    return _PRIORITY.get()
+
+class BudgetSpent(Exception):
+    """The enclosing budget() block has used up its upstream requests."""
+
+class Budget:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def charge(self):
+        with self._lock:
+            if self.spent >= self.limit:
+                raise BudgetSpent()
+            self.spent += 1
+
+_BUDGET: contextvars.ContextVar = contextvars.ContextVar("rp_budget", default=None)
+
+@contextmanager
+def budget(limit: int):
+    """
+    Allow at most `limit` upstream requests in this block (and in scans started from
+    it), warm-ups, token refreshes and retries included; the next one raises BudgetSpent.
+    """
+    b = Budget(limit)
+    token = _BUDGET.set(b)
+    try:
+        yield b
+    finally:
+        _BUDGET.reset(token)
+
+def charge():
+    """Count one upstream request against the calling context's budget, if any."""
+    b = _BUDGET.get()
+    if b is not None:
+        b.charge()
+
+class Governor:
+    """
+    Global limit on upstream traffic: a token bucket (requests/s) plus a cap on
+    requests in flight. Waiters are served strictly by priority class, FIFO within
+    a class, so interactive calls jump ahead of queued tracker/crawler calls.
+    """
+
+    def __init__(self, rate: float = config.RP_RATE_PER_SEC, burst: float = config.RP_BURST,
+                 max_concurrency: int = config.RP_MAX_CONCURRENCY):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self._cv = threading.Condition()
+        self._queue = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._waits: Dict[int, Dict[str, float]] = {
+            p: {"queued": 0, "requests": 0, "wait_total": 0.0, "wait_max": 0.0} for p in _NAMES
+        }
+
+    def acquire(self, level: int = None) -> float:
+        level = _PRIORITY.get() if level is None else level
+        me = (level, next(self._seq))
+        started = time.monotonic()
+        with self._cv:
+            heapq.heappush(self._queue, me)
+            self._waits[level]["queued"] += 1
+            try:
+                while True:
+                    timeout = None
+                    if self._queue[0] == me and self._inflight < self.max_concurrency:
+                        timeout = self.bucket.try_take()
+                        if not timeout:
+                            break
+                    self._cv.wait(timeout)
+            except BaseException:
+                self._queue.remove(me)
+                heapq.heapify(self._queue)
+                self._waits[level]["queued"] -= 1
+                self._cv.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._inflight += 1
+            waited = time.monotonic() - started
+            w = self._waits[level]
+            w["queued"] -= 1
+            w["requests"] += 1
+            w["wait_total"] += waited
+            w["wait_max"] = max(w["wait_max"], waited)
+            self._cv.notify_all()  # the next in line may be able to go too
+        return waited
+
+    def release(self):
+        with self._cv:
+            self._inflight -= 1
+            self._cv.notify_all()
+
+    @contextmanager
+    def slot(self, level: int = None):
+        self.acquire(level)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, object]:
+        with self._cv:
+            per_class = {}
+            for p, w in self._waits.items():
+                per_class[_NAMES[p]] = {
+                    "queued": w["queued"],
+                    "requests": w["requests"],
+                    "wait_avg": round(w["wait_total"] / w["requests"], 3) if w["requests"] else 0.0,
+                    "wait_max": round(w["wait_max"], 3),
+                }
+            return {"inflight": self._inflight, "queue_depth": len(self._queue), "classes": per_class}
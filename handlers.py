@@ -1,9 +1,12 @@
 import logging
 import re
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, Tuple, List
 
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest
 from telegram.ext import (
     CallbackContext, ConversationHandler, CommandHandler, MessageHandler, Filters
 )
@@ -11,6 +14,14 @@ from telegram.ext import (
 import config
 import database as db
 import scraper
+import availability
+import catalog
+import crawler
+import metrics
+import notifier
+import scheduler
+import sessions
+import workers
 import keyboards as kb
 
 logger = logging.getLogger(__name__)
@@ -18,17 +29,17 @@ logger = logging.getLogger(__name__)
 # States
 REG_PHONE, REG_PSN, REG_SMS, MENU_EXAM, MENU_SERVICE, MENU_BRANCH, MENU_FILTER, MENU_WEEKDAY, MENU_DATE, MENU_HOUR, MENU_TIMES, ASK_EMAIL, CONFIRM_BOOK = range(13)
 
-USER_SESS = {}  # chat_id -> requests.Session
 CTX: Dict[int, Dict[str, Any]] = {}
 
-def _get_session(chat_id: int):
-    sess = USER_SESS.get(chat_id)
-    if sess:
-        return sess
+def _new_session(chat_id: int):
     cookies = db.load_cookies(chat_id)
-    sess = scraper.init_session(seed_cookies=cookies if cookies else None)
-    USER_SESS[chat_id] = sess
-    return sess
+    # login, verify and booking only (reads go through the anonymous pool): a small pool is enough
+    return scraper.init_session(seed_cookies=cookies if cookies else None, pool_maxsize=config.SESSION_POOL_SIZE)
+
+SESSIONS = sessions.SessionManager(_new_session)  # chat_id -> requests.Session
+
+def _get_session(chat_id: int):
+    return SESSIONS.get(chat_id)
 
 def _validate_phone(s: str) -> bool:
     return bool(re.fullmatch(r"(\+374\d{8}|0\d{8})", s))
@@ -42,12 +53,89 @@ def _validate_email(s: str) -> bool:
 def _today_ddmmYYYY():
     return datetime.now().strftime("%d-%m-%Y")
 
-def _iter_dates(n_days: int):
+def _iter_days(n_days: int):
     base = datetime.now()
     for i in range(n_days):
-        d = base + timedelta(days=i)
+        yield base + timedelta(days=i)
+
+def _iter_dates(n_days: int):
+    for d in _iter_days(n_days):
         yield d.strftime("%d-%m-%Y")
 
+class _StreamReply:
+    """
+    Progressive answer for long scans: the first day with openings is posted right
+    away, later days edit that message in place at most every STREAM_EDIT_SECONDS
+    (lines arriving in between are flushed by a timer) and finish() sets the final
+    text. Errors talking to Telegram never abort the scan feeding add().
+    """
+
+    def __init__(self, message, header: str, line):
+        self.message = message
+        self.header = header
+        self.line = line  # (date, slots) -> text or None
+        self.lines: Dict[str, str] = {}
+        self.sent = None
+        self.last_edit = 0.0
+        self.done = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, date: str, slots: List[Dict]):
+        try:
+            text = self.line(date, slots) if config.STREAM_RESULTS else None
+            if not text:
+                return
+            with self._lock:
+                if self.done:
+                    return
+                if workers.cancelled():  # /cancel: leave what was posted, edit no more
+                    self.done = True
+                    if self._timer is not None:
+                        self._timer.cancel()
+                    return
+                self.lines[date] = text
+                wait = self.last_edit + config.STREAM_EDIT_SECONDS - time.monotonic()
+                if wait <= 0:
+                    self._flush()
+                elif self._timer is None:
+                    self._timer = threading.Timer(wait, self._on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+        except Exception:
+            logger.warning("stream reply: progress update failed", exc_info=True)
+
+    def finish(self, text: str):
+        with self._lock:
+            self.done = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._show(text)
+
+    def _on_timer(self):
+        try:
+            with self._lock:
+                self._timer = None
+                if not self.done:
+                    self._flush()
+        except Exception:
+            logger.warning("stream reply: progress update failed", exc_info=True)
+
+    def _flush(self):
+        ordered = sorted(self.lines, key=lambda d: datetime.strptime(d, "%d-%m-%Y"))[:50]
+        self._show(self.header + "\n" + "\n".join(self.lines[d] for d in ordered) + "\n\n⏳ Որոնումը շարունակվում է…")
+
+    def _show(self, text: str):
+        self.last_edit = time.monotonic()
+        try:
+            if self.sent is None:
+                self.sent = self.message.reply_text(text)
+            else:
+                self.sent.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning("stream reply: %s", e)
+
 # ------------- Registration -------------
 
 def cmd_start(update: Update, context: CallbackContext):
@@ -88,6 +176,7 @@ def reg_phone(update: Update, context: CallbackContext):
     update.message.reply_text("Մուտքագրեք Ձեր ՊՍՀ/սոց քարտի 10-նիշ համարանիշը։")
     return REG_PSN
 
+@workers.long_running
 def reg_psn(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -97,17 +186,23 @@ def reg_psn(update: Update, context: CallbackContext):
     if not _validate_psn(psn):
         update.message.reply_text("Խնդրում ենք մուտքագրել ճիշտ 10-նիշ համար (օր․ 1234567890)։")
         return REG_PSN
+    workers.checkpoint()  # the login sends an SMS
     C["psn"] = psn
 
     try:
         resp = scraper.login(sess, psn=psn, phone=C["phone"], country="374")
     except Exception:
         logger.exception("login error")
+        workers.checkpoint()
         update.message.reply_text("Սխալ՝ սերվերի հետ կապը չստացվեց։ Փորձեք նորից /start")
         return ConversationHandler.END
 
+    # the login went through: report it even if /cancel came in meanwhile
     text_resp = str(resp).lower()
     if "verify" in text_resp or "sms" in text_resp or "token" in text_resp:
+        if workers.cancelled():
+            update.message.reply_text("ՍՄՍ կոդն արդեն ուղարկվել էր, բայց գործընթացը դադարեցվեց։ Սկսեք նորից՝ /start")
+            return ConversationHandler.END
         update.message.reply_text("ՍՄՍ կոդը ուղարկվեց։ Մուտքագրեք ստացած կոդը (մինչև 8 թվանշան)։")
         return REG_SMS
 
@@ -116,6 +211,7 @@ def reg_psn(update: Update, context: CallbackContext):
     update.message.reply_text("Մուտք հաջողվեց ✅ Օգտագործեք /search՝ որոնելու համար։")
     return ConversationHandler.END
 
+@workers.long_running
 def reg_code(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -123,10 +219,12 @@ def reg_code(update: Update, context: CallbackContext):
     if not re.fullmatch(r"\d{3,8}", code):
         update.message.reply_text("Մուտքագրեք ճիշտ կոդ (մինչև 8 թվանշան)։")
         return REG_SMS
+    workers.checkpoint()
     try:
         _ = scraper.verify(sess, code)
     except Exception:
         logger.exception("verify error")
+        workers.checkpoint()
         update.message.reply_text("Սխալ՝ հաստատումը չհաջողվեց։ Փորձեք կրկին /start")
         return ConversationHandler.END
 
@@ -136,9 +234,21 @@ def reg_code(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 def cancel(update: Update, context: CallbackContext):
+    workers.cancel(update.effective_chat.id)
     update.message.reply_text("Գործընթացը դադարեցվեց։")
     return ConversationHandler.END
 
+def cancel_running(update: Update, context: CallbackContext):
+    """WAITING state /cancel: the running step stops at its next checkpoint; a request already sent completes."""
+    workers.cancel(update.effective_chat.id)
+    update.message.reply_text("Գործընթացը դադարեցվեց։ Եթե մուտքի կամ ամրագրման հարցումն արդեն ուղարկվել էր, "
+                              "այն կավարտվի, և արդյունքը կստանաք։")
+    return ConversationHandler.END
+
+def still_working(update: Update, context: CallbackContext):
+    """WAITING state: a long-running step of this chat is still on the worker pool."""
+    update.effective_message.reply_text("⏳ Հարցումը դեռ ընթացքում է… Սպասեք կամ /cancel՝ դադարեցնելու համար։")
+
 # ------------- Search & booking -------------
 
 def cmd_search(update: Update, context: CallbackContext):
@@ -148,19 +258,21 @@ def cmd_search(update: Update, context: CallbackContext):
     update.message.reply_text("Ընտրեք քննության տեսակը․", reply_markup=kb.exam_type_kb())
     return MENU_EXAM
 
+@workers.long_running
 def pick_exam(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     choice = (update.message.text or "").strip()
 
     try:
-        branches, services = scraper.fetch_branches_and_services(sess)
+        branches, services = catalog.get()
     except Exception:
         logger.exception("fetch lists error")
+        workers.checkpoint()
         update.message.reply_text("Չհաջողվեց ստանալ ցանկերը։ Փորձեք կրկին /search")
         return ConversationHandler.END
 
+    workers.checkpoint()
     C["flow"]["branches"] = branches
     C["flow"]["services_all"] = services
 
@@ -204,19 +316,20 @@ def pick_branch(update: Update, context: CallbackContext):
 
 def _do_nearest(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
     try:
-        resp = scraper.nearest_day(sess, b, s, _today_ddmmYYYY())
+        resp = availability.nearest_day(None, b, s, _today_ddmmYYYY())
         day = resp.get("data", {}).get("day")
         slots = resp.get("data", {}).get("slots") or []
     except Exception:
         logger.exception("nearest error")
+        workers.checkpoint()
         update.message.reply_text("Չհաջողվեց ստանալ ամենամոտ օրը։")
         return ConversationHandler.END
 
+    workers.checkpoint()
     if not day or not slots:
         update.message.reply_text("Ամենամոտ օր չի գտնվել։ Փորձեք «Բոլոր ազատ օրերը»։")
         return ConversationHandler.END
@@ -228,27 +341,29 @@ def _do_nearest(update: Update, context: CallbackContext):
 
 def _do_all_days(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
-    found: List[Tuple[str,int]] = []
-    try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            slots = scraper.slots_for_day(sess, b, s, d)
-            if slots:
-                found.append((d, len(slots)))
-    except Exception:
-        logger.exception("list days error")
+    stream = _StreamReply(update.message, "Առկա օրեր՝", lambda d, sl: sl and f"• {d} — {len(sl)} ազատ ժամ")
+    dates = list(_iter_dates(config.LOOKAHEAD_DAYS))
+    if config.DAY_DISCOVERY == "chain":
+        days = availability.discover_days(None, b, s, dates, progress=stream.add,
+                                          chain_hits=config.DISCOVERY_CHAIN_HITS,
+                                          chain_seconds=config.DISCOVERY_CHAIN_SECONDS)
+        found: List[Tuple[str,int]] = [(d, len(slots)) for d, slots in days]
+    else:
+        found = availability.day_counts(None, b, s, dates, progress=stream.add)
 
+    workers.checkpoint()
     if not found:
-        update.message.reply_text("Մոտակա օրերի ազատ ժամեր չկան։ Փորձեք փոխել ֆիլտրերը։")
+        stream.finish("Մոտակա օրերի ազատ ժամեր չկան։ Փորձեք փոխել ֆիլտրերը։")
         return ConversationHandler.END
 
     lines = [f"• {d} — {cnt} ազատ ժամ" for d, cnt in found[:50]]
-    update.message.reply_text("Առկա օրեր՝\n" + "\n".join(lines) + "\n\nՕգտ․ «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
+    stream.finish("Առկա օրեր՝\n" + "\n".join(lines) + "\n\nՕգտ․ «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
     return ConversationHandler.END
 
+@workers.long_running
 def pick_filter(update: Update, context: CallbackContext):
     choice = (update.message.text or "").strip()
     if choice == "Ֆիլտր՝ շաբաթվա օրով":
@@ -268,10 +383,10 @@ def pick_filter(update: Update, context: CallbackContext):
         update.message.reply_text("Խնդրում ենք ընտրել առաջարկված տարբերակներից։")
         return MENU_FILTER
 
+@workers.long_running
 def pick_weekday(update: Update, context: CallbackContext):
     wd_map = {"Երկուշաբթի":0,"Երեքշաբթի":1,"Չորեքշաբթի":2,"Հինգշաբթի":3,"Ուրբաթ":4,"Շաբաթ":5,"Կիրակի":6}
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
     label = (update.message.text or "").strip()
@@ -280,29 +395,23 @@ def pick_weekday(update: Update, context: CallbackContext):
         return MENU_WEEKDAY
     want = wd_map[label]
 
-    found = []
-    try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            dt = datetime.strptime(d, "%d-%m-%Y")
-            if dt.weekday() != want:
-                continue
-            slots = scraper.slots_for_day(sess, b, s, d)
-            if slots:
-                found.append((d, len(slots)))
-    except Exception:
-        logger.exception("weekday list error")
+    dates = [d.strftime("%d-%m-%Y") for d in _iter_days(config.LOOKAHEAD_DAYS) if d.weekday() == want]
+    stream = _StreamReply(update.message, f"{label} օրերին առկա օրեր՝",
+                          lambda d, sl: sl and f"• {d} — {len(sl)} ազատ ժամ")
+    found = availability.days_on_weekday(None, b, s, want, dates, progress=stream.add)
 
+    workers.checkpoint()
     if not found:
-        update.message.reply_text("Տվյալ շաբաթվա օրով ազատ ժամեր չկան։")
+        stream.finish("Տվյալ շաբաթվա օրով ազատ ժամեր չկան։")
         return ConversationHandler.END
 
     lines = [f"• {d} — {cnt} ազատ ժամ" for d, cnt in found[:50]]
-    update.message.reply_text(f"{label} օրերին առկա օրեր՝\n" + "\n".join(lines) + "\n\nՕգտ․ «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
+    stream.finish(f"{label} օրերին առկա օրեր՝\n" + "\n".join(lines) + "\n\nՕգտ․ «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
     return ConversationHandler.END
 
+@workers.long_running
 def pick_date(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
     d = (update.message.text or "").strip()
@@ -310,12 +419,14 @@ def pick_date(update: Update, context: CallbackContext):
         update.message.reply_text(f"Ամսաթիվը սխալ է։ {config.DATE_FORMAT_HINT}")
         return MENU_DATE
     try:
-        slots = scraper.slots_for_day(sess, b, s, d)
+        slots = availability.slots_for_day(None, b, s, d)
     except Exception:
         logger.exception("slots day error")
+        workers.checkpoint()
         update.message.reply_text("Չստացվեց բեռնել ժամերը։")
         return ConversationHandler.END
 
+    workers.checkpoint()
     if not slots:
         update.message.reply_text(f"{d} օրով ազատ ժամ չկա։ Փորձեք այլ օր։")
         return ConversationHandler.END
@@ -325,9 +436,9 @@ def pick_date(update: Update, context: CallbackContext):
     update.message.reply_text(f"{d} օրվա ազատ ժամերը՝ Ընտրեք ժամը։", reply_markup=kb.times_kb(slots))
     return MENU_TIMES
 
+@workers.long_running
 def pick_hour_filter(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
     hhmm = (update.message.text or "").strip()
@@ -335,20 +446,22 @@ def pick_hour_filter(update: Update, context: CallbackContext):
         update.message.reply_text(f"Ժամի ֆորմատը սխալ է։ {config.HOUR_FORMAT_HINT}")
         return MENU_HOUR
 
-    found = []
-    try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            slots = scraper.slots_for_day(sess, b, s, d)
-            if any((sl.get("value") == hhmm or sl.get("label") == hhmm) for sl in slots):
-                found.append(d)
-    except Exception:
-        logger.exception("hour filter error")
-
+    stream = _StreamReply(update.message, "Համապատասխան օրեր՝",
+                          lambda d, sl: any(hhmm in (x.get("value"), x.get("label")) for x in sl) and f"• {d}")
+    dates = list(_iter_dates(config.LOOKAHEAD_DAYS))
+    if config.DAY_DISCOVERY == "chain":
+        # caches every day of the window, open or empty
+        availability.discover_days(None, b, s, dates, progress=stream.add,
+                                   chain_hits=config.DISCOVERY_CHAIN_HITS,
+                                   chain_seconds=config.DISCOVERY_CHAIN_SECONDS)
+    found = availability.days_at_time(None, b, s, hhmm, dates, progress=stream.add)
+
+    workers.checkpoint()
     if not found:
-        update.message.reply_text(f"Մոտակա {config.LOOKAHEAD_DAYS} օրում {hhmm}-ին ազատ ժամեր չկան։")
+        stream.finish(f"Մոտակա {config.LOOKAHEAD_DAYS} օրում {hhmm}-ին ազատ ժամեր չկան։")
         return ConversationHandler.END
 
-    update.message.reply_text("Համապատասխան օրեր՝\n" + "\n".join(f"• {d}" for d in found[:50]))
+    stream.finish("Համապատասխան օրեր՝\n" + "\n".join(f"• {d}" for d in found[:50]))
     return ConversationHandler.END
 
 def pick_time(update: Update, context: CallbackContext):
@@ -382,6 +495,7 @@ def ask_email(update: Update, context: CallbackContext):
     )
     return CONFIRM_BOOK
 
+@workers.long_running
 def confirm_book(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -390,9 +504,11 @@ def confirm_book(update: Update, context: CallbackContext):
         update.message.reply_text("Չեղարկվեց։")
         return ConversationHandler.END
 
+    flow = C["flow"]
+    workers.checkpoint()  # last point where /cancel stops the booking; past it the result is always reported
     try:
         resp = scraper.register_slot(
-            sess, C["flow"]["branch_id"], C["flow"]["service_id"], C["flow"]["date"], C["flow"]["slot_time"], C["flow"]["email"]
+            sess, flow["branch_id"], flow["service_id"], flow["date"], flow["slot_time"], flow["email"]
         )
         pin = resp.get("pin") or ""
         msg = "Ամրագրումը հաջողվեց ✅"
@@ -404,33 +520,65 @@ def confirm_book(update: Update, context: CallbackContext):
         update.message.reply_text("Ամրագրումը չստացվեց։ Փորձեք կրկին։")
         return ConversationHandler.END
 
+    availability.invalidate(flow["branch_id"], flow["service_id"], flow["date"])
+
     db.save_cookies(chat_id, sess.cookies.get_dict())
     return ConversationHandler.END
 
 # ------------- Tracker (optional) -------------
 
-def tracker_poll(context: CallbackContext):
-    """Check all trackers; if nearer day found, notify."""
-    bot = context.bot
-    for chat_id_str, rec in db.get_all_trackers().items():
-        chat_id = int(chat_id_str)
+def _tracker_update(chat_id: int, rec: Dict[str, Any], day: str):
+    """Compare an open day with one subscriber's last_day; notify if nearer. No last_day: seed it."""
+    old = rec.get("last_day")
+    if old:
+        d_new = datetime.strptime(day, "%d-%m-%Y")
+        d_old = datetime.strptime(old, "%d-%m-%Y")
+        if d_new < d_old:
+            db.set_tracker(chat_id, rec["branch_id"], rec["service_id"], day)
+            NOTIFIER.send(chat_id, f"✅ Գտնվեց ավելի մոտ օր՝ {day}")
+    else:
+        db.set_tracker(chat_id, rec["branch_id"], rec["service_id"], day)
+
+def _on_slot_event(ev: availability.SlotEvent):
+    """
+    Change feed -> trackers: any newly opened slot (optionally at the tracked hour) is
+    checked against last_day. Runs on the feed's delivery thread, not on the read
+    that saw the change. Trackers without a last_day wait for poll_target to seed
+    it from the nearest day; an arbitrary opened day must not become their baseline.
+    """
+    if ev.kind != availability.SLOT_OPENED:
+        return
+    for chat_id, rec in db.trackers_for_target(ev.branch_id, ev.service_id):
+        if not rec.get("last_day"):
+            continue
+        if rec.get("hour") and rec["hour"] not in ev.times:
+            continue
         try:
-            sess = _get_session(chat_id)
-            resp = scraper.nearest_day(sess, rec["branch_id"], rec["service_id"], datetime.now().strftime("%d-%m-%Y"))
-            day = resp.get("data", {}).get("day")
-            if not day:
-                continue
-            old = rec.get("last_day")
-            if old:
-                d_new = datetime.strptime(day, "%d-%m-%Y")
-                d_old = datetime.strptime(old, "%d-%m-%Y")
-                if d_new < d_old:
-                    db.set_tracker(chat_id, rec["branch_id"], rec["service_id"], day)
-                    bot.send_message(chat_id, f"✅ Գտնվեց ավելի մոտ օր՝ {day}")
-            else:
-                db.set_tracker(chat_id, rec["branch_id"], rec["service_id"], day)
+            _tracker_update(chat_id, rec, ev.date)
         except Exception:
-            logger.exception("tracker poll error")
+            logger.exception("tracker notify error")
+
+def poll_target(bot, branch_id: str, service_id: str, subscribers: List[Tuple[int, Dict[str, Any]]]):
+    """
+    Refresh one (branch, service) with a single nearest-day call. Changes reach the
+    subscribers through the availability change feed (_on_slot_event); here we only
+    give new trackers their starting last_day.
+    """
+    resp = availability.nearest_day(None, branch_id, service_id, datetime.now().strftime("%d-%m-%Y"))
+    data = resp.get("data") or {}
+    day = data.get("day")
+    if not day:
+        return
+    if not data.get("slots"):
+        availability.slots_for_day(None, branch_id, service_id, day)  # feeds the change feed
+    for chat_id, _ in subscribers:
+        rec = db.get_tracker(chat_id)
+        if rec and not rec.get("last_day"):
+            _tracker_update(chat_id, rec, day)
+
+NOTIFIER = notifier.Notifier()  # tracker alerts go out through a rate-limited queue
+TRACKERS = scheduler.TrackerScheduler(poll_target)
+CRAWLER = crawler.Crawler()
 
 def register_dispatcher(dp, job_queue):
     # Registration conv
@@ -443,6 +591,11 @@ def register_dispatcher(dp, job_queue):
             ],
             REG_PSN: [MessageHandler(Filters.text & ~Filters.command, reg_psn)],
             REG_SMS: [MessageHandler(Filters.text & ~Filters.command, reg_code)],
+            # updates that arrive while an offloaded step is still running
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel_running),
+                MessageHandler(Filters.all, still_working),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         name="reg_conv",
@@ -463,14 +616,39 @@ def register_dispatcher(dp, job_queue):
             MENU_TIMES: [MessageHandler(Filters.text & ~Filters.command, pick_time)],
             ASK_EMAIL: [MessageHandler(Filters.text & ~Filters.command, ask_email)],
             CONFIRM_BOOK: [MessageHandler(Filters.text & ~Filters.command, confirm_book)],
+            # updates that arrive while an offloaded step is still running
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel_running),
+                MessageHandler(Filters.all, still_working),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         name="search_conv",
         per_user=True, per_chat=True, persistent=False
     )
 
-    dp.add_handler(reg_conv)
-    dp.add_handler(search_conv)
+    for conv in (reg_conv, search_conv):
+        metrics.instrument(conv)
+        workers.offload(conv)  # upstream-bound steps leave the dispatcher thread
+        dp.add_handler(conv)
+
+    for prefix, stats in (("governor", scraper.GOVERNOR.stats), ("availability", availability.stats),
+                          ("sessions", SESSIONS.stats), ("notifier", NOTIFIER.stats),
+                          ("trackers", TRACKERS.stats), ("handler_pool", workers.POOL.stats),
+                          ("user_cache", db.user_cache_stats)):
+        metrics.register_stats(prefix, stats)
+
+    # branch/service lists: warm at startup, then refresh in the background
+    job_queue.run_repeating(catalog.refresh_job, interval=config.CATALOG_REFRESH_MINUTES * 60, first=0)
+
+    # full availability snapshot, refreshed in the background
+    job_queue.run_repeating(CRAWLER.run, interval=config.CRAWL_INTERVAL_MINUTES * 60, first=30)
+
+    # idle session eviction
+    job_queue.run_repeating(SESSIONS.sweep_job, interval=config.SESSION_SWEEP_SECONDS, first=config.SESSION_SWEEP_SECONDS)
+
+    NOTIFIER.start(dp.bot)
+    availability.subscribe(_on_slot_event)
 
-    # periodic tracker
-    job_queue.run_repeating(tracker_poll, interval=config.TRACK_INTERVAL_MINUTES * 60, first=60)
+    # periodic tracker: polls are staggered across TRACK_INTERVAL_MINUTES
+    job_queue.run_repeating(TRACKERS.tick, interval=config.TRACK_TICK_SECONDS, first=60)
@@ -9,9 +9,16 @@ from telegram.ext import (
     Filters, ConversationHandler, CallbackContext
 )
 
+import availability
+import catalog
 import config
+import crawler
 import database as db
+import metrics
 import rp_client
+import scraper
+import sessions
+import workers
 import keyboards as kb
 
 logging.basicConfig(
@@ -23,18 +30,18 @@ logger = logging.getLogger(__name__)
 REG_PHONE, REG_PSN, REG_SMS, MENU_EXAM, MENU_SERVICE, MENU_BRANCH, MENU_FILTER, MENU_WEEKDAY, MENU_DATE, MENU_HOUR, MENU_TIMES, ASK_EMAIL, CONFIRM_BOOK = range(13)
 
 # ephemeral per-chat runtime cache
-USER_SESS = {}  # chat_id -> requests.Session
 CTX = {}        # chat_id -> dict
 
-def _get_session(chat_id: int):
-    sess = USER_SESS.get(chat_id)
-    if sess:
-        return sess
+def _new_session(chat_id: int):
     # try load cookies from DB
     cookies = db.load_cookies(chat_id)
-    sess = rp_client.init_session(seed_cookies=cookies if cookies else None)
-    USER_SESS[chat_id] = sess
-    return sess
+    return rp_client.init_session(seed_cookies=cookies if cookies else None)
+
+SESSIONS = sessions.SessionManager(_new_session)  # chat_id -> requests.Session, for login and booking
+CRAWLER = crawler.Crawler()
+
+def _get_session(chat_id: int):
+    return SESSIONS.get(chat_id)
 
 def _validate_phone(s: str) -> bool:
     return bool(re.fullmatch(r"(\+374\d{8}|0\d{8})", s))
@@ -91,6 +98,7 @@ def reg_phone(update: Update, context: CallbackContext):
     )
     return REG_PSN
 
+@workers.long_running
 def reg_psn(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -101,18 +109,24 @@ def reg_psn(update: Update, context: CallbackContext):
         update.message.reply_text("Խնդրում ենք մուտքագրել ճիշտ 10-նիշ համար (օր․ 1234567890)։")
         return REG_PSN
 
+    workers.checkpoint()  # the login sends an SMS
     C["psn"] = psn
     # try login
     try:
         resp = rp_client.login(sess, psn=psn, phone=C["phone"], country="374")
     except Exception as e:
         logger.exception("login error")
+        workers.checkpoint()
         update.message.reply_text("Սխալ՝ սերվերի հետ կապը չստացվեց։ Փորձեք նորից /start")
         return ConversationHandler.END
 
+    # the login went through: report it even if /cancel came in meanwhile
     # Heuristics: if response has something indicating verify step
     text_resp = str(resp).lower()
     if "verify" in text_resp or "sms" in text_resp or "token" in text_resp:
+        if workers.cancelled():
+            update.message.reply_text("ՍՄՍ կոդն արդեն ուղարկվել էր, բայց գործընթացը դադարեցվեց։ Սկսեք նորից՝ /start")
+            return ConversationHandler.END
         update.message.reply_text("ՍՄՍ կոդը ուղարկվեց։ Խնդրում ենք մուտքագրել ՍՄՍ կոդը՝ (մինչև 6 թվանշան)։")
         return REG_SMS
 
@@ -125,6 +139,7 @@ def reg_psn(update: Update, context: CallbackContext):
     )
     return ConversationHandler.END
 
+@workers.long_running
 def reg_code(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -132,10 +147,12 @@ def reg_code(update: Update, context: CallbackContext):
     if not re.fullmatch(r"\d{3,8}", code):
         update.message.reply_text("Մուտքագրեք ճիշտ կոդ (մինչև 8 թվանշան)։")
         return REG_SMS
+    workers.checkpoint()
     try:
         resp = rp_client.verify(sess, code)
     except Exception:
         logger.exception("verify error")
+        workers.checkpoint()
         update.message.reply_text("Սխալ՝ հաստատումը չհաջողվեց։ Փորձեք կրկին /start")
         return ConversationHandler.END
 
@@ -145,9 +162,21 @@ def reg_code(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 def cancel(update: Update, context: CallbackContext):
+    workers.cancel(update.effective_chat.id)
     update.message.reply_text("Գործընթացը դադարեցվեց։")
     return ConversationHandler.END
 
+def cancel_running(update: Update, context: CallbackContext):
+    """WAITING state /cancel: the running step stops at its next checkpoint; a request already sent completes."""
+    workers.cancel(update.effective_chat.id)
+    update.message.reply_text("Գործընթացը դադարեցվեց։ Եթե մուտքի կամ ամրագրման հարցումն արդեն ուղարկվել էր, "
+                              "այն կավարտվի, և արդյունքը կստանաք։")
+    return ConversationHandler.END
+
+def still_working(update: Update, context: CallbackContext):
+    """WAITING state: a long-running step of this chat is still on the worker pool."""
+    update.effective_message.reply_text("⏳ Հարցումը դեռ ընթացքում է… Սպասեք կամ /cancel՝ դադարեցնելու համար։")
+
 # ---------------- SEARCH FLOW ----------------
 
 def cmd_search(update: Update, context: CallbackContext):
@@ -157,20 +186,22 @@ def cmd_search(update: Update, context: CallbackContext):
     update.message.reply_text("Ընտրեք քննության տեսակը․", reply_markup=kb.exam_type_kb())
     return MENU_EXAM
 
+@workers.long_running
 def pick_exam(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     choice = (update.message.text or "").strip()
 
-    # Fetch dynamic lists
+    # Lists come from the shared catalog; /hqb is only hit on a cold start
     try:
-        branches, services = rp_client.fetch_branches_and_services(sess)
+        branches, services = catalog.get()
     except Exception:
         logger.exception("fetch lists error")
+        workers.checkpoint()
         update.message.reply_text("Չհաջողվեց ստանալ ծառայությունների և բաժինների ցանկը։ Փորձեք կրկին /search")
         return ConversationHandler.END
 
+    workers.checkpoint()
     C["flow"]["branches"] = branches
     C["flow"]["services_all"] = services
 
@@ -221,6 +252,7 @@ def pick_branch(update: Update, context: CallbackContext):
     update.message.reply_text("Ընտրեք որոնման տարբերակը․", reply_markup=kb.filter_kb())
     return MENU_FILTER
 
+@workers.long_running
 def pick_filter(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     C = CTX.setdefault(chat_id, {})
@@ -245,19 +277,21 @@ def pick_filter(update: Update, context: CallbackContext):
 
 def _do_nearest(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
+    # availability reads share the cache, the crawler's snapshot and the anonymous sessions
     try:
-        resp = rp_client.nearest_day(sess, b, s, _today_ddmmYYYY())
+        resp = availability.nearest_day(None, b, s, _today_ddmmYYYY())
         day = resp.get("data", {}).get("day")
         slots = resp.get("data", {}).get("slots") or []
     except Exception:
         logger.exception("nearest error")
+        workers.checkpoint()
         update.message.reply_text("Չհաջողվեց ստանալ ամենամոտ օրը։")
         return ConversationHandler.END
 
+    workers.checkpoint()
     if not day or not slots:
         update.message.reply_text("Ազատ մոտ օր暂 չգտնվեց։ Փորձեք «Բոլոր ազատ օրերը» կամ փոխեք բաժինը/ծառայությունը։")
         return ConversationHandler.END
@@ -275,19 +309,22 @@ def _iter_dates(n_days: int):
 
 def _do_all_days(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
     found = []
+    dates = list(_iter_dates(config.LOOKAHEAD_DAYS))
     try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            slots = rp_client.slots_for_day(sess, b, s, d)
-            if slots:
-                found.append((d, len(slots)))
+        if config.DAY_DISCOVERY == "chain":
+            days = availability.discover_days(None, b, s, dates, chain_hits=config.DISCOVERY_CHAIN_HITS,
+                                              chain_seconds=config.DISCOVERY_CHAIN_SECONDS)
+            found = [(d, len(slots)) for d, slots in days]
+        else:
+            found = availability.day_counts(None, b, s, dates)
     except Exception:
         logger.exception("list days error")
 
+    workers.checkpoint()
     if not found:
         update.message.reply_text("Մոտակա օրերի ազատ ժամեր չկան։ Փորձեք փոխել ֆիլտրերը։")
         return ConversationHandler.END
@@ -296,13 +333,13 @@ def _do_all_days(update: Update, context: CallbackContext):
     update.message.reply_text("Գոյություն ունեցող օրեր՝\n" + "\n".join(lines) + "\n\nՕգտագործեք «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
     return ConversationHandler.END
 
+@workers.long_running
 def pick_weekday(update: Update, context: CallbackContext):
     wd_map = {
         "Երկուշաբթի": 0, "Երեքշաբթի": 1, "Չորեքշաբթի": 2,
         "Հինգշաբթի": 3, "Ուրբաթ": 4, "Շաբաթ": 5, "Կիրակի": 6
     }
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
     label = (update.message.text or "").strip()
@@ -313,16 +350,11 @@ def pick_weekday(update: Update, context: CallbackContext):
 
     found = []
     try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            dt = datetime.strptime(d, "%d-%m-%Y")
-            if dt.weekday() != want:
-                continue
-            slots = rp_client.slots_for_day(sess, b, s, d)
-            if slots:
-                found.append((d, len(slots)))
+        found = availability.days_on_weekday(None, b, s, want, _iter_dates(config.LOOKAHEAD_DAYS))
     except Exception:
         logger.exception("weekday list error")
 
+    workers.checkpoint()
     if not found:
         update.message.reply_text("Տվյալ շաբաթվա օրով ազատ ժամեր չկան մոտակա ժամանակահատվածում։")
         return ConversationHandler.END
@@ -331,9 +363,9 @@ def pick_weekday(update: Update, context: CallbackContext):
     update.message.reply_text(f"{label} օրերին առկա օրեր՝\n" + "\n".join(lines) + "\n\nՕգտ․ «Ֆիլտր՝ ամսաթվով»՝ օրը ընտրելու համար։")
     return ConversationHandler.END
 
+@workers.long_running
 def pick_date(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
@@ -343,12 +375,14 @@ def pick_date(update: Update, context: CallbackContext):
         return MENU_DATE
 
     try:
-        slots = rp_client.slots_for_day(sess, b, s, d)
+        slots = availability.slots_for_day(None, b, s, d)
     except Exception:
         logger.exception("slots day error")
+        workers.checkpoint()
         update.message.reply_text("Չստացվեց բեռնել ժամերը։")
         return ConversationHandler.END
 
+    workers.checkpoint()
     if not slots:
         update.message.reply_text(f"{d} օրով ազատ ժամ չկա։ Փորձեք այլ օր։")
         return ConversationHandler.END
@@ -358,9 +392,9 @@ def pick_date(update: Update, context: CallbackContext):
     update.message.reply_text(f"{d} օրվա ազատ ժամերը՝ Ընտրեք ժամը։", reply_markup=kb.times_kb(slots))
     return MENU_TIMES
 
+@workers.long_running
 def pick_hour_filter(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    sess = _get_session(chat_id)
     C = CTX.setdefault(chat_id, {})
     b = C["flow"]["branch_id"]; s = C["flow"]["service_id"]
 
@@ -370,14 +404,17 @@ def pick_hour_filter(update: Update, context: CallbackContext):
         return MENU_HOUR
 
     found = []
+    dates = list(_iter_dates(config.LOOKAHEAD_DAYS))
     try:
-        for d in _iter_dates(config.LOOKAHEAD_DAYS):
-            slots = rp_client.slots_for_day(sess, b, s, d)
-            if any((sl.get("value") == hhmm or sl.get("label") == hhmm) for sl in slots):
-                found.append(d)
+        if config.DAY_DISCOVERY == "chain":
+            # caches every day of the window, open or empty
+            availability.discover_days(None, b, s, dates, chain_hits=config.DISCOVERY_CHAIN_HITS,
+                                       chain_seconds=config.DISCOVERY_CHAIN_SECONDS)
+        found = availability.days_at_time(None, b, s, hhmm, dates)
     except Exception:
         logger.exception("hour filter error")
 
+    workers.checkpoint()
     if not found:
         update.message.reply_text(f"Մոտակա {config.LOOKAHEAD_DAYS} օրում {hhmm}-ին ազատ ժամեր չկան։")
         return ConversationHandler.END
@@ -419,6 +456,7 @@ def ask_email(update: Update, context: CallbackContext):
     )
     return CONFIRM_BOOK
 
+@workers.long_running
 def confirm_book(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     sess = _get_session(chat_id)
@@ -428,10 +466,12 @@ def confirm_book(update: Update, context: CallbackContext):
         update.message.reply_text("Չեղարկվեց։")
         return ConversationHandler.END
 
+    flow = C["flow"]
+    workers.checkpoint()  # last point where /cancel stops the booking; past it the result is always reported
     try:
         resp = rp_client.register_slot(sess,
-            C["flow"]["branch_id"], C["flow"]["service_id"], C["flow"]["date"],
-            C["flow"]["slot_time"], C["flow"]["email"]
+            flow["branch_id"], flow["service_id"], flow["date"],
+            flow["slot_time"], flow["email"]
         )
         pin = resp.get("pin") or ""
         msg = "Ամրագրումը հաջողվեց ✅"
@@ -443,6 +483,8 @@ def confirm_book(update: Update, context: CallbackContext):
         update.message.reply_text("Ամրագրումը չստացվեց։ Փորձեք կրկին։")
         return ConversationHandler.END
 
+    availability.invalidate(flow["branch_id"], flow["service_id"], flow["date"])
+
     # save latest cookies
     db.save_cookies(chat_id, sess.cookies.get_dict())
     return ConversationHandler.END
@@ -453,7 +495,9 @@ def main():
     if not config.BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN environment variable is required")
 
-    updater = Updater(token=config.BOT_TOKEN, use_context=True)
+    # pooled handlers reply from their own threads: size the Bot API connection pool for them
+    updater = Updater(token=config.BOT_TOKEN, use_context=True,
+                      request_kwargs={"con_pool_size": config.HANDLER_WORKERS + 8})
     dp = updater.dispatcher
 
     # Registration conversation
@@ -466,6 +510,11 @@ def main():
             ],
             REG_PSN: [MessageHandler(Filters.text & ~Filters.command, reg_psn)],
             REG_SMS: [MessageHandler(Filters.text & ~Filters.command, reg_code)],
+            # updates that arrive while an offloaded step is still running
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel_running),
+                MessageHandler(Filters.all, still_working),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         name="reg_conv",
@@ -487,6 +536,11 @@ def main():
             MENU_TIMES: [MessageHandler(Filters.text & ~Filters.command, pick_time)],
             ASK_EMAIL: [MessageHandler(Filters.text & ~Filters.command, ask_email)],
             CONFIRM_BOOK: [MessageHandler(Filters.text & ~Filters.command, confirm_book)],
+            # updates that arrive while an offloaded step is still running
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel_running),
+                MessageHandler(Filters.all, still_working),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         name="search_conv",
@@ -495,19 +549,35 @@ def main():
         per_chat=True,
     )
 
-    dp.add_handler(reg_conv)
-    dp.add_handler(search_conv)
+    for conv in (reg_conv, search_conv):
+        metrics.instrument(conv)
+        workers.offload(conv)  # upstream-bound steps leave the dispatcher thread
+        dp.add_handler(conv)
+    metrics.register_stats("governor", scraper.GOVERNOR.stats)
+    metrics.register_stats("availability", availability.stats)
+    metrics.register_stats("sessions", SESSIONS.stats)
+    metrics.register_stats("handler_pool", workers.POOL.stats)
+    metrics.register_stats("user_cache", db.user_cache_stats)
+
+    updater.job_queue.run_repeating(catalog.refresh_job, interval=config.CATALOG_REFRESH_MINUTES * 60, first=0)
+    # full availability snapshot, refreshed in the background
+    updater.job_queue.run_repeating(CRAWLER.run, interval=config.CRAWL_INTERVAL_MINUTES * 60, first=30)
+    updater.job_queue.run_repeating(SESSIONS.sweep_job, interval=config.SESSION_SWEEP_SECONDS,
+                                    first=config.SESSION_SWEEP_SECONDS)
 
     # Webhook mode for Render
     if config.WEBHOOK_BASE_URL:
         webhook_path = f"/bot/{config.BOT_TOKEN}"
         updater.start_webhook(listen="0.0.0.0", port=config.PORT, url_path=webhook_path)
         updater.bot.set_webhook(url=f"{config.WEBHOOK_BASE_URL}{webhook_path}")
-        logger.info("Bot started via webhook on port %s", config.PORT)
+        metrics.serve_on_webhook(updater)
+        logger.info("Bot started via webhook on port %s (metrics on /metrics)", config.PORT)
         updater.idle()
     else:
         # Polling fallback (local/dev)
         logger.info("Starting bot with long polling…")
+        if config.METRICS_PORT:
+            metrics.serve(config.METRICS_PORT)
         updater.start_polling(clean=True)
         updater.idle()
 
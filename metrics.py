@@ -0,0 +1,202 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text exposition (format 0.0.4), without the client library.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_LOCK = threading.Lock()
+_METRICS: List["_Metric"] = []
+_STATS: Dict[str, Callable[[], Dict]] = {}  # prefix -> stats() rendered as gauges
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}" if body else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        with _LOCK:
+            _METRICS.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(k, "")) for k in self.labels)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            out.extend(self._samples(items))
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def _samples(self, items):
+        return [f"{self.name}{_labels(zip(self.labels, key))} {v}" for key, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, items):
+        out = []
+        for key, (counts, total, n) in items:
+            pairs = list(zip(self.labels, key))
+            cum = 0
+            for le, c in zip(self.buckets, counts):
+                cum += c
+                out.append(f"{self.name}_bucket{_labels(pairs + [('le', repr(float(le)))])} {cum}")
+            out.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {n}")
+            out.append(f"{self.name}_sum{_labels(pairs)} {total}")
+            out.append(f"{self.name}_count{_labels(pairs)} {n}")
+        return out
+
+@contextmanager
+def timed(hist: Histogram, errors: Counter, **labels):
+    """Observe the block's duration; count an error (by exception type) if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        errors.inc(error=type(e).__name__, **labels)
+        raise
+    finally:
+        hist.observe(time.perf_counter() - started, **labels)
+
+UPSTREAM_SECONDS = Histogram("rodar_upstream_request_seconds", "roadpolice.am request latency", ("endpoint",))
+UPSTREAM_ERRORS = Counter("rodar_upstream_errors_total", "roadpolice.am failed requests", ("endpoint", "error"))
+UPSTREAM_SHARED = Counter("rodar_upstream_shared_total", "Reads answered by joining an identical in-flight request", ("endpoint",))
+HANDLER_SECONDS = Histogram("rodar_handler_seconds", "Conversation handler run time", ("conversation", "handler"))
+HANDLER_ERRORS = Counter("rodar_handler_errors_total", "Conversation handler exceptions", ("conversation", "handler", "error"))
+SUPABASE_SECONDS = Histogram("rodar_supabase_request_seconds", "Supabase REST call latency", ("op",))
+SUPABASE_ERRORS = Counter("rodar_supabase_errors_total", "Supabase REST call failures", ("op", "error"))
+
+def instrument(conv) -> None:
+    """Time every callback of a ConversationHandler (entry points, states, fallbacks)."""
+    handlers = list(conv.entry_points) + list(conv.fallbacks)
+    for hs in conv.states.values():
+        handlers.extend(hs)
+    for h in handlers:
+        cb = h.callback
+        if getattr(cb, "rp_instrumented", False):
+            continue
+        h.callback = _timed_callback(cb, conv.name or "", cb.__name__)
+
+def _timed_callback(cb: Callable, conversation: str, handler: str) -> Callable:
+    @functools.wraps(cb)
+    def wrapper(update, context):
+        with timed(HANDLER_SECONDS, HANDLER_ERRORS, conversation=conversation, handler=handler):
+            return cb(update, context)
+    wrapper.rp_instrumented = True
+    return wrapper
+
+def register_stats(prefix: str, stats: Callable[[], Dict]):
+    """Expose a component's stats() dict as gauges `rodar_<prefix>_<key>`; nested dicts are flattened."""
+    with _LOCK:
+        _STATS[prefix] = stats
+
+def _flatten(prefix: str, d: Dict) -> Iterable[Tuple[str, float]]:
+    for k, v in d.items():
+        name = f"{prefix}_{k}".replace("-", "_")
+        if isinstance(v, dict):
+            yield from _flatten(name, v)
+        elif isinstance(v, (int, float)):
+            yield name, float(v)
+
+def render() -> str:
+    with _LOCK:
+        metrics = list(_METRICS)
+        stats = list(_STATS.items())
+    lines: List[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    for prefix, fn in stats:
+        try:
+            values = list(_flatten(f"rodar_{prefix}", fn()))
+        except Exception:
+            logger.warning("metrics: %s stats failed", prefix, exc_info=True)
+            continue
+        for name, v in values:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {v}")
+    return "\n".join(lines) + "\n"
+
+def serve_on_webhook(updater, path: str = "/metrics"):
+    """Add `path` to the running webhook server (call after start_webhook)."""
+    import tornado.web
+
+    class _Handler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", CONTENT_TYPE)
+            self.write(render())
+
+    httpd = updater.httpd
+    app = httpd.http_server.request_callback
+    httpd.loop.add_callback(app.add_handlers, r".*", [(path, _Handler)])
+
+class _StdlibHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Standalone /metrics endpoint on a daemon thread (polling mode has no web server)."""
+    server = ThreadingHTTPServer((host, port), _StdlibHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+
+import config
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class Notifier:
+    """
+    Outbound message queue for alerts, kept apart from upstream polling.
+
+    send() only enqueues. Sender threads respect Telegram's limits: a global token
+    bucket (~30 msg/s) and at most one message per chat every `per_chat_seconds`.
+    RetryAfter pauses all sending for the requested time and requeues the message;
+    network errors are retried a few times.
+    """
+
+    def __init__(self, rate: float = config.NOTIFY_RATE_PER_SEC,
+                 per_chat_seconds: float = config.NOTIFY_PER_CHAT_SECONDS,
+                 workers: int = config.NOTIFY_WORKERS, max_attempts: int = 5):
+        self.bucket = TokenBucket(rate, rate)
+        self.per_chat_seconds = per_chat_seconds
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.bot = None
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []  # (not_before, seq, msg)
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._chat_next: Dict[int, float] = {}
+        self._paused_until = 0.0
+        self._threads: List[threading.Thread] = []
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, bot):
+        self.bot = bot
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"notifier-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def send(self, chat_id: int, text: str, **kwargs):
+        self._push({"chat_id": chat_id, "text": text, "kwargs": kwargs, "attempt": 0, "seq": next(self._seq)}, 0.0)
+
+    def _push(self, msg: Dict[str, Any], not_before: float):
+        # ties break on the original enqueue order, so retries keep their place within a chat
+        with self._cv:
+            heapq.heappush(self._heap, (not_before, msg["seq"], msg))
+            self._cv.notify()
+
+    def _next_ready(self) -> Optional[Dict[str, Any]]:
+        """Pop the first message whose chat may receive now; reserve the chat's next slot."""
+        with self._cv:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0 and self._heap:
+                    not_before, _, msg = self._heap[0]
+                    ready_at = max(not_before, self._chat_next.get(msg["chat_id"], 0.0))
+                    if ready_at <= now:
+                        heapq.heappop(self._heap)
+                        self._chat_next[msg["chat_id"]] = now + self.per_chat_seconds
+                        return msg
+                    if ready_at > not_before:
+                        # chat is rate limited: push back so other chats go first
+                        heapq.heapreplace(self._heap, (ready_at, msg["seq"], msg))
+                        continue
+                    wait = ready_at - now
+                self._cv.wait(timeout=wait if wait > 0 else None)
+
+    def _loop(self):
+        while True:
+            msg = self._next_ready()
+            self.bucket.take()
+            try:
+                self.bot.send_message(msg["chat_id"], msg["text"], **msg["kwargs"])
+                self.sent += 1
+            except RetryAfter as e:
+                logger.warning("notifier: flood limit, retry after %ss", e.retry_after)
+                with self._cv:
+                    self._paused_until = time.monotonic() + float(e.retry_after)
+                self._push(msg, 0.0)
+            except (Unauthorized, BadRequest) as e:
+                # blocked bot / deleted chat: retrying will not help
+                self.failed += 1
+                logger.info("notifier: dropping message to %s: %s", msg["chat_id"], e)
+            except (TimedOut, NetworkError):
+                msg["attempt"] += 1
+                if msg["attempt"] >= self.max_attempts:
+                    self.failed += 1
+                    logger.exception("notifier: giving up on message to %s", msg["chat_id"])
+                else:
+                    self._push(msg, time.monotonic() + 2 ** msg["attempt"])
+            except Exception:
+                self.failed += 1
+                logger.exception("notifier: send failed")
+            finally:
+                if len(self._chat_next) > 10000:
+                    self._forget_idle_chats()
+
+    def _forget_idle_chats(self):
+        with self._cv:
+            now = time.monotonic()
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+    def stats(self) -> Dict[str, int]:
+        with self._cv:
+            return {"queued": len(self._heap), "sent": self.sent, "failed": self.failed}
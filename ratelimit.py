@@ -0,0 +1,34 @@
+import threading
+import time
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` banked."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_take(self, n: float = 1.0) -> float:
+        """Take n tokens if available and return 0, else return seconds until they would be."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+    def take(self, n: float = 1.0):
+        """Block until n tokens are available."""
+        while True:
+            wait = self.try_take(n)
+            if not wait:
+                return
+            time.sleep(wait)
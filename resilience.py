@@ -0,0 +1,72 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class UpstreamUnavailable(Exception):
+    """The circuit breaker is open: roadpolice.am is considered down, call not attempted."""
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(config.RP_BACKOFF_MAX, config.RP_BACKOFF_BASE * 2 ** attempt))
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive upstream failures; while open, calls fail fast.
+    After `cooldown` seconds a single trial call is let through (half-open): success
+    closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, failures: int = config.RP_BREAKER_FAILURES,
+                 cooldown: float = config.RP_BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self._count < self.failures:
+            return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._count < self.failures:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            if self._count >= self.failures:
+                logger.info("upstream recovered, closing circuit breaker")
+            self._count = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._count == self.failures or self._trial:
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning("upstream failing, circuit breaker open for %.0fs", self.cooldown)
+            self._trial = False
+
+    def cancel(self):
+        """An allowed call ended without an upstream outcome; give back the half-open trial."""
+        with self._lock:
+            self._trial = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "consecutive_failures": self._count, "trips": self.trips}
@@ -0,0 +1,256 @@
+"""
+Asyncio flavour of the roadpolice.am client (same surface as scraper.py).
+
+All sessions share one pooled httpx.AsyncClient; each RPSession keeps its own
+cookie jar, so users never see each other's cookies. Every request goes through
+the same policies as scraper.py: the global governor (and crawl budget), the
+circuit breaker, retries with backoff, metrics and the XSRF refresh-and-replay.
+Sync code (the PTB 13 handlers) can drive coroutines on the shared background
+loop with run(); they inherit the caller's governor priority and budget.
+"""
+import asyncio
+import http.cookiejar
+import importlib.util
+import logging
+import threading
+from typing import Dict, List, Tuple, Optional, Iterable
+from urllib.parse import unquote
+
+import httpx
+
+import config
+import governor
+import metrics
+import resilience
+from scraper import (BREAKER, GOVERNOR, HEADERS_BASE, SessionExpired, _csrf_rejected, _endpoint,
+                     _transient, parse_branches_and_services)
+
+logger = logging.getLogger(__name__)
+
+_MAX_REDIRECTS = 5
+
+class RPSession:
+    """Per-user state: the cookie jar. The transport is shared."""
+
+    def __init__(self, cookies: Optional[Dict[str, str]] = None):
+        self.cookies = httpx.Cookies()
+        self.token_lock = asyncio.Lock()
+        for k, v in (cookies or {}).items():
+            self.cookies.set(k, v, domain=config.RP_COOKIE_DOMAIN)
+
+    def get_dict(self) -> Dict[str, str]:
+        return {c.name: c.value for c in self.cookies.jar}
+
+    def xsrf_token(self) -> Optional[str]:
+        # Laravel stores XSRF-TOKEN cookie URL-encoded
+        token_cookie = self.cookies.get("XSRF-TOKEN")
+        if not token_cookie:
+            return None
+        try:
+            return unquote(token_cookie)
+        except Exception:
+            return token_cookie
+
+_CLIENT: Optional[httpx.AsyncClient] = None
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+def _client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None:
+        http2 = config.RP_HTTP2 and importlib.util.find_spec("h2") is not None
+        # a jar that refuses everything: cookies live in RPSession, never on the shared client
+        no_cookies = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        _CLIENT = httpx.AsyncClient(
+            http2=http2,
+            cookies=no_cookies,
+            timeout=20.0,
+            limits=httpx.Limits(max_connections=config.RP_ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=config.RP_ASYNC_MAX_CONNECTIONS),
+        )
+    return _CLIENT
+
+async def _send(session: RPSession, method: str, url: str, **kw) -> httpx.Response:
+    """One request; redirects are followed here so the final response's history is kept."""
+    client = _client()
+    req = client.build_request(method, url, **kw)
+    history: List[httpx.Response] = []
+    for _ in range(_MAX_REDIRECTS + 1):
+        session.cookies.set_cookie_header(req)
+        r = await client.send(req)
+        session.cookies.extract_cookies(r)
+        if not r.is_redirect or r.next_request is None:
+            await r.aread()
+            r.history = history
+            return r
+        # follow redirects by hand so cookies set mid-chain land in this session's jar
+        await r.aclose()
+        history.append(r)
+        req = r.next_request
+    raise httpx.TooManyRedirects("too many redirects", request=req)
+
+async def _slot(level: int):
+    """Take a governor slot without blocking the loop; a cancelled waiter gives it back."""
+    fut = asyncio.get_running_loop().run_in_executor(None, GOVERNOR.acquire, level)
+    try:
+        await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception() or GOVERNOR.release())
+        raise
+
+async def _request(session: RPSession, method: str, url: str, retries: Optional[int] = None,
+                   **kw) -> httpx.Response:
+    """Async scraper._request: governor, breaker (one outcome per call) and retries."""
+    retries = config.RP_RETRIES if retries is None else retries
+    endpoint = _endpoint(url)
+    if not BREAKER.allow():
+        metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, error="breaker_open")
+        raise resilience.UpstreamUnavailable(url)
+    try:
+        r = await _attempts(session, method, url, retries, endpoint, **kw)
+    except httpx.HTTPError:
+        BREAKER.failure()
+        raise
+    except BaseException:
+        BREAKER.cancel()
+        raise
+    if _transient(r):
+        BREAKER.failure()
+    else:
+        BREAKER.success()
+    return r
+
+async def _attempts(session: RPSession, method: str, url: str, retries: int, endpoint: str,
+                    **kw) -> httpx.Response:
+    level = governor.current()
+    attempt = 0
+    while True:
+        governor.charge()
+        await _slot(level)
+        try:
+            with metrics.timed(metrics.UPSTREAM_SECONDS, metrics.UPSTREAM_ERRORS, endpoint=endpoint):
+                r = await _send(session, method, url, **kw)
+            if r.status_code >= 400:
+                metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, error=str(r.status_code))
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                raise
+            logger.info("%s %s: %s, retrying", method, url, type(e).__name__)
+        else:
+            if not _transient(r) or attempt >= retries:
+                return r  # caller's raise_for_status reports a final 5xx/429
+            logger.info("%s %s: HTTP %s, retrying", method, url, r.status_code)
+        finally:
+            GOVERNOR.release()
+        await asyncio.sleep(resilience.backoff(attempt))
+        attempt += 1
+
+async def _refresh_token(session: RPSession, stale: Optional[str]):
+    """Fetch a new XSRF token with one GET. Single-flight per session."""
+    async with session.token_lock:
+        if session.xsrf_token() != stale:
+            return  # a concurrent caller already refreshed it
+        await _request(session, "GET", f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE)
+
+async def _post(session: RPSession, path: str, data: Dict[str, str], retries: Optional[int] = None) -> Dict:
+    url = f"{config.RP_BASE}/{config.RP_LANG}/{path}"
+    for attempt in range(2):
+        xsrf = session.xsrf_token()
+        headers = dict(HEADERS_BASE)
+        if xsrf:
+            headers["x-csrf-token"] = xsrf
+        r = await _request(session, "POST", url, retries=retries, data=data, headers=headers)
+        if not _csrf_rejected(r):
+            break
+        if attempt:
+            raise SessionExpired(f"{path}: rejected again after token refresh ({r.status_code})")
+        logger.info("%s: XSRF token rejected (%s), refreshing and replaying", path, r.status_code)
+        await _refresh_token(session, xsrf)
+    r.raise_for_status()
+    return r.json()
+
+async def init_session(seed_cookies: Optional[Dict[str, str]] = None, lazy: Optional[bool] = None) -> RPSession:
+    """Same contract as scraper.init_session (lazy skips the warm-up if the seed has a token)."""
+    lazy = config.RP_LAZY_SESSION if lazy is None else lazy
+    s = RPSession()
+    if not (lazy and seed_cookies and seed_cookies.get("XSRF-TOKEN")):
+        # open home & hqb to receive cookies
+        await _request(s, "GET", f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE)
+        await _request(s, "GET", f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE)
+    for k, v in (seed_cookies or {}).items():
+        s.cookies.set(k, v, domain=config.RP_COOKIE_DOMAIN)
+    return s
+
+async def login(session: RPSession, psn: str, phone: str, country: str = "374") -> Dict:
+    payload = {"psn": psn, "phone_number": phone, "country": country}
+    return await _post(session, "hqb-sw/login", payload, retries=0)  # each attempt sends an SMS
+
+async def verify(session: RPSession, token: str) -> Dict:
+    return await _post(session, "hqb-sw/verify", {"token": token}, retries=0)
+
+async def fetch_branches_and_services(session: RPSession) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    r = await _request(session, "GET", f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE)
+    r.raise_for_status()
+    return parse_branches_and_services(r.text)
+
+async def nearest_day(session: RPSession, branch_id: str, service_id: str, from_date_dd_mm_yyyy: str) -> Dict:
+    return await _post(session, "hqb-nearest-day", {
+        "branchId": branch_id, "serviceId": service_id, "date": from_date_dd_mm_yyyy
+    })
+
+async def slots_for_day(session: RPSession, branch_id: str, service_id: str, date_dd_mm_yyyy: str) -> List[Dict]:
+    resp = await _post(session, "hqb-slots-for-day", {
+        "branchId": branch_id, "serviceId": service_id, "date": date_dd_mm_yyyy
+    })
+    return resp.get("data") or []
+
+async def register_slot(session: RPSession, branch_id: str, service_id: str,
+                        date_dd_mm_yyyy: str, slot_time: str, email: str) -> Dict:
+    # never retried: a lost response may still have booked the slot
+    return await _post(session, "hqb-register", {
+        "branchId": branch_id, "serviceId": service_id,
+        "date": date_dd_mm_yyyy, "slotTime": slot_time, "email": email
+    }, retries=0)
+
+async def slots_for_days(session: RPSession, branch_id: str, service_id: str, dates: Iterable[str],
+                         concurrency: Optional[int] = None,
+                         deadline: Optional[float] = None) -> List[Tuple[str, List[Dict]]]:
+    """Async counterpart of scraper.fan_out over slots_for_day: date order, partial on failure/deadline."""
+    dates = list(dates)
+    sem = asyncio.Semaphore(concurrency or config.SCAN_CONCURRENCY)
+    deadline = config.SCAN_DEADLINE_SECONDS if deadline is None else deadline
+
+    async def one(d: str):
+        async with sem:
+            return await slots_for_day(session, branch_id, service_id, d)
+
+    tasks = {asyncio.ensure_future(one(d)): d for d in dates}
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for t in pending:
+        t.cancel()
+    if pending:
+        logger.warning("async scan: deadline %.0fs hit, %d/%d days missing", deadline, len(pending), len(dates))
+    results: Dict[str, List[Dict]] = {}
+    for t in done:
+        if t.exception() is not None:
+            logger.warning("async scan: day %s failed: %r", tasks[t], t.exception())
+        else:
+            results[tasks[t]] = t.result()
+    return [(d, results[d]) for d in dates if d in results]
+
+def _loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="rp-async", daemon=True).start()
+        return _LOOP
+
+def run(coro, timeout: Optional[float] = None):
+    """
+    Run a coroutine on the shared client loop from sync code and wait for its result.
+    The task runs in a copy of the caller's context (governor priority, crawl budget).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _loop()).result(timeout)
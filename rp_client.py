@@ -5,6 +5,7 @@ import requests
 from urllib.parse import unquote
 from bs4 import BeautifulSoup
 import config
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -26,24 +27,31 @@ def _read_xsrf_token(session: requests.Session) -> Optional[str]:
     except Exception:
         return token_cookie
 
+def _timed(endpoint: str, send, url: str, **kwargs) -> requests.Response:
+    with metrics.timed(metrics.UPSTREAM_SECONDS, metrics.UPSTREAM_ERRORS, endpoint=endpoint):
+        r = send(url, **kwargs)
+    if r.status_code >= 400:
+        metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, error=str(r.status_code))
+    return r
+
 def _post(session: requests.Session, path: str, data: Dict[str, str]) -> Dict:
     xsrf = _read_xsrf_token(session)
     headers = dict(HEADERS_BASE)
     if xsrf:
         headers["x-csrf-token"] = xsrf
     url = f"{config.RP_BASE}/{config.RP_LANG}/{path}"
-    r = session.post(url, data=data, headers=headers, timeout=20)
+    r = _timed(path.rsplit("/", 1)[-1].replace("hqb-", ""), session.post, url, data=data, headers=headers, timeout=20)
     r.raise_for_status()
     return r.json()
 
 def init_session(seed_cookies: Optional[Dict[str, str]] = None) -> requests.Session:
     s = requests.Session()
     # open home & hqb to receive cookies
-    s.get(f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE, timeout=20)
-    s.get(f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE, timeout=20)
+    _timed("home", s.get, f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE, timeout=20)
+    _timed("hqb", s.get, f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE, timeout=20)
     if seed_cookies:
         for k, v in seed_cookies.items():
-            s.cookies.set(k, v, domain="roadpolice.am", secure=True)
+            s.cookies.set(k, v, domain=config.RP_COOKIE_DOMAIN, secure=config.RP_COOKIE_SECURE)
     # ensure we have csrf
     _ = _read_xsrf_token(s)
     return s
@@ -66,7 +74,7 @@ def fetch_branches_and_services(session: requests.Session) -> Tuple[List[Tuple[s
     Parsed from the /hqb page <select name="branchId"> and <select name="serviceId">.
     """
     url = f"{config.RP_BASE}/{config.RP_LANG}/hqb"
-    r = session.get(url, headers=HEADERS_BASE, timeout=20)
+    r = _timed("hqb", session.get, url, headers=HEADERS_BASE, timeout=20)
     r.raise_for_status()
     soup = BeautifulSoup(r.text, "lxml")
 
@@ -0,0 +1,90 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import config
+import database as db
+import governor
+
+logger = logging.getLogger(__name__)
+
+Subscribers = List[Tuple[int, Dict[str, Any]]]
+
+class TrackerScheduler:
+    """
+    Spreads tracker polls over the interval instead of one burst per cycle.
+
+    Every tick() claims the (branch, service) targets that are due from the tracker
+    store, polls them (highest priority first) on a bounded pool and reschedules each
+    one `interval` later with jitter. The store spreads reloaded targets over the
+    interval. A target that is still polling when it comes due again, or whose poll
+    doesn't finish within one interval of its due time, counts as an overrun.
+    """
+
+    def __init__(self, poll: Callable[[Any, str, str, Subscribers], None],
+                 interval: float = config.TRACK_INTERVAL_MINUTES * 60,
+                 jitter: float = config.TRACK_JITTER,
+                 max_concurrency: int = config.TRACK_MAX_CONCURRENCY):
+        self.poll = poll
+        self.interval = interval
+        self.jitter = jitter
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="tracker")
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, str], float] = {}
+        self.polls = 0
+        self.overruns = 0
+        self.max_lag = 0.0
+
+    @staticmethod
+    def priority(subscribers: Subscribers) -> Tuple[int, int]:
+        return max(int(rec.get("priority") or 0) for _, rec in subscribers), len(subscribers)
+
+    def _next(self, due: float, now: float) -> float:
+        nxt = due + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        return nxt if nxt > now else now + self.interval
+
+    def tick(self, context=None):
+        bot = context.bot if context is not None else None
+        now = time.time()
+        batch = []
+        for target, due in db.due_targets(now):
+            db.set_target_due(target[0], target[1], self._next(due, now))
+            subscribers = db.trackers_for_target(*target)
+            if subscribers:
+                batch.append((target, due, subscribers))
+        batch.sort(key=lambda x: self.priority(x[2]), reverse=True)
+        with self._lock:
+            for target, due, subscribers in batch:
+                lag = now - due
+                self.max_lag = max(self.max_lag, lag)
+                if target in self._inflight:
+                    self.overruns += 1
+                    logger.warning("tracker %s: previous poll still running after %.0fs, skipping",
+                                   target, now - self._inflight[target])
+                    continue
+                self._inflight[target] = now
+                self._pool.submit(self._run, bot, target, due, subscribers)
+
+    def _run(self, bot, target: Tuple[str, str], due: float, subscribers: Subscribers):
+        try:
+            with governor.priority(governor.TRACKER):
+                self.poll(bot, target[0], target[1], subscribers)
+        except Exception:
+            logger.exception("tracker poll error")
+        finally:
+            late = time.time() - due - self.interval
+            with self._lock:
+                self._inflight.pop(target, None)
+                self.polls += 1
+                if late > 0:
+                    self.overruns += 1
+            if late > 0:
+                logger.warning("tracker %s: poll finished %.0fs past its interval", target, late)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"inflight": len(self._inflight), "polls": self.polls,
+                    "overruns": self.overruns, "max_lag": round(self.max_lag, 1)}
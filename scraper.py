@@ -1,13 +1,24 @@
+import contextvars
+import copy
 import logging
 import re
-from typing import Dict, List, Tuple, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List, Tuple, Optional, TypeVar
 import requests
-from urllib.parse import unquote
+from requests.adapters import HTTPAdapter
+from urllib.parse import unquote, urlsplit
 from bs4 import BeautifulSoup
 import config
+import governor
+import metrics
+import resilience
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 HEADERS_BASE = {
     "User-Agent": "Mozilla/5.0 (X11; Linux) AppleWebKit/537.36 (KHTML, like Gecko) PTB/13 Safari/537.36",
     "Accept": "*/*",
@@ -25,69 +36,295 @@ def _read_xsrf_token(session: requests.Session) -> Optional[str]:
     except Exception:
         return token_cookie
 
-def _post(session: requests.Session, path: str, data: Dict[str, str]) -> Dict:
-    xsrf = _read_xsrf_token(session)
-    headers = dict(HEADERS_BASE)
-    if xsrf:
-        headers["x-csrf-token"] = xsrf
+# every upstream request passes the global governor (rate, concurrency, priority)
+GOVERNOR = governor.Governor()
+
+# consecutive upstream failures across all sessions trip this breaker
+BREAKER = resilience.CircuitBreaker()
+
+def _endpoint(url: str) -> str:
+    """Metrics label for a roadpolice.am URL: hqb, nearest-day, login, ... ("home" for /hy)."""
+    path = urlsplit(url).path.strip("/")
+    name = path.rsplit("/", 1)[-1] if "/" in path else "home"
+    return name[4:] if name.startswith("hqb-") else name
+
+def _transient(r: requests.Response) -> bool:
+    return r.status_code >= 500 or r.status_code == 429
+
+def _request(session: requests.Session, method: str, url: str, retries: Optional[int] = None,
+             **kwargs) -> requests.Response:
+    """
+    One upstream call through the governor and the circuit breaker. Connection errors,
+    timeouts, 5xx and 429 are retried `retries` times (default config.RP_RETRIES);
+    pass retries=0 for calls that must not be repeated. The breaker sees one outcome
+    per call, after the retries.
+    """
+    retries = config.RP_RETRIES if retries is None else retries
+    endpoint = _endpoint(url)
+    if not BREAKER.allow():
+        metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, error="breaker_open")
+        raise resilience.UpstreamUnavailable(url)
+    try:
+        r = _attempts(session, method, url, retries, endpoint, **kwargs)
+    except requests.RequestException:
+        BREAKER.failure()
+        raise
+    except BaseException:
+        BREAKER.cancel()  # e.g. a spent crawl budget: says nothing about the upstream
+        raise
+    if _transient(r):
+        BREAKER.failure()
+    else:
+        BREAKER.success()
+    return r
+
+def _attempts(session: requests.Session, method: str, url: str, retries: int, endpoint: str,
+              **kwargs) -> requests.Response:
+    attempt = 0
+    while True:
+        governor.charge()
+        try:
+            with GOVERNOR.slot(), metrics.timed(metrics.UPSTREAM_SECONDS, metrics.UPSTREAM_ERRORS, endpoint=endpoint):
+                r = session.request(method, url, **kwargs)
+            if r.status_code >= 400:
+                metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, error=str(r.status_code))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= retries:
+                raise
+            logger.info("%s %s: %s, retrying", method, url, type(e).__name__)
+        else:
+            if not _transient(r) or attempt >= retries:
+                return r  # caller's raise_for_status reports a final 5xx/429
+            logger.info("%s %s: HTTP %s, retrying", method, url, r.status_code)
+        time.sleep(resilience.backoff(attempt))
+        attempt += 1
+
+def _warm_up(session: requests.Session):
+    """Open home & hqb so the server hands out a fresh session + XSRF-TOKEN."""
+    _request(session, "GET", f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE, timeout=20)
+    _request(session, "GET", f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE, timeout=20)
+
+class SessionExpired(Exception):
+    """The server kept rejecting the session's XSRF token / login after a refresh."""
+
+def _csrf_rejected(r: requests.Response) -> bool:
+    # 419 = Laravel "page expired" (token mismatch); an expired session is redirected
+    # to the login page, which the JSON endpoints otherwise never do
+    if r.status_code == 419:
+        return True
+    if not r.history:
+        return False
+    target = urlsplit(r.history[-1].headers.get("Location", "")).path.rstrip("/")
+    return target.endswith("/login") or "json" not in r.headers.get("Content-Type", "")
+
+def _refresh_token(session: requests.Session, stale: Optional[str]):
+    """Fetch a new XSRF token with one GET. Single-flight per session."""
+    lock = session.__dict__.setdefault("rp_token_lock", threading.Lock())
+    with lock:
+        if _read_xsrf_token(session) != stale:
+            return  # a concurrent caller already refreshed it
+        _request(session, "GET", f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE, timeout=20)
+
+def _post(session: requests.Session, path: str, data: Dict[str, str], retries: Optional[int] = None) -> Dict:
     url = f"{config.RP_BASE}/{config.RP_LANG}/{path}"
-    r = session.post(url, data=data, headers=headers, timeout=20)
+    for attempt in range(2):
+        xsrf = _read_xsrf_token(session)
+        headers = dict(HEADERS_BASE)
+        if xsrf:
+            headers["x-csrf-token"] = xsrf
+        r = _request(session, "POST", url, retries=retries, data=data, headers=headers, timeout=20)
+        if not _csrf_rejected(r):
+            break
+        if attempt:
+            raise SessionExpired(f"{path}: rejected again after token refresh ({r.status_code})")
+        logger.info("%s: XSRF token rejected (%s), refreshing and replaying", path, r.status_code)
+        _refresh_token(session, xsrf)
     r.raise_for_status()
     return r.json()
 
-def init_session(seed_cookies: Optional[Dict[str, str]] = None) -> requests.Session:
+def init_session(seed_cookies: Optional[Dict[str, str]] = None, lazy: Optional[bool] = None,
+                 pool_maxsize: Optional[int] = None) -> requests.Session:
+    """
+    With lazy=True (default: config.RP_LAZY_SESSION) and seed cookies that carry an
+    XSRF token, skip the warm-up GETs; _post refreshes the token if the server rejects it.
+    pool_maxsize defaults to room for a whole fan-out scan on one session's keep-alive pool.
+    """
+    lazy = config.RP_LAZY_SESSION if lazy is None else lazy
     s = requests.Session()
-    s.get(f"{config.RP_BASE}/{config.RP_LANG}", headers=HEADERS_BASE, timeout=20)
-    s.get(f"{config.RP_BASE}/{config.RP_LANG}/hqb", headers=HEADERS_BASE, timeout=20)
+    pool_maxsize = pool_maxsize or max(10, config.SCAN_CONCURRENCY)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    if not (lazy and seed_cookies and seed_cookies.get("XSRF-TOKEN")):
+        _warm_up(s)
     if seed_cookies:
         for k, v in seed_cookies.items():
-            s.cookies.set(k, v, domain="roadpolice.am", secure=True)
-    _ = _read_xsrf_token(s)
+            s.cookies.set(k, v, domain=config.RP_COOKIE_DOMAIN, secure=config.RP_COOKIE_SECURE)
     return s
 
 def login(session: requests.Session, psn: str, phone: str, country: str = "374") -> Dict:
     payload = {"psn": psn, "phone_number": phone, "country": country}
-    return _post(session, "hqb-sw/login", payload)
+    return _post(session, "hqb-sw/login", payload, retries=0)  # each attempt sends an SMS
 
 def verify(session: requests.Session, token: str) -> Dict:
-    return _post(session, "hqb-sw/verify", {"token": token})
+    return _post(session, "hqb-sw/verify", {"token": token}, retries=0)
 
-def fetch_branches_and_services(session: requests.Session) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
-    url = f"{config.RP_BASE}/{config.RP_LANG}/hqb"
-    r = session.get(url, headers=HEADERS_BASE, timeout=20)
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "lxml")
+def parse_branches_and_services(html: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Returns (branches, services) where each is list of (id, label).
+    Parsed from the /hqb page <select name="branchId"> and <select name="serviceId">.
+    """
+    soup = BeautifulSoup(html, "lxml")
 
     def parse_select(name: str) -> List[Tuple[str, str]]:
         sel = soup.select_one(f'select[name="{name}"]')
-        items: List[Tuple[str, str]] = []
+        out: List[Tuple[str, str]] = []
         if sel:
             for opt in sel.find_all("option"):
                 val = (opt.get("value") or "").strip()
                 txt = (opt.text or "").strip()
                 if not val or not txt:
                     continue
-                items.append((val, txt))
-        return items
+                out.append((val, txt))
+        return out
 
     branches = parse_select("branchId")
     services = parse_select("serviceId")
     return branches, services
 
+def fetch_branches_and_services(session: requests.Session) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    url = f"{config.RP_BASE}/{config.RP_LANG}/hqb"
+    r = _request(session, "GET", url, headers=HEADERS_BASE, timeout=20)
+    r.raise_for_status()
+    return parse_branches_and_services(r.text)
+
+def fetch_catalog(session: requests.Session, etag: Optional[str] = None, last_modified: Optional[str] = None):
+    """
+    Conditional GET of /hqb. Returns (lists, etag, last_modified) where lists is
+    (branches, services), or None when the server answers 304 Not Modified.
+    """
+    headers = dict(HEADERS_BASE)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    url = f"{config.RP_BASE}/{config.RP_LANG}/hqb"
+    r = _request(session, "GET", url, headers=headers, timeout=20)
+    if r.status_code == 304:
+        return None, etag, last_modified
+    r.raise_for_status()
+    return parse_branches_and_services(r.text), r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "priority")
+
+    def __init__(self, priority: int):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.priority = priority
+
+_FLIGHTS: Dict[Tuple, _Flight] = {}
+_FLIGHTS_LOCK = threading.Lock()
+
+def _copy_error(e: BaseException) -> BaseException:
+    try:
+        return copy.copy(e)
+    except Exception:
+        return e
+
+def _shared_post(session: requests.Session, path: str, data: Dict[str, str]) -> Dict:
+    """
+    Single-flight _post for availability reads: concurrent identical requests (same
+    path and form data, whatever the session) share one upstream call and all get
+    a copy of its result, or of its exception. A caller whose priority is higher than
+    the leader's waits at most RP_SHARED_WAIT_SECONDS, then makes its own request.
+    """
+    key = (path, tuple(sorted(data.items())))
+    level = governor.current()
+    with _FLIGHTS_LOCK:
+        flight = _FLIGHTS.get(key)
+        leader = flight is None
+        if leader:
+            flight = _FLIGHTS[key] = _Flight(level)
+    if not leader:
+        metrics.UPSTREAM_SHARED.inc(endpoint=_endpoint(f"{config.RP_BASE}/{config.RP_LANG}/{path}"))
+        timeout = config.RP_SHARED_WAIT_SECONDS if level < flight.priority else None
+        if not flight.done.wait(timeout):
+            logger.info("%s: shared read still queued behind lower priority, going alone", path)
+            return _post(session, path, data)
+        if flight.error is not None:
+            raise _copy_error(flight.error)
+        return copy.deepcopy(flight.result)
+    try:
+        flight.result = _post(session, path, data)
+        return copy.deepcopy(flight.result)
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _FLIGHTS_LOCK:
+            del _FLIGHTS[key]
+        flight.done.set()
+
 def nearest_day(session: requests.Session, branch_id: str, service_id: str, from_date_dd_mm_yyyy: str) -> Dict:
-    return _post(session, "hqb-nearest-day", {
+    return _shared_post(session, "hqb-nearest-day", {
         "branchId": branch_id, "serviceId": service_id, "date": from_date_dd_mm_yyyy
     })
 
 def slots_for_day(session: requests.Session, branch_id: str, service_id: str, date_dd_mm_yyyy: str) -> List[Dict]:
-    resp = _post(session, "hqb-slots-for-day", {
+    resp = _shared_post(session, "hqb-slots-for-day", {
         "branchId": branch_id, "serviceId": service_id, "date": date_dd_mm_yyyy
     })
     return resp.get("data") or []
 
 def register_slot(session: requests.Session, branch_id: str, service_id: str,
                   date_dd_mm_yyyy: str, slot_time: str, email: str) -> Dict:
+    # never retried: a lost response may still have booked the slot
     return _post(session, "hqb-register", {
         "branchId": branch_id, "serviceId": service_id,
         "date": date_dd_mm_yyyy, "slotTime": slot_time, "email": email
-    })
+    }, retries=0)
+
+def fan_out(fetch: Callable[[str], T], dates: Iterable[str],
+            concurrency: Optional[int] = None, deadline: Optional[float] = None,
+            on_result: Optional[Callable[[str, T], None]] = None) -> List[Tuple[str, T]]:
+    """
+    Run fetch(date) for many days at once with at most `concurrency` requests in flight.
+    Returns (date, result) in input order for the days that finished within `deadline`
+    seconds; days that failed or ran out of time are logged and left out.
+    on_result(date, result) is called from the caller's thread as each day completes.
+    """
+    dates = list(dates)
+    if not dates:
+        return []
+    concurrency = concurrency or config.SCAN_CONCURRENCY
+    deadline = config.SCAN_DEADLINE_SECONDS if deadline is None else deadline
+    results: Dict[str, T] = {}
+    pool = ThreadPoolExecutor(max_workers=min(concurrency, len(dates)), thread_name_prefix="scan")
+    try:
+        # each worker inherits the caller's context, i.e. its governor priority
+        pending = {pool.submit(contextvars.copy_context().run, fetch, d): d for d in dates}
+        end = time.monotonic() + deadline
+        while pending:
+            left = end - time.monotonic()
+            if left <= 0:
+                break
+            done, _ = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for fut in done:
+                d = pending.pop(fut)
+                try:
+                    results[d] = fut.result()
+                except Exception:
+                    logger.warning("scan: day %s failed", d, exc_info=True)
+                    continue
+                if on_result is not None:
+                    try:
+                        on_result(d, results[d])
+                    except Exception:
+                        logger.exception("scan: progress callback failed")
+        if pending:
+            logger.warning("scan: deadline %.0fs hit, %d/%d days missing", deadline, len(pending), len(dates))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return [(d, results[d]) for d in dates if d in results]
@@ -0,0 +1,206 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+import requests
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+def _pooled_sockets(sess: requests.Session) -> int:
+    """Idle keep-alive connections held by the session's adapters."""
+    n = 0
+    for adapter in set(sess.adapters.values()):
+        pm = getattr(adapter, "poolmanager", None)
+        if pm is None:
+            continue
+        for key in list(pm.pools.keys()):
+            pool = pm.pools.get(key)
+            if pool is not None and pool.pool is not None:
+                n += pool.pool.qsize()
+    return n
+
+def _close_pools(sess: requests.Session):
+    for adapter in set(sess.adapters.values()):
+        pm = getattr(adapter, "poolmanager", None)
+        if pm is not None:
+            pm.clear()
+
+class SessionManager:
+    """
+    Per-chat upstream sessions with LRU eviction, an idle timeout and a cap on
+    pooled sockets, enforced on every get() and sweep(). Evicted sessions write their cookies back to the database,
+    so the next get() rebuilds them transparently.
+    """
+
+    def __init__(self, factory: Callable[[Hashable], Any],
+                 max_sessions: int = config.SESSION_MAX,
+                 idle_seconds: float = config.SESSION_IDLE_SECONDS,
+                 max_sockets: int = config.SESSION_MAX_SOCKETS):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_sockets = max_sockets
+        self._sess: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+
+    def get(self, chat_id: Hashable):
+        with self._lock:
+            item = self._sess.get(chat_id)
+            if item:
+                self._sess[chat_id] = (item[0], time.monotonic())
+                self._sess.move_to_end(chat_id)
+        if item:
+            self._trim_sockets(keep=item[0])
+            return item[0]
+        # build outside the lock: warm-up does network I/O
+        sess = self.factory(chat_id)
+        with self._lock:
+            item = self._sess.get(chat_id)
+            if item:  # another thread won the race
+                victims = [(None, sess)]
+                sess = item[0]
+            else:
+                self._sess[chat_id] = (sess, time.monotonic())
+                self.created += 1
+                victims = self._over_limit()
+        self._evict(victims)
+        self._trim_sockets(keep=sess)
+        return sess
+
+    def __contains__(self, chat_id: Hashable) -> bool:
+        with self._lock:
+            return chat_id in self._sess
+
+    def drop(self, chat_id: Hashable):
+        with self._lock:
+            item = self._sess.pop(chat_id, None)
+        if item:
+            self._evict([(chat_id, item[0])])
+
+    def _over_limit(self) -> List[Tuple[Hashable, Any]]:
+        victims = []
+        while len(self._sess) > self.max_sessions:
+            chat_id, (sess, _) = self._sess.popitem(last=False)
+            victims.append((chat_id, sess))
+        return victims
+
+    def _evict(self, victims: List[Tuple[Hashable, Any]]):
+        for chat_id, sess in victims:
+            if chat_id is not None:
+                self.evicted += 1
+                try:
+                    db.save_cookies(chat_id, sess.cookies.get_dict())
+                except Exception:
+                    logger.exception("session evict: saving cookies failed for %s", chat_id)
+                # a handler may still be mid-request on it; dropping our reference
+                # lets GC close the sockets once that caller is done
+                continue
+            try:
+                sess.close()  # lost a build race, never handed out
+            except Exception:
+                pass
+
+    def sweep(self):
+        """Evict idle sessions, then trim pooled sockets of the least recently used ones."""
+        now = time.monotonic()
+        with self._lock:
+            victims = [(cid, s) for cid, (s, used) in self._sess.items() if now - used > self.idle_seconds]
+            for cid, _ in victims:
+                del self._sess[cid]
+            victims += self._over_limit()
+        self._evict(victims)
+        self._trim_sockets()
+
+    def _trim_sockets(self, keep: Any = None):
+        """Close the pooled sockets of the least recently used sessions (not `keep`) until under max_sockets."""
+        with self._lock:
+            lru = [s for s, _ in self._sess.values()]
+        total = sum(_pooled_sockets(s) for s in lru)
+        for s in lru:
+            if total <= self.max_sockets:
+                break
+            if s is keep:
+                continue
+            n = _pooled_sockets(s)
+            if n:
+                _close_pools(s)  # keeps cookies, drops keep-alive sockets
+                total -= n
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            live = [s for s, _ in self._sess.values()]
+            created, evicted = self.created, self.evicted
+        return {
+            "live": len(live),
+            "pooled_sockets": sum(_pooled_sockets(s) for s in live),
+            "cookies": sum(len(s.cookies) for s in live),
+            "created": created,
+            "evicted": evicted,
+        }
+
+    def sweep_job(self, context=None):
+        try:
+            self.sweep()
+            logger.info("sessions: %s", self.stats())
+        except Exception:
+            logger.exception("session sweep error")
+
+class AnonymousPool:
+    """
+    A few anonymous (not logged-in) upstream sessions shared by every availability
+    read. Callers rotate through them round-robin; each is warmed once on first use
+    and rebuilt after `max_age` seconds or when retired.
+    """
+
+    def __init__(self, factory: Callable[[], Any],
+                 size: int = config.ANON_SESSIONS,
+                 max_age: float = config.ANON_SESSION_MAX_AGE_SECONDS):
+        self.factory = factory
+        self.max_age = max_age
+        self._slots = [[None, 0.0, threading.Lock()] for _ in range(max(1, size))]  # [session, born, lock]
+        self._next = itertools.count()
+        self.created = 0
+        self.retired = 0
+
+    def get(self):
+        slot = self._slots[next(self._next) % len(self._slots)]
+        sess, born, lock = slot
+        if sess is not None and time.monotonic() - born < self.max_age:
+            return sess
+        with lock:  # one warm-up per slot; the other slots stay usable meanwhile
+            if slot[0] is None or time.monotonic() - slot[1] >= self.max_age:
+                old = slot[0]
+                slot[0] = self.factory()
+                slot[1] = time.monotonic()
+                self.created += 1
+                if old is not None:
+                    try:
+                        old.close()  # a request still running on it finishes; only idle sockets go
+                    except Exception:
+                        pass
+            return slot[0]
+
+    def retire(self, sess):
+        """Drop a session that misbehaved; its slot is rebuilt on the next get()."""
+        for slot in self._slots:
+            if slot[0] is sess:
+                slot[0] = None
+                self.retired += 1
+
+    def stats(self) -> Dict[str, int]:
+        live = [slot[0] for slot in self._slots if slot[0] is not None]
+        return {
+            "size": len(self._slots),
+            "live": len(live),
+            "pooled_sockets": sum(_pooled_sockets(s) for s in live),
+            "created": self.created,
+            "retired": self.retired,
+        }
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+# config reads the environment on import: keep the tests off any real Supabase and
+# out of the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_TMP = tempfile.mkdtemp(prefix="rodar-tests-")
+os.environ["SUPABASE_URL"] = ""
+os.environ["SUPABASE_KEY"] = ""
+os.environ["TRACKER_DB_PATH"] = os.path.join(_TMP, "trackers.db")
+os.environ["CATALOG_PATH"] = os.path.join(_TMP, "catalog.json")
+
+class Clock:
+    """Stands in for the `time` module of the code under test."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
@@ -0,0 +1,222 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import availability as av
+import governor
+import resilience
+import scraper
+from cache import TTLCache
+
+SESSION = object()  # a caller's session: keeps reads off the anonymous pool
+
+def slots(*times):
+    return [{"label": t, "value": t} for t in times]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Empty caches and index over a fake site; returns (open days, fetched dates)."""
+    monkeypatch.setattr(av, "_SLOTS", TTLCache(300, 1000))
+    monkeypatch.setattr(av, "_NEAREST", TTLCache(300, 1000))
+    monkeypatch.setattr(av, "_INDEX", {})
+    monkeypatch.setattr(av, "_SEEN", {})
+    monkeypatch.setattr(av, "_SNAPSHOT", {"version": 0, "taken_at": 0.0, "targets": {}})
+    site, fetched = {}, []
+
+    def slots_for_day(sess, b, s, d):
+        fetched.append(d)
+        return site.get(d, [])
+
+    def nearest_day(sess, b, s, start):
+        fetched.append("nearest " + start)
+        begin = datetime.strptime(start, "%d-%m-%Y").date()
+        for d in sorted(site, key=lambda d: datetime.strptime(d, "%d-%m-%Y").date()):
+            if site[d] and datetime.strptime(d, "%d-%m-%Y").date() >= begin:
+                return {"status": "OK", "data": {"day": d, "slots": site[d]}}
+        return {"status": "OK", "data": {}}
+
+    monkeypatch.setattr(scraper, "slots_for_day", slots_for_day)
+    monkeypatch.setattr(scraper, "nearest_day", nearest_day)
+    return site, fetched
+
+@pytest.fixture
+def feed(monkeypatch):
+    """A fresh change feed with one subscriber; returns a function that drains it."""
+    monkeypatch.setattr(av, "_SEEN", {})
+    monkeypatch.setattr(av, "_SUBSCRIBERS", [])
+    events = []
+    av.subscribe(events.append)
+
+    def drain():
+        av._EVENTS.join()
+        out = list(events)
+        events.clear()
+        return [(e.kind, e.date, set(e.times)) for e in out]
+
+    return drain
+
+DATES = ["07-01-2030", "08-01-2030", "09-01-2030", "14-01-2030"]  # Mon, Tue, Wed, Mon
+
+def test_day_counts_lists_open_days_in_order(upstream):
+    site, fetched = upstream
+    site.update({"14-01-2030": slots("09:00"), "07-01-2030": slots("09:00", "10:00")})
+    assert av.day_counts(SESSION, "b", "s", DATES) == [("07-01-2030", 2), ("14-01-2030", 1)]
+    assert av.day_counts(SESSION, "b", "s", DATES) == [("07-01-2030", 2), ("14-01-2030", 1)]
+    assert sorted(fetched) == sorted(DATES)  # second query answered from the index
+
+def test_days_at_time_matches_value_or_label(upstream):
+    site, _ = upstream
+    site.update({"07-01-2030": slots("09:00"), "08-01-2030": [{"label": "9:00", "value": "09:00"}],
+                 "09-01-2030": slots("10:00")})
+    assert av.days_at_time(SESSION, "b", "s", "09:00", DATES) == ["07-01-2030", "08-01-2030"]
+    assert av.days_at_time(SESSION, "b", "s", "9:00", DATES) == ["08-01-2030"]
+    assert av.days_at_time(SESSION, "b", "s", "11:00", DATES) == []
+
+def test_days_on_weekday_skips_empty_days(upstream):
+    site, _ = upstream
+    site.update({"14-01-2030": slots("09:00", "10:00"), "08-01-2030": slots("09:00")})
+    assert av.days_on_weekday(SESSION, "b", "s", 0, DATES) == [("14-01-2030", 2)]
+    assert av.days_on_weekday(SESSION, "b", "s", 1, DATES) == [("08-01-2030", 1)]
+
+def test_index_follows_changes_and_invalidation(upstream):
+    site, _ = upstream
+    site["07-01-2030"] = slots("09:00")
+    assert av.days_at_time(SESSION, "b", "s", "09:00", DATES) == ["07-01-2030"]
+    av._store("b", "s", "07-01-2030", slots("10:00"))  # re-fetched with other times
+    assert av.days_at_time(SESSION, "b", "s", "09:00", DATES) == []
+    site["07-01-2030"] = []
+    av.invalidate("b", "s", "07-01-2030")
+    assert av.day_counts(SESSION, "b", "s", DATES) == []
+
+def window(n):
+    first = date(2030, 1, 7)
+    return [(first + timedelta(days=i)).strftime("%d-%m-%Y") for i in range(n)]
+
+def test_discover_days_chains_and_settles_empty_days(upstream):
+    site, fetched = upstream
+    dates = window(10)
+    site.update({dates[2]: slots("09:00"), dates[6]: slots("10:00", "11:00")})
+    settled = {}
+    assert av.discover_days(SESSION, "b", "s", dates, settled=settled) == [(dates[2], site[dates[2]]),
+                                                                          (dates[6], site[dates[6]])]
+    assert fetched == ["nearest " + dates[0], "nearest " + dates[3], "nearest " + dates[7]]
+    assert settled == {d: site.get(d, []) for d in dates}
+    assert av.day_counts(SESSION, "b", "s", dates) == [(dates[2], 1), (dates[6], 2)]  # all cached
+    assert len(fetched) == 3
+
+def test_discover_days_stops_at_the_limit(upstream):
+    site, fetched = upstream
+    dates = window(10)
+    site.update({d: slots("09:00") for d in dates[1::2]})
+    found = av.discover_days(SESSION, "b", "s", dates, limit=2)
+    assert [d for d, _ in found] == dates[1:4:2]
+    assert len(fetched) == 2
+
+def test_broken_chain_falls_back_to_a_scan(upstream, monkeypatch):
+    site, fetched = upstream
+    dates = window(6)
+    site.update({dates[1]: slots("09:00"), dates[4]: slots("10:00")})
+    chain = scraper.nearest_day
+
+    def flaky(sess, b, s, start):
+        if start != dates[0]:
+            raise RuntimeError("upstream hiccup")
+        return chain(sess, b, s, start)
+
+    monkeypatch.setattr(scraper, "nearest_day", flaky)
+    settled = {}
+    found = av.discover_days(SESSION, "b", "s", dates, settled=settled)
+    assert [d for d, _ in found] == [dates[1], dates[4]]
+    assert sorted(d for d in fetched if not d.startswith("nearest")) == sorted(dates[2:])
+    assert set(settled) == set(dates)
+    fetched.clear()
+    av.invalidate("b", "s")
+    assert [d for d, _ in av.discover_days(SESSION, "b", "s", dates, fallback=False)] == [dates[1]]
+    assert all(d.startswith("nearest") for d in fetched)
+
+def test_capped_chain_switches_to_a_scan(upstream):
+    site, fetched = upstream
+    dates = window(10)
+    site.update({d: slots("09:00") for d in dates[::2]})
+    found = av.discover_days(SESSION, "b", "s", dates, chain_hits=2)
+    assert [d for d, _ in found] == dates[::2]
+    assert [d for d in fetched if d.startswith("nearest")] == ["nearest " + dates[0], "nearest " + dates[1]]
+    assert sorted(d for d in fetched if not d.startswith("nearest")) == sorted(dates[3:])
+
+def test_spent_deadline_returns_what_the_chain_found(upstream):
+    site, fetched = upstream
+    dates = window(10)
+    site.update({d: slots("09:00") for d in dates})
+    assert av.discover_days(SESSION, "b", "s", dates, deadline=0) == []
+    assert fetched == []
+
+def test_spent_budget_is_passed_to_the_caller(upstream, monkeypatch):
+    site, _ = upstream
+    dates = window(4)
+    site[dates[3]] = slots("09:00")
+    monkeypatch.setattr(scraper, "nearest_day", lambda *a: governor.charge())
+    with governor.budget(0), pytest.raises(governor.BudgetSpent):
+        av.discover_days(SESSION, "b", "s", dates)
+
+def test_first_observation_reports_all_free_times_as_opened(feed):
+    av._observe("b", "s", "01-01-2030", slots("09:00", "10:00"))
+    assert feed() == [(av.SLOT_OPENED, "01-01-2030", {"09:00", "10:00"})]
+
+def test_unchanged_day_emits_nothing(feed):
+    av._observe("b", "s", "01-01-2030", slots("09:00"))
+    feed()
+    av._observe("b", "s", "01-01-2030", slots("09:00"))
+    assert feed() == []
+
+def test_changes_are_split_into_opened_and_taken(feed):
+    av._observe("b", "s", "01-01-2030", slots("09:00", "10:00"))
+    feed()
+    av._observe("b", "s", "01-01-2030", slots("10:00", "11:00"))
+    assert feed() == [(av.SLOT_OPENED, "01-01-2030", {"11:00"}),
+                      (av.SLOT_TAKEN, "01-01-2030", {"09:00"})]
+
+def test_day_emptied_carries_the_times_that_were_free(feed):
+    av._observe("b", "s", "01-01-2030", slots("09:00"))
+    feed()
+    av._observe("b", "s", "01-01-2030", [])
+    assert feed() == [(av.SLOT_TAKEN, "01-01-2030", {"09:00"}),
+                      (av.DAY_EMPTIED, "01-01-2030", {"09:00"})]
+
+def test_days_and_targets_are_diffed_independently(feed):
+    av._observe("b", "s", "01-01-2030", slots("09:00"))
+    av._observe("b", "s", "02-01-2030", slots("09:00"))
+    av._observe("b", "other", "01-01-2030", slots("09:00"))
+    assert len(feed()) == 3
+
+def test_times_use_the_same_keys_as_the_index():
+    sl = [{"label": "9:00", "value": "09:00"}]
+    idx = av._TargetIndex()
+    idx.put("01-01-2030", sl)
+    assert av._slot_times(sl) == idx.days["01-01-2030"][1] == {"9:00", "09:00"}
+
+def test_reads_served_from_the_snapshot_are_not_replayed_as_changes(upstream, feed):
+    av.publish("b", "s", {"07-01-2030": slots("09:00")})
+    assert feed() == [(av.SLOT_OPENED, "07-01-2030", {"09:00"})]
+    av._observe("b", "s", "07-01-2030", [])  # a newer fetch saw it taken
+    feed()
+    assert av.slots_for_day(SESSION, "b", "s", "07-01-2030") == slots("09:00")  # older snapshot copy
+    assert feed() == []
+
+def test_broken_anonymous_session_is_retired(monkeypatch):
+    retired = []
+    pooled = object()
+    monkeypatch.setattr(av.ANON_SESSIONS, "get", lambda: pooled)
+    monkeypatch.setattr(av.ANON_SESSIONS, "retire", retired.append)
+
+    def expired(sess, *args):
+        raise scraper.SessionExpired("rejected")
+
+    def down(sess, *args):
+        raise resilience.UpstreamUnavailable("open")
+
+    for fetch in (expired, down):
+        with pytest.raises(Exception):
+            av._read(fetch, None, "b")
+    with pytest.raises(scraper.SessionExpired):
+        av._read(expired, SESSION, "b")  # a caller's own session is never retired
+    assert retired == [pooled]
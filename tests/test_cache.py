@@ -0,0 +1,43 @@
+import cache
+from conftest import Clock
+
+def make(monkeypatch, ttl=10, max_entries=3):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return cache.TTLCache(ttl, max_entries), clock
+
+def test_entries_expire_after_ttl(monkeypatch):
+    c, clock = make(monkeypatch)
+    c.set("a", 1)
+    clock.advance(9.9)
+    assert c.get("a") == 1
+    clock.advance(0.2)
+    assert c.get("a") is None
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+def test_lookup_tells_cached_none_from_miss_and_serves_stale(monkeypatch):
+    c, clock = make(monkeypatch)
+    c.set("none", None)
+    assert c.lookup("none") == (True, None)
+    assert c.lookup("other") == (False, None)
+    clock.advance(11)
+    assert c.lookup("none") == (False, None)
+    assert c.lookup("none", stale=True) == (True, None)
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    c, _ = make(monkeypatch)
+    for k in "abc":
+        c.set(k, k)
+    c.get("a")  # a is now the most recent, b the least
+    c.set("d", "d")
+    assert c.lookup("b") == (False, None)
+    assert [c.get(k) for k in "acd"] == ["a", "c", "d"]
+
+def test_invalidate_and_pop(monkeypatch):
+    c, _ = make(monkeypatch)
+    c.set(("b", "s", "1"), 1)
+    c.set(("b", "s", "2"), 2)
+    c.set(("x", "s", "1"), 3)
+    assert c.invalidate(lambda k: k[0] == "b") == 2
+    c.pop(("x", "s", "1"))
+    assert c.stats()["entries"] == 0
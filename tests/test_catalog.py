@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import catalog
+import config
+import scraper
+from bench.fake_rp import FakeRP
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CATALOG_PATH", str(tmp_path / "catalog.json"))
+    monkeypatch.setattr(catalog, "_STATE", {"branches": [], "services": [], "etag": None,
+                                            "last_modified": None, "loaded_at": 0.0})
+    monkeypatch.setattr(catalog, "_SESSION", None)
+
+@pytest.fixture
+def rp(monkeypatch):
+    fake = FakeRP(latency=0, branches=3, services=2).start()
+    monkeypatch.setattr(config, "RP_BASE", fake.url)
+    yield fake
+    fake.stop()
+
+def test_unchanged_page_is_a_304(rp):
+    assert catalog.refresh() is True
+    assert catalog.refresh() is False
+    assert rp.stats()["/hy/hqb"] == 2
+    branches, services = catalog.get()
+    assert len(branches) == 3 and len(services) == 2
+    with open(config.CATALOG_PATH, encoding="utf-8") as f:
+        assert json.load(f)["etag"] == catalog._STATE["etag"]
+
+def test_empty_page_keeps_the_good_copy(rp, monkeypatch):
+    catalog.refresh()
+    good = catalog.get()
+    with open(config.CATALOG_PATH, encoding="utf-8") as f:
+        saved = f.read()
+    monkeypatch.setattr(scraper, "fetch_catalog", lambda *a: (([], []), '"broken"', None))
+    assert catalog.refresh() is False
+    assert catalog.get() == good
+    with open(config.CATALOG_PATH, encoding="utf-8") as f:
+        assert f.read() == saved
+
+def test_cold_start_reads_disk_before_upstream(monkeypatch):
+    with open(config.CATALOG_PATH, "w", encoding="utf-8") as f:
+        json.dump({"branches": [["1", "A"]], "services": [["2", "B"]], "etag": '"x"'}, f)
+
+    def down(*a):
+        raise AssertionError("upstream must not be hit")
+
+    monkeypatch.setattr(scraper, "fetch_catalog", down)
+    assert catalog.get() == ([("1", "A")], [("2", "B")])
+    assert catalog._STATE["etag"] == '"x"'
+
+def test_unreadable_disk_copy_falls_back_to_upstream(rp):
+    with open(config.CATALOG_PATH, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    branches, _ = catalog.get()
+    assert branches[0] == ("100", "Branch 1")
@@ -0,0 +1,24 @@
+import availability
+import catalog
+import crawler
+import governor
+
+def test_run_stops_at_the_budget_and_resumes_there(monkeypatch):
+    monkeypatch.setattr(catalog, "get", lambda: ([("b1", "B1"), ("b2", "B2")], [("s", "S")]))
+    crawled, published = [], []
+
+    def discover(session, b, s, dates, limit=None, fallback=True, settled=None):
+        assert governor.current() == governor.CRAWLER
+        for _ in range(3):
+            governor.charge()
+        crawled.append(b)
+        settled[dates[0]] = []
+
+    monkeypatch.setattr(availability, "discover_days", discover)
+    monkeypatch.setattr(availability, "publish", lambda b, s, days: published.append(b))
+    c = crawler.Crawler(budget=4)
+    c.run()
+    assert crawled == ["b1"] and published == ["b1"]  # b2 ran out of budget mid-way
+    assert c.last_run["requests"] == 4 and c.last_run["targets"] == 1
+    c.run()
+    assert crawled == ["b1", "b2"]  # picks up where the last run stopped
@@ -0,0 +1,84 @@
+import pytest
+
+import database as db
+from cache import TTLCache
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+class FakeSupabase:
+    """Just enough PostgREST for the users table: select by id and upsert."""
+
+    def __init__(self):
+        self.rows = {}
+        self.gets = 0
+        self.on_get = None
+
+    def get(self, url, params=None, headers=None):
+        self.gets += 1
+        key = params["tg_user_id"].split(".", 1)[1]
+        row = dict(self.rows[key]) if key in self.rows else None
+        if self.on_get is not None:
+            hook, self.on_get = self.on_get, None
+            hook()  # something else happens while this read is in flight
+        return Response(200, [row] if row else [])
+
+    def post(self, url, params=None, headers=None, json=None):
+        row = dict(self.rows.get(json["tg_user_id"], {}))
+        row.update(json)
+        self.rows[json["tg_user_id"]] = row
+        return Response(201, [dict(row)])
+
+@pytest.fixture
+def sb(monkeypatch):
+    fake = FakeSupabase()
+    monkeypatch.setattr(db, "_USE_SB", True)
+    monkeypatch.setattr(db, "_client", lambda: fake)
+    monkeypatch.setattr(db, "_USERS", TTLCache(300, 100))
+    monkeypatch.setattr(db, "_USER_GEN", {})
+    return fake
+
+def test_reads_are_cached_including_misses(sb):
+    assert db.get_user(1) is None
+    assert db.get_user(1) is None
+    sb.rows["2"] = {"tg_user_id": "2", "email": "a@b.c"}
+    assert db.get_user(2)["email"] == "a@b.c"
+    assert db.get_user(2)["email"] == "a@b.c"
+    assert sb.gets == 2
+
+def test_writes_go_through_to_the_cache(sb):
+    sb.rows["1"] = {"tg_user_id": "1", "verified": False}
+    assert db.get_verified(1) is False
+    db.set_verified(1, True)
+    assert db.get_verified(1) is True
+    assert sb.gets == 1  # served from the row the upsert returned
+
+def test_callers_get_copies(sb):
+    sb.rows["1"] = {"tg_user_id": "1", "email": "a@b.c"}
+    db.get_user(1)["email"] = "changed"
+    assert db.get_user(1)["email"] == "a@b.c"
+
+def test_read_overlapping_a_write_does_not_cache_the_old_row(sb):
+    sb.rows["1"] = {"tg_user_id": "1", "email": "old@x.y"}
+    sb.on_get = lambda: db.upsert_user_fields(1, email="new@x.y")
+    assert db.get_user(1)["email"] == "old@x.y"  # what that read saw
+    assert db.get_user(1)["email"] == "new@x.y"
+    assert sb.gets == 1
+
+def test_failed_write_drops_the_cached_row(sb, monkeypatch):
+    sb.rows["1"] = {"tg_user_id": "1", "email": "a@b.c"}
+    db.get_user(1)
+    monkeypatch.setattr(sb, "post", lambda *a, **k: Response(500, {"message": "down"}))
+    db.upsert_user_fields(1, email="new@x.y")
+    db.get_user(1)
+    assert sb.gets == 2
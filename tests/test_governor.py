@@ -0,0 +1,50 @@
+import threading
+import time
+
+import governor
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+def test_waiters_are_served_by_priority_then_fifo():
+    g = governor.Governor(rate=10000, burst=10000, max_concurrency=1)
+    order = []
+    g.acquire(governor.INTERACTIVE)  # hold the only slot while the others queue
+
+    def worker(name, level):
+        with g.slot(level):
+            order.append(name)
+
+    threads = []
+    for name, level in [("crawl", governor.CRAWLER), ("track-1", governor.TRACKER),
+                        ("user", governor.INTERACTIVE), ("track-2", governor.TRACKER)]:
+        t = threading.Thread(target=worker, args=(name, level))
+        t.start()
+        threads.append(t)
+        wait_for(lambda: g.stats()["queue_depth"] == len(threads))
+    g.release()
+    for t in threads:
+        t.join(5)
+    assert order == ["user", "track-1", "track-2", "crawl"]
+    assert g.stats()["inflight"] == 0
+
+def test_priority_context_sets_the_default_level():
+    assert governor.current() == governor.INTERACTIVE
+    with governor.priority(governor.CRAWLER):
+        assert governor.current() == governor.CRAWLER
+    assert governor.current() == governor.INTERACTIVE
+
+def test_budget_counts_requests_and_raises_when_spent():
+    governor.charge()  # no budget in scope: free
+    with governor.budget(2) as b:
+        governor.charge(); governor.charge()
+        try:
+            governor.charge()
+        except governor.BudgetSpent:
+            pass
+        else:
+            raise AssertionError("budget not enforced")
+    assert b.spent == 2
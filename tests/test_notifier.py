@@ -0,0 +1,58 @@
+import threading
+import time
+
+from telegram.error import RetryAfter, Unauthorized
+
+from notifier import Notifier
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = list(errors or [])  # raised by the first sends, in order
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append((chat_id, text, time.monotonic()))
+
+def _drain(n: Notifier, total: int, timeout: float = 5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        s = n.stats()
+        if s["sent"] + s["failed"] >= total:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"notifier still busy: {n.stats()}")
+
+def test_one_message_per_chat_per_interval_others_go_first():
+    bot, n = FakeBot(), Notifier(rate=1000, per_chat_seconds=0.2, workers=1)
+    for text in ("a1", "a2", "a3"):
+        n.send(1, text)
+    n.send(2, "b1")
+    n.start(bot)
+    _drain(n, 4)
+    assert [t for _, t, _ in bot.sent] == ["a1", "b1", "a2", "a3"]
+    times = [at for chat, _, at in bot.sent if chat == 1]
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+
+def test_retry_after_pauses_and_requeues_in_order():
+    bot, n = FakeBot(errors=[RetryAfter(0.3)]), Notifier(rate=1000, per_chat_seconds=0, workers=1)
+    started = time.monotonic()
+    n.send(1, "first")
+    n.send(1, "second")
+    n.start(bot)
+    _drain(n, 2)
+    assert [t for _, t, _ in bot.sent] == ["first", "second"]
+    assert bot.sent[0][2] - started >= 0.29  # nothing went out during the pause
+    assert n.stats() == {"queued": 0, "sent": 2, "failed": 0}
+
+def test_blocked_chat_is_dropped():
+    bot, n = FakeBot(errors=[Unauthorized("blocked")]), Notifier(rate=1000, per_chat_seconds=0, workers=1)
+    n.send(1, "gone")
+    n.send(2, "ok")
+    n.start(bot)
+    _drain(n, 2)
+    assert [t for _, t, _ in bot.sent] == ["ok"]
+    assert n.stats()["failed"] == 1
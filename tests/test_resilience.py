@@ -0,0 +1,48 @@
+import resilience
+from conftest import Clock
+
+def make(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return resilience.CircuitBreaker(failures=2, cooldown=10), clock
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    b, _ = make(monkeypatch)
+    b.failure()
+    assert b.state == "closed" and b.allow()
+    b.success()  # resets the streak
+    b.failure()
+    assert b.state == "closed"
+    b.failure()
+    assert b.state == "open" and not b.allow()
+    assert b.trips == 1
+
+def test_half_open_lets_one_trial_through(monkeypatch):
+    b, clock = make(monkeypatch)
+    b.failure(); b.failure()
+    clock.advance(10)
+    assert b.state == "half-open"
+    assert b.allow()
+    assert not b.allow()  # only one trial at a time
+    b.success()
+    assert b.state == "closed" and b.allow()
+
+def test_failed_trial_reopens_for_another_cooldown(monkeypatch):
+    b, clock = make(monkeypatch)
+    b.failure(); b.failure()
+    clock.advance(10)
+    assert b.allow()
+    b.failure()
+    assert b.state == "open" and b.trips == 2
+    clock.advance(9)
+    assert not b.allow()
+    clock.advance(1)
+    assert b.allow()
+
+def test_cancel_gives_the_trial_back(monkeypatch):
+    b, clock = make(monkeypatch)
+    b.failure(); b.failure()
+    clock.advance(10)
+    assert b.allow()
+    b.cancel()
+    assert b.allow()
@@ -0,0 +1,73 @@
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import config
+import governor
+import resilience
+import rp_async
+import scraper
+from bench.fake_rp import FakeRP
+
+@pytest.fixture
+def rp(monkeypatch):
+    fake = FakeRP(latency=0).start()
+    monkeypatch.setattr(config, "RP_BASE", fake.url)
+    monkeypatch.setattr(config, "RP_COOKIE_DOMAIN", "127.0.0.1")
+    monkeypatch.setattr(scraper, "BREAKER", resilience.CircuitBreaker())
+    monkeypatch.setattr(rp_async, "BREAKER", scraper.BREAKER)
+    yield fake
+    fake.stop()
+
+def _day() -> str:
+    return (date.today() + timedelta(days=1)).strftime("%d-%m-%Y")
+
+def test_reads_through_the_shared_client(rp):
+    session = rp_async.run(rp_async.init_session(), 10)
+    branches, services = rp_async.run(rp_async.fetch_branches_and_services(session), 10)
+    assert branches[0] == ("100", "Branch 1") and services
+    days = rp_async.run(rp_async.slots_for_days(session, "100", "300", [_day()]), 10)
+    assert [d for d, _ in days] == [_day()]
+
+def test_expired_token_is_refreshed_and_replayed(rp):
+    session = rp_async.run(rp_async.init_session(), 10)
+    rp.session_ttl = 0.5  # long enough for the refreshed token to outlive the replay
+    time.sleep(0.6)
+    rp.reset()
+    rp_async.run(rp_async.nearest_day(session, "100", "300", _day()), 10)
+    stats = rp.stats()
+    assert stats["/hy"] == 1  # one refresh GET
+    assert stats["/hy/hqb-nearest-day"] == 2  # rejected, then replayed
+
+def test_second_rejection_raises_session_expired(rp):
+    session = rp_async.run(rp_async.init_session(), 10)
+    rp.session_ttl = 0  # every token is stale on arrival
+    with pytest.raises(scraper.SessionExpired):
+        rp_async.run(rp_async.nearest_day(session, "100", "300", _day()), 10)
+
+def test_open_breaker_fails_fast(rp, monkeypatch):
+    monkeypatch.setattr(scraper.BREAKER, "allow", lambda: False)
+    with pytest.raises(resilience.UpstreamUnavailable):
+        rp_async.run(rp_async.init_session(), 10)
+    assert rp.stats() == {}
+
+def test_run_carries_the_callers_budget_and_priority(rp):
+    def crawler_requests() -> int:
+        return scraper.GOVERNOR.stats()["classes"].get("crawler", {}).get("requests", 0)
+
+    before = crawler_requests()
+    with governor.priority(governor.CRAWLER), governor.budget(2) as b:
+        session = rp_async.run(rp_async.init_session(), 10)  # home + hqb
+        with pytest.raises(governor.BudgetSpent):
+            rp_async.run(rp_async.nearest_day(session, "100", "300", _day()), 10)
+    assert b.spent == 2
+    assert crawler_requests() == before + 2
+
+def test_deadline_gives_governor_slots_back(rp):
+    session = rp_async.run(rp_async.init_session(), 10)
+    rp.latency = 0.3
+    days = rp_async.run(rp_async.slots_for_days(session, "100", "300", [_day()] * 3, deadline=0.05), 10)
+    assert days == []
+    time.sleep(0.1)
+    assert scraper.GOVERNOR.stats()["inflight"] == 0
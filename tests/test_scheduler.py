@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+import scheduler
+from conftest import Clock
+
+INTERVAL = 600.0
+
+class FakeStore:
+    def __init__(self):
+        self.due = []
+        self.subscribers = {}
+        self.rescheduled = {}
+
+    def due_targets(self, now):
+        out, self.due = self.due, []
+        return out
+
+    def set_target_due(self, b, s, ts):
+        self.rescheduled[(b, s)] = ts
+
+    def trackers_for_target(self, b, s):
+        return self.subscribers.get((b, s), [])
+
+@pytest.fixture
+def env(monkeypatch):
+    store, clock = FakeStore(), Clock(1_000_000.0)
+    monkeypatch.setattr(scheduler, "db", store)
+    monkeypatch.setattr(scheduler, "time", clock)
+    return store, clock
+
+def make(poll):
+    return scheduler.TrackerScheduler(poll, interval=INTERVAL, jitter=0.1, max_concurrency=1)
+
+def finish(sched):
+    sched._pool.shutdown(wait=True)
+
+def test_due_targets_are_polled_by_priority_and_rescheduled(env):
+    store, clock = env
+    polled = []
+    store.due = [(("b", "low"), clock.now - 5), (("b", "high"), clock.now - 5), (("b", "none"), clock.now)]
+    store.subscribers = {("b", "low"): [(1, {})], ("b", "high"): [(2, {"priority": 1}), (3, {})]}
+    sched = make(lambda bot, b, s, subs: polled.append(s))
+    sched.tick()
+    finish(sched)
+    assert polled == ["high", "low"]  # a target without subscribers is skipped
+    for target in [("b", "low"), ("b", "high"), ("b", "none")]:
+        assert INTERVAL * 0.9 - 5 <= store.rescheduled[target] - clock.now <= INTERVAL * 1.1
+    assert sched.stats()["polls"] == 2 and sched.stats()["overruns"] == 0
+
+def test_next_due_never_lands_in_the_past(env):
+    store, clock = env
+    sched = make(lambda *a: None)
+    assert sched._next(clock.now - 10 * INTERVAL, clock.now) == clock.now + INTERVAL
+
+def test_poll_finishing_past_its_interval_is_an_overrun(env):
+    store, clock = env
+    store.due = [(("b", "s"), clock.now)]
+    store.subscribers = {("b", "s"): [(1, {})]}
+    sched = make(lambda *a: clock.advance(INTERVAL + 1))
+    sched.tick()
+    finish(sched)
+    assert sched.stats()["overruns"] == 1
+
+def test_target_still_polling_is_skipped_and_counted(env):
+    store, clock = env
+    store.subscribers = {("b", "s"): [(1, {})]}
+    running, release = threading.Event(), threading.Event()
+    calls = []
+
+    def poll(*a):
+        calls.append(a)
+        running.set()
+        release.wait(5)
+
+    sched = make(poll)
+    store.due = [(("b", "s"), clock.now)]
+    sched.tick()
+    assert running.wait(5)
+    store.due = [(("b", "s"), clock.now)]
+    sched.tick()
+    release.set()
+    finish(sched)
+    assert len(calls) == 1
+    assert sched.stats()["overruns"] == 1
@@ -0,0 +1,241 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+import requests
+
+import config
+import governor
+import resilience
+import scraper
+from bench.fake_rp import FakeRP
+
+@pytest.fixture
+def rp(monkeypatch):
+    fake = FakeRP(latency=0).start()
+    monkeypatch.setattr(config, "RP_BASE", fake.url)
+    monkeypatch.setattr(config, "RP_COOKIE_DOMAIN", "127.0.0.1")
+    monkeypatch.setattr(config, "RP_COOKIE_SECURE", False)
+    monkeypatch.setattr(scraper, "BREAKER", resilience.CircuitBreaker())
+    yield fake
+    fake.stop()
+
+def _day() -> str:
+    return (date.today() + timedelta(days=1)).strftime("%d-%m-%Y")
+
+def _response(status: int, content_type: str = "application/json", location: str = None) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r.headers["Content-Type"] = content_type
+    if location is not None:
+        hop = requests.Response()
+        hop.status_code = 302
+        hop.headers["Location"] = location
+        r.history = [hop]
+    return r
+
+def test_csrf_rejected_spots_419_and_login_redirects():
+    assert scraper._csrf_rejected(_response(419))
+    assert scraper._csrf_rejected(_response(200, "text/html", location="https://x/hy/hqb-sw/login"))
+    assert scraper._csrf_rejected(_response(200, "text/html", location="https://x/hy"))  # html where json was due
+    assert not scraper._csrf_rejected(_response(200))
+    assert not scraper._csrf_rejected(_response(200, location="https://x/hy/hqb"))
+    assert not scraper._csrf_rejected(_response(422))
+
+def test_expired_token_is_refreshed_and_replayed(rp):
+    sess = scraper.init_session()
+    rp.session_ttl = 0.5  # long enough for the refreshed token to outlive the replay
+    time.sleep(0.6)
+    rp.reset()
+    scraper._post(sess, "hqb-nearest-day", {"branchId": "100", "serviceId": "300", "date": _day()})
+    stats = rp.stats()
+    assert stats["/hy"] == 1  # one refresh GET
+    assert stats["/hy/hqb-nearest-day"] == 2  # rejected, then replayed
+
+def test_lazy_session_with_stale_seed_refreshes_on_first_post(rp):
+    sess = scraper.init_session(seed_cookies={"XSRF-TOKEN": "stale", "laravel_session": "gone"}, lazy=True)
+    assert rp.stats() == {}  # no warm-up
+    scraper.verify(sess, "1234")
+    assert rp.stats() == {"/hy/hqb-sw/verify": 2, "/hy": 1}
+
+def test_second_rejection_raises_session_expired(rp):
+    sess = scraper.init_session()
+    rp.session_ttl = 0  # every token is stale on arrival
+    rp.reset()
+    with pytest.raises(scraper.SessionExpired):
+        scraper.register_slot(sess, "100", "300", _day(), "10:00", "a@b.c")
+    assert rp.stats()["/hy/hqb-register"] == 2  # never more than one replay
+
+def test_fan_out_returns_partial_results_at_the_deadline():
+    release = threading.Event()
+    seen = []
+
+    def fetch(d):
+        if d == "slow":
+            release.wait(5)
+        if d == "bad":
+            raise RuntimeError("boom")
+        return d.upper()
+
+    try:
+        started = time.monotonic()
+        out = scraper.fan_out(fetch, ["a", "slow", "bad", "b"], concurrency=4, deadline=0.3,
+                              on_result=lambda d, r: seen.append(d))
+        assert time.monotonic() - started < 2
+    finally:
+        release.set()
+    assert out == [("a", "A"), ("b", "B")]  # input order; failed and late days left out
+    assert sorted(seen) == ["a", "b"]
+
+def test_fan_out_limits_requests_in_flight():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def fetch(d):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return d
+
+    out = scraper.fan_out(fetch, [str(i) for i in range(12)], concurrency=3)
+    assert [d for d, _ in out] == [str(i) for i in range(12)]
+    assert peak[0] <= 3
+
+def test_fan_out_workers_inherit_the_callers_priority():
+    with governor.priority(governor.CRAWLER):
+        out = scraper.fan_out(lambda d: governor.current(), ["x", "y"], concurrency=2)
+    assert dict(out) == {"x": governor.CRAWLER, "y": governor.CRAWLER}
+
+class _Shared:
+    """Counts joiners via the metrics hook so tests know when they are waiting."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.n = 0
+        self.lock = threading.Lock()
+        self.all_joined = threading.Event()
+
+    def inc(self, **labels):
+        with self.lock:
+            self.n += 1
+            if self.n == self.expected:
+                self.all_joined.set()
+
+def _run_flight(monkeypatch, post, joiners=2):
+    shared = _Shared(joiners)
+    monkeypatch.setattr(scraper.metrics, "UPSTREAM_SHARED", shared)
+    monkeypatch.setattr(scraper, "_post", post)
+    results = {}
+
+    def call(name):
+        try:
+            results[name] = scraper._shared_post(None, "hqb-slots-for-day", {"date": "01-01-2030"})
+        except Exception as e:
+            results[name] = e
+
+    leader = threading.Thread(target=call, args=("leader",))
+    leader.start()
+    post.started.wait(5)
+    threads = [threading.Thread(target=call, args=(f"j{i}",)) for i in range(joiners)]
+    for t in threads:
+        t.start()
+    assert shared.all_joined.wait(5)
+    post.release.set()
+    for t in [leader] + threads:
+        t.join(5)
+    return results
+
+class _Post:
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.calls = 0
+        self.started, self.release = threading.Event(), threading.Event()
+
+    def __call__(self, session, path, data, retries=None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def test_shared_post_makes_one_call_and_hands_out_copies(monkeypatch):
+    post = _Post(result={"data": [{"value": "09:00"}]})
+    results = _run_flight(monkeypatch, post)
+    assert post.calls == 1
+    assert all(r == {"data": [{"value": "09:00"}]} for r in results.values())
+    results["j0"]["data"].append("mine")
+    assert results["leader"]["data"] == [{"value": "09:00"}]
+    assert results["j1"]["data"] == [{"value": "09:00"}]
+    assert not scraper._FLIGHTS
+
+def test_shared_post_propagates_the_leaders_error_to_waiters(monkeypatch):
+    error = scraper.SessionExpired("rejected")
+    results = _run_flight(monkeypatch, _Post(error=error))
+    assert results["leader"] is error
+    for name in ("j0", "j1"):
+        assert isinstance(results[name], scraper.SessionExpired)
+        assert results[name] is not error and str(results[name]) == "rejected"
+    assert not scraper._FLIGHTS
+
+def test_higher_priority_joiner_stops_waiting_on_a_low_priority_flight(monkeypatch):
+    monkeypatch.setattr(scraper.config, "RP_SHARED_WAIT_SECONDS", 0.05)
+    leader_post = _Post(result={"who": "crawler"})
+    calls = []
+
+    def post(session, path, data, retries=None):
+        if governor.current() == governor.CRAWLER:
+            return leader_post(session, path, data)
+        calls.append(path)
+        return {"who": "user"}
+
+    monkeypatch.setattr(scraper, "_post", post)
+
+    def crawl():
+        with governor.priority(governor.CRAWLER):
+            scraper._shared_post(None, "hqb-nearest-day", {"date": "01-01-2030"})
+
+    t = threading.Thread(target=crawl)
+    t.start()
+    leader_post.started.wait(5)
+    try:
+        assert scraper._shared_post(None, "hqb-nearest-day", {"date": "01-01-2030"}) == {"who": "user"}
+        assert calls == ["hqb-nearest-day"]
+    finally:
+        leader_post.release.set()
+        t.join(5)
+
+def test_different_requests_do_not_share(monkeypatch):
+    monkeypatch.setattr(scraper, "_post", lambda s, path, data, retries=None: dict(data))
+    assert scraper._shared_post(None, "p", {"date": "1"}) == {"date": "1"}
+    assert scraper._shared_post(None, "p", {"date": "2"}) == {"date": "2"}
+
+class DownSession:
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        raise requests.ConnectionError("down")
+
+def test_request_counts_one_breaker_failure_after_retries(monkeypatch):
+    breaker = resilience.CircuitBreaker(failures=2, cooldown=60)
+    monkeypatch.setattr(scraper, "BREAKER", breaker)
+    monkeypatch.setattr(resilience, "backoff", lambda attempt: 0)
+    sess = DownSession()
+    with pytest.raises(requests.ConnectionError):
+        scraper._request(sess, "GET", "http://rp.test/hy", retries=2)
+    assert sess.calls == 3
+    assert breaker.stats()["consecutive_failures"] == 1
+
+def test_spent_budget_is_not_an_upstream_failure(monkeypatch):
+    breaker = resilience.CircuitBreaker(failures=1, cooldown=60)
+    monkeypatch.setattr(scraper, "BREAKER", breaker)
+    sess = DownSession()
+    with governor.budget(0), pytest.raises(governor.BudgetSpent):
+        scraper._request(sess, "GET", "http://rp.test/hy")
+    assert sess.calls == 0 and breaker.state == "closed"
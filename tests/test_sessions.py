@@ -0,0 +1,88 @@
+import itertools
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+import sessions
+from conftest import Clock
+
+class FakeSession:
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(FakeSession.ids)
+        self.closed = False
+        self.sockets = 0
+        self.adapters = {}
+        self.cookies = RequestsCookieJar()
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def saved(monkeypatch):
+    out = {}
+    monkeypatch.setattr(sessions.db, "save_cookies", lambda cid, cookies: out.setdefault(cid, cookies))
+    monkeypatch.setattr(sessions, "_pooled_sockets", lambda s: s.sockets)
+    monkeypatch.setattr(sessions, "_close_pools", lambda s: setattr(s, "sockets", 0))
+    return out
+
+def test_session_manager_evicts_least_recently_used(saved):
+    mgr = sessions.SessionManager(lambda cid: FakeSession(), max_sessions=2, idle_seconds=60, max_sockets=10)
+    a = mgr.get(1)
+    mgr.get(2)
+    assert mgr.get(1) is a
+    mgr.get(3)  # evicts 2
+    assert 2 not in mgr and 1 in mgr and 3 in mgr
+    assert list(saved) == [2]
+
+def test_get_trims_sockets_of_least_recently_used(saved):
+    mgr = sessions.SessionManager(lambda cid: FakeSession(), max_sessions=10, idle_seconds=60, max_sockets=4)
+    a, b, c = mgr.get(1), mgr.get(2), mgr.get(3)
+    a.sockets = b.sockets = c.sockets = 2
+    assert mgr.get(3) is c  # 6 pooled > 4: the LRU session (1) loses its sockets
+    assert (a.sockets, b.sockets, c.sockets) == (0, 2, 2)
+    b.sockets = c.sockets = 4
+    mgr.get(2)  # never trims the session it hands out
+    assert (a.sockets, b.sockets, c.sockets) == (0, 4, 0)
+    assert not a.closed and 1 in mgr  # cookies and session stay
+
+def test_sweep_evicts_idle_sessions(saved, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions, "time", clock)
+    mgr = sessions.SessionManager(lambda cid: FakeSession(), max_sessions=10, idle_seconds=60, max_sockets=10)
+    mgr.get(1)
+    clock.advance(30)
+    mgr.get(2)
+    clock.advance(31)
+    mgr.sweep()
+    assert 1 not in mgr and 2 in mgr
+    assert list(saved) == [1]
+
+def make(monkeypatch, size=2, max_age=100):
+    clock = Clock()
+    monkeypatch.setattr(sessions, "time", clock)
+    return sessions.AnonymousPool(FakeSession, size=size, max_age=max_age), clock
+
+def test_sessions_rotate_round_robin(monkeypatch):
+    pool, _ = make(monkeypatch)
+    got = [pool.get() for _ in range(4)]
+    assert got[0] is got[2] and got[1] is got[3] and got[0] is not got[1]
+    assert pool.stats()["created"] == 2 and pool.stats()["live"] == 2
+
+def test_expired_session_is_rebuilt_and_closed(monkeypatch):
+    pool, clock = make(monkeypatch, size=1)
+    first = pool.get()
+    clock.advance(99)
+    assert pool.get() is first
+    clock.advance(1)
+    second = pool.get()
+    assert second is not first and first.closed and not second.closed
+    assert pool.stats()["created"] == 2
+
+def test_retired_session_is_replaced_on_next_get(monkeypatch):
+    pool, _ = make(monkeypatch, size=1)
+    first = pool.get()
+    pool.retire(first)
+    assert pool.stats()["live"] == 0 and pool.stats()["retired"] == 1
+    assert pool.get() is not first
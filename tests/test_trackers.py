@@ -0,0 +1,73 @@
+import pytest
+
+import config
+import database as db
+from conftest import Clock
+
+def _restart(monkeypatch):
+    """Forget everything in memory, as a fresh process would."""
+    monkeypatch.setattr(db, "_MEM_TRACKERS", {})
+    monkeypatch.setattr(db, "_TR_LOADED", False)
+    monkeypatch.setattr(db, "_TR_RETRY_AT", 0.0)
+    monkeypatch.setattr(db, "_BY_TARGET", {})
+    monkeypatch.setattr(db, "_NEXT_DUE", {})
+    monkeypatch.setattr(db, "_DUE_HEAP", [])
+    monkeypatch.setattr(db, "_SQLITE", None)
+
+@pytest.fixture
+def clock(monkeypatch, tmp_path):
+    monkeypatch.setattr(db, "_USE_SB", False)
+    monkeypatch.setattr(config, "TRACKER_DB_PATH", str(tmp_path / "trackers.db"))
+    _restart(monkeypatch)
+    clock = Clock(1_000_000.0)
+    monkeypatch.setattr(db, "time", clock)
+    return clock
+
+def test_trackers_survive_a_restart_in_sqlite(clock, monkeypatch):
+    db.set_tracker(1, "b", "s", "01-01-2030", priority=1)
+    db.set_tracker(2, "b", "s", None)
+    db.clear_tracker(2)
+    _restart(monkeypatch)
+    assert db.get_all_trackers() == {"1": {"branch_id": "b", "service_id": "s", "last_day": "01-01-2030", "priority": 1}}
+    assert db.trackers_for_target("b", "s") == [(1, db.get_tracker(1))]
+
+def test_due_targets_are_claimed_once_until_rescheduled(clock):
+    db.set_tracker(1, "b", "s1", None)
+    db.set_tracker(2, "b", "s1", None)
+    db.set_tracker(3, "b", "s2", None)
+    now = clock.now
+    assert sorted(t for t, _ in db.due_targets(now)) == [("b", "s1"), ("b", "s2")]
+    assert db.due_targets(now + 10) == []  # claimed
+    db.set_target_due("b", "s1", now + 60)
+    assert db.due_targets(now + 59) == []
+    assert db.due_targets(now + 60) == [(("b", "s1"), now + 60)]
+
+def test_cleared_target_is_not_due(clock):
+    db.set_tracker(1, "b", "s", None)
+    db.clear_tracker(1)
+    db.set_target_due("b", "s", clock.now)
+    assert db.due_targets(clock.now + 1) == []
+
+def test_failed_load_is_retried_and_merged_memory_first(clock, monkeypatch):
+    loads = []
+
+    def load():
+        loads.append(clock.now)
+        if len(loads) == 1:
+            raise RuntimeError("backend down")
+        return {"1": {"branch_id": "b", "service_id": "old", "last_day": None},
+                "2": {"branch_id": "b", "service_id": "s", "last_day": "02-02-2030"}}
+
+    monkeypatch.setattr(db, "_tr_backend_load", load)
+    db.set_tracker(1, "b", "new", None)  # load fails, memory keeps working
+    clock.advance(config.TRACKER_LOAD_RETRY_SECONDS - 1)
+    assert db.get_tracker(1)["service_id"] == "new" and len(loads) == 1
+    clock.advance(1)
+    trackers = db.get_all_trackers()
+    assert len(loads) == 2
+    assert trackers["1"]["service_id"] == "new"  # changed while the load was pending: memory wins
+    assert trackers["2"]["last_day"] == "02-02-2030"
+    assert db.trackers_for_target("b", "old") == []
+    # first polls are spread over one interval, not all due at once
+    due = [ts for _, ts in db.due_targets(clock.now + config.TRACK_INTERVAL_MINUTES * 60)]
+    assert len(due) == 2 and all(clock.now <= ts <= clock.now + config.TRACK_INTERVAL_MINUTES * 60 for ts in due)
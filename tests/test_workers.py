@@ -0,0 +1,50 @@
+import threading
+
+from telegram.ext import ConversationHandler
+
+import workers
+
+class Update:
+    def __init__(self, chat_id):
+        self.effective_chat = type("Chat", (), {"id": chat_id})()
+
+def offloaded(fn, pool):
+    return workers._offloaded(workers.long_running(fn), pool)
+
+def test_cancel_stops_a_running_step_at_its_checkpoint():
+    pool = workers.WorkerPool(max_workers=2)
+    started, go = threading.Event(), threading.Event()
+    booked = []
+
+    def confirm(update, context):
+        started.set()
+        go.wait(5)
+        workers.checkpoint()
+        booked.append(update.effective_chat.id)
+        return "next"
+
+    step = offloaded(confirm, pool)
+    mine, other = step(Update(1), None), step(Update(2), None)
+    assert started.wait(5)
+    workers.cancel(1)
+    go.set()
+    assert mine.result(5) == ConversationHandler.END
+    assert other.result(5) == "next"  # other chats are not affected
+    assert booked == [2]
+    assert step(Update(1), None).result(5) == "next"  # a step started after /cancel runs
+
+def test_step_cancelled_while_queued_never_starts():
+    pool = workers.WorkerPool(max_workers=1)
+    busy = threading.Event()
+    ran = []
+    blocker = offloaded(lambda u, c: busy.wait(5), pool)(Update(9), None)
+    queued = offloaded(lambda u, c: ran.append(1), pool)(Update(3), None)
+    workers.cancel(3)
+    busy.set()
+    blocker.result(5)
+    assert queued.result(5) == ConversationHandler.END and ran == []
+
+def test_checkpoint_outside_an_offloaded_step_is_a_no_op():
+    workers.cancel(4)
+    workers.checkpoint()
+    assert not workers.cancelled()
@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram.ext import ConversationHandler
+from telegram.ext.utils.promise import Promise
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class Cancelled(Exception):
+    """The chat sent /cancel while this offloaded step was running."""
+
+# /cancel bumps the chat's generation; a step started under an older one is stale
+_GENERATION: Dict[int, int] = {}
+_GENERATION_LOCK = threading.Lock()
+_STEP: contextvars.ContextVar = contextvars.ContextVar("rp_step", default=None)  # (chat_id, generation)
+
+def _generation(chat_id: int) -> int:
+    with _GENERATION_LOCK:
+        return _GENERATION.get(chat_id, 0)
+
+def cancel(chat_id: int):
+    """Stop the chat's offloaded step (if any) at its next checkpoint()."""
+    with _GENERATION_LOCK:
+        _GENERATION[chat_id] = _GENERATION.get(chat_id, 0) + 1
+
+def cancelled() -> bool:
+    """True if the chat cancelled the offloaded step running in this context."""
+    step: Optional[Tuple[int, int]] = _STEP.get()
+    return step is not None and _generation(step[0]) != step[1]
+
+def checkpoint():
+    """
+    Raise Cancelled if the chat cancelled the running step. Steps call it before
+    irreversible upstream calls (login, booking) and before touching CTX or replying.
+    """
+    if cancelled():
+        raise Cancelled()
+
+def long_running(fn: Callable) -> Callable:
+    """Mark a conversation callback that talks to upstream; offload() moves it to the pool."""
+    fn.rp_long_running = True
+    return fn
+
+class WorkerPool:
+    """
+    Dedicated executor for long conversation steps (scans, login, booking). The
+    callback returns a PTB Promise right away, so the dispatcher thread moves on;
+    ConversationHandler resolves the Promise into the next state when it is done
+    (messages arriving meanwhile go to the WAITING state).
+    """
+
+    def __init__(self, max_workers: int = config.HANDLER_WORKERS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="handler")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.completed = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Promise:
+        promise = Promise(fn, args, kwargs)
+        with self._lock:
+            self._queued += 1
+        self._pool.submit(self._run, promise)
+        return promise
+
+    def _run(self, promise: Promise):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            promise.run()
+            if promise.exception is not None:
+                logger.error("handler %s failed", promise.pooled_function.__name__, exc_info=promise.exception)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"workers": self.max_workers, "queue_depth": self._queued,
+                    "running": self._running, "completed": self.completed}
+
+POOL = WorkerPool()
+
+def offload(conv, pool: WorkerPool = POOL) -> None:
+    """Run the conversation's long_running callbacks on `pool` (call after metrics.instrument)."""
+    handlers = list(conv.entry_points) + list(conv.fallbacks)
+    for hs in conv.states.values():
+        handlers.extend(hs)
+    for h in handlers:
+        cb = h.callback
+        if getattr(cb, "rp_long_running", False) and not getattr(cb, "rp_offloaded", False):
+            h.callback = _offloaded(cb, pool)
+
+def _offloaded(cb: Callable, pool: WorkerPool) -> Callable:
+    def wrapper(update, context):
+        chat_id = update.effective_chat.id
+        generation = _generation(chat_id)
+
+        def step(update, context):
+            token = _STEP.set((chat_id, generation))
+            try:
+                checkpoint()  # cancelled while still queued
+                return cb(update, context)
+            except Cancelled:
+                logger.info("%s: cancelled by chat %s", cb.__name__, chat_id)
+                return ConversationHandler.END
+            finally:
+                _STEP.reset(token)
+
+        step.__name__ = cb.__name__
+        return pool.submit(step, update, context)
+    wrapper.__name__ = cb.__name__
+    wrapper.rp_offloaded = True
+    return wrapper